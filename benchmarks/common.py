@@ -0,0 +1,17 @@
+"""
+Helpers shared by the benchmarks.
+"""
+import subprocess
+
+# vocabulary of the synthetic texts
+WORDS = ['Router', 'Anschluss', 'Telefon', 'Internet', 'langsam', 'seit', 'gestern', 'kein', 'Signal', 'bitte',
+         'neu', 'starten', 'Speedport', 'Leitung', 'gestört', 'Techniker', 'Termin', 'Vertrag', 'Tarif', 'WLAN',
+         'und', 'die', 'der', 'das', 'ist', 'nicht', 'mit', 'ich', 'habe', 'auch']
+
+
+def get_commit():
+    # short hash of the checked out commit (stored with the results), None outside of a git repository
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,106 @@
+"""
+Benchmark for loading intents and answers into the mdswriter tables (st_docset, st_doc), with sqlite as stand-in
+for MySQL.
+
+The bulk path (helper.load_mdswriter: multi-row inserts, docset ids resolved in memory, one transaction) is compared
+with the previous one (executemany with a subquery on the unindexed topic column per answer). Both have to produce
+the same docsets and docs (the synthetic texts do not contain ").
+
+usage:
+    python -m benchmarks.mdswriter_benchmark
+    python -m benchmarks.mdswriter_benchmark -n 2000 -a 50 -o bench_mdswriter.jl
+"""
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import plac
+
+from benchmarks.common import WORDS, get_commit
+from questionscraper.spiders.helper import load_mdswriter, MDSWRITER_BATCH_ROWS
+
+SCHEMA = ['CREATE TABLE st_docset (id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT)',
+          'CREATE TABLE st_doc (id INTEGER PRIMARY KEY AUTOINCREMENT, docset_id INTEGER, doc_title TEXT, '
+          'doc_text TEXT)']
+
+
+def create_synthetic_input(nbr_intents, nbr_answers, seed=0):
+    """
+    :return: tuple (docsets, docs), see load_mdswriter
+    """
+    rnd = random.Random(seed)
+    topics = ['Intent %i: %s' % (i, ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 12))))
+              for i in range(nbr_intents)]
+    docs = []
+    for i in range(nbr_intents):
+        for k in range(nbr_answers):
+            text = '\n\n'.join(' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 60)))
+                               for _ in range(rnd.randint(1, 5)))
+            docs.append(('https://telekomhilft.telekom.de/t5/Board/m-p/%i#M%i' % (i, k), text, i))
+    return list(enumerate(topics)), docs
+
+
+def load_per_row(db, docsets, docs):
+    # the previous implementation of create_sql_inserts(insert=True)
+    topics = dict(docsets)
+    c = db.cursor()
+    c.executemany('INSERT INTO st_docset (topic) VALUES (?)', ((topic.replace('"', '\''),) for _, topic in docsets))
+    db.commit()
+    c.executemany('INSERT INTO st_doc(docset_id, doc_title, doc_text) SELECT id, ?, ? FROM st_docset WHERE topic = ?',
+                  ((title, text, topics[key]) for title, text, key in docs))
+    db.commit()
+    return len(docsets), c.execute('SELECT COUNT(*) FROM st_doc').fetchone()[0]
+
+
+def load_bulk(db, docsets, docs, batch_rows=MDSWRITER_BATCH_ROWS):
+    return load_mdswriter(db, docsets, docs, placeholder='?', batch_rows=batch_rows)
+
+
+def get_content(db):
+    return sorted(db.execute('SELECT topic, doc_title, doc_text FROM st_doc JOIN st_docset '
+                             'ON st_doc.docset_id = st_docset.id').fetchall())
+
+
+def benchmark(name, func, docsets, docs, directory):
+    path = os.path.join(directory, '%s.sqlite' % name)
+    db = sqlite3.connect(path)
+    for statement in SCHEMA:
+        db.execute(statement)
+    db.commit()
+    start = time.perf_counter()
+    nbr_docsets, nbr_docs = func(db, docsets, docs)
+    duration = time.perf_counter() - start
+    content = get_content(db)
+    db.close()
+    return content, nbr_docsets + nbr_docs, duration
+
+
+def main(nbr_intents: ('number of intents (docsets)', 'option', 'n', int) = 1000,
+         nbr_answers: ('number of answers (docs) per intent', 'option', 'a', int) = 50,
+         batch_rows: ('max number of rows per INSERT of the bulk path', 'option', 'b', int) = MDSWRITER_BATCH_ROWS,
+         out: ('append the results as json line to this file', 'option', 'o', str) = None):
+    docsets, docs = create_synthetic_input(nbr_intents, nbr_answers)
+    results = {}
+    contents = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, func in [('per_row', load_per_row),
+                           ('bulk', lambda db, t, d: load_bulk(db, t, d, batch_rows=batch_rows))]:
+            contents[name], nbr_rows, duration = benchmark(name, func, docsets, docs, directory)
+            results[name] = {'seconds': duration, 'rows': nbr_rows, 'rows_per_second': nbr_rows / duration}
+            print('%-8s %10.3f s %10i rows %14.1f rows/s' % (name, duration, nbr_rows, nbr_rows / duration))
+    speedup = results['per_row']['seconds'] / results['bulk']['seconds']
+    equal = contents['per_row'] == contents['bulk']
+    print('speedup: %.1fx, content equal: %s' % (speedup, equal))
+    if out is not None:
+        with open(out, 'a') as f:
+            f.write(json.dumps({'commit': get_commit(), 'nbr_intents': nbr_intents, 'nbr_answers': nbr_answers,
+                                'batch_rows': batch_rows, 'results': results, 'speedup': speedup,
+                                'content_equal': equal}) + '\n')
+    assert equal, 'the bulk load differs from the previous implementation'
+
+
+if __name__ == '__main__':
+    plac.call(main)
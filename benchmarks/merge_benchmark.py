@@ -0,0 +1,131 @@
+"""
+Benchmark for the questions branch of merge_answers_to_intents (helper.merge_questions) on synthetic input.
+
+Every intent links nbr_questions threads with nbr_answers answers each, a share of the answers is relevant. The current
+implementation is compared against the previous one (linear scan of relevant_answer_links per answer, fields built in
+separate passes), the outputs have to be equal.
+
+usage:
+    python -m benchmarks.merge_benchmark
+    python -m benchmarks.merge_benchmark -n 50 -q 20 -a 200 -r 3 -o bench_merge.jl
+"""
+import json
+import random
+import time
+
+import plac
+
+from benchmarks.common import WORDS, get_commit
+from questionscraper.spiders.helper import merge_questions, flatten, join_answers_marked, INTENT_ID, INTENT_TEXT
+
+
+def create_synthetic_input(nbr_intents, nbr_questions, nbr_answers, relevant_ratio, seed=0):
+    """
+    :return: tuple (intents, questions), questions is a dict of thread url to thread item
+    """
+    rnd = random.Random(seed)
+    intents = []
+    questions = {}
+    for i in range(nbr_intents):
+        links = []
+        relevant = []
+        for j in range(nbr_questions):
+            url = 'https://telekomhilft.telekom.de/t5/Board/Thread-%i-%i/td-p/%i' % (i, j, i * nbr_questions + j)
+            answers = []
+            for k in range(nbr_answers):
+                paragraphs = [' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 40)))
+                              for _ in range(rnd.randint(1, 4))]
+                if rnd.random() < 0.2:
+                    paragraphs.append('[LINK]{{https://www.telekom.de/hilfe}}{{Hilfe}}')
+                answer_url = '%s/m-p/%i#M%i' % (url.split('/td-p/')[0], i * 10 ** 6 + j * 10 ** 3 + k, k)
+                answers.append({'url': answer_url, 'content_cleaned': '\n\n'.join(paragraphs), 'has_quote': False,
+                                'solution_accepted_by': None})
+                if rnd.random() < relevant_ratio:
+                    relevant.append(answer_url)
+            questions[url] = {'url': url, 'title': 'Thread %i %i' % (i, j), 'answers': answers,
+                              'question': {'url': url.replace('/td-p/', '/m-p/')}}
+            links.append(url)
+        rnd.shuffle(relevant)
+        intents.append({INTENT_ID: 'I%05i' % i, INTENT_TEXT: 'intent %i' % i, 'links': links,
+                        'relevant_answer_links': relevant, 'original_relevant_answer_links': relevant[:10]})
+    return intents, questions
+
+
+def merge_questions_list_scan(intents, questions):
+    # the previous implementation of merge_questions (without sentence splitting), used as reference
+    for intent in intents:
+        # (questions in link order as in merge_questions, the previous implementation used set(intent['links']))
+        intent['questions'] = [questions[url] for url in dict.fromkeys(intent['links']) if url in questions]
+        for j, q in enumerate(intent['questions']):
+            intent['questions'][j]['nbr_answers'] = len(intent['questions'][j]['answers'])
+            intent['questions'][j]['nbr_answers_relevant'] = 0
+            for k, a in enumerate(q['answers']):
+                if a['url'] in intent.get('relevant_answer_links', []):
+                    intent['questions'][j]['answers'][k]['is_relevant'] = True
+                    intent['questions'][j]['nbr_answers_relevant'] += 1
+                else:
+                    intent['questions'][j]['answers'][k]['is_relevant'] = False
+        answers = flatten([[a for a in q['answers']] for q in intent['questions']])
+        answers_relevant = flatten([[a for a in q['answers'] if a['is_relevant']] for q in intent['questions']])
+        intent['answers_plain'] = '\n\n'.join([a['content_cleaned'] for a in answers])
+        intent['answers_plain_relevant'] = '\n\n'.join([a['content_cleaned'] for a in answers_relevant])
+        intent['answers_plain_marked'] = join_answers_marked(answers)
+        intent['answers_plain_marked_relevant'] = join_answers_marked(answers_relevant)
+        intent['nbr_answers'] = sum([q['nbr_answers'] for q in intent['questions']])
+        intent['nbr_answers_relevant'] = sum([q['nbr_answers_relevant'] for q in intent['questions']])
+        intent['nbr_words'] = len(intent['answers_plain'].split())
+        intent['nbr_words_relevant'] = len(intent['answers_plain_relevant'].split())
+        intent['nbr_original_relevant_answer_links'] = len(intent['original_relevant_answer_links'])
+        intent['nbr_questions'] = len(intent['questions'])
+        yield intent
+
+
+def benchmark(func, create_input, repeat):
+    # best of `repeat` runs, every run gets a fresh input (merge_questions modifies the questions)
+    best = None
+    output = None
+    for _ in range(repeat):
+        intents, questions = create_input()
+        start = time.perf_counter()
+        # the json round trip is not timed, but needed to keep the result of every intent (the questions are shared)
+        output = []
+        duration = 0.0
+        for intent in func(intents, questions):
+            duration += time.perf_counter() - start
+            output.append(json.dumps(intent, sort_keys=True))
+            start = time.perf_counter()
+        best = duration if best is None else min(best, duration)
+    return output, best
+
+
+def main(nbr_intents: ('number of intents', 'option', 'n', int) = 20,
+         nbr_questions: ('number of linked threads per intent', 'option', 'q', int) = 20,
+         nbr_answers: ('number of answers per thread', 'option', 'a', int) = 200,
+         relevant_ratio: ('share of relevant answers', 'option', 'l', float) = 0.1,
+         repeat: ('number of runs per implementation (the best one is reported)', 'option', 'r', int) = 3,
+         out: ('append the results as json line to this file', 'option', 'o', str) = None):
+    def create_input():
+        return create_synthetic_input(nbr_intents, nbr_questions, nbr_answers, relevant_ratio)
+
+    total_answers = nbr_intents * nbr_questions * nbr_answers
+    results = {}
+    outputs = {}
+    for name, func in [('list_scan', merge_questions_list_scan), ('merge_questions', merge_questions)]:
+        outputs[name], duration = benchmark(func, create_input, repeat)
+        results[name] = {'seconds': duration, 'intents_per_second': nbr_intents / duration,
+                         'answers_per_second': total_answers / duration}
+        print('%-16s %10.3f s %12.1f intents/s %14.1f answers/s'
+              % (name, duration, nbr_intents / duration, total_answers / duration))
+    speedup = results['list_scan']['seconds'] / results['merge_questions']['seconds']
+    equal = outputs['list_scan'] == outputs['merge_questions']
+    print('speedup: %.1fx, output equal: %s' % (speedup, equal))
+    if out is not None:
+        with open(out, 'a') as f:
+            f.write(json.dumps({'commit': get_commit(), 'nbr_intents': nbr_intents, 'nbr_questions': nbr_questions,
+                                'nbr_answers': nbr_answers, 'relevant_ratio': relevant_ratio, 'repeat': repeat,
+                                'results': results, 'speedup': speedup, 'output_equal': equal}) + '\n')
+    assert equal, 'output of merge_questions differs from the previous implementation'
+
+
+if __name__ == '__main__':
+    plac.call(main)
@@ -0,0 +1,272 @@
+"""
+Offline benchmark for the thread parser: parse_question, parse_answers, process_message_view and the post serializers.
+
+Every sub directory of the fixtures directory holds the saved pages of one thread (page_XX.html), a manifest.json that
+maps the page files to their urls and golden.json, the item QuestionsSpider yields for that thread. The benchmark checks
+the output of every function against golden.json and reports pages/s, posts/s and peak memory. The case
+reparse_answers checks that the offline re-parse (questionscraper.reparse) skips only the answers of a page that is
+missing in the raw html store, as the spider does.
+
+usage:
+    python -m benchmarks.parser_benchmark run
+    python -m benchmarks.parser_benchmark run -r 20 -s tree -o bench_parser.json
+    # after an intended change of the parser output:
+    python -m benchmarks.parser_benchmark update-golden
+    # save a new thread (follows the pager, needs network access):
+    python -m benchmarks.parser_benchmark record -u https://telekomhilft.telekom.de/t5/... -n my_thread
+"""
+import json
+import logging
+import os
+import time
+import tracemalloc
+import urllib.request
+
+import plac
+import scrapy
+from scrapy.http import HtmlResponse
+
+from benchmarks.common import get_commit
+from questionscraper.reparse import run_inline
+from questionscraper.spiders.questions_scraper import parse_question, parse_answers, process_message_view, \
+    parse_thread, get_answer_views, get_message_content, get_next_page_url, serialize_elem, serialize_elem_tree, \
+    iter_thread_answers, QuestionUrlCache, SERIALIZERS, SERIALIZER_XPATH
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+MANIFEST = 'manifest.json'
+GOLDEN = 'golden.json'
+
+
+def load_fixture(fixture_dir):
+    with open(os.path.join(fixture_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+    pages = []
+    for page in manifest['pages']:
+        with open(os.path.join(fixture_dir, page['file']), 'rb') as f:
+            pages.append((page['url'], f.read()))
+    return manifest, pages
+
+
+def create_responses(pages):
+    responses = [HtmlResponse(url=url, body=body, encoding='utf-8', request=scrapy.Request(url)) for url, body in pages]
+    # parse the html up front, so that the timings below contain only the work of the benchmarked functions
+    for response in responses:
+        response.selector
+    return responses
+
+
+def get_message_views(responses):
+    res = [(responses[0].css('.lia-thread-topic')[0], responses[0])]
+    for response in responses:
+        res.extend((message, response) for message in get_answer_views(response))
+    return res
+
+
+def serialized_as_posted(serialized):
+    # apply the post processing of process_message_view to (content, content_cleaned)
+    text, text_cleaned = serialized
+    return {'content': text.strip().replace('"', '\'\''),
+            'content_cleaned': text_cleaned.replace('  ', ' ').strip().replace('"', '\'\'')}
+
+
+def posts_as_serialized(posts):
+    return [{'content': p['content'], 'content_cleaned': p['content_cleaned']} for p in posts]
+
+
+def get_cases(serialize):
+    """
+    Returns the benchmark cases as tuples: (name, function(responses) -> output, function(golden) -> expected output,
+    function(responses) -> (nbr of pages, nbr of posts)).
+    """
+    def all_pages(responses):
+        return len(responses), 1 + sum(len(get_answer_views(r)) for r in responses)
+
+    def serialize_with(serialize_func):
+        def run(responses):
+            return [serialized_as_posted(serialize_func(get_message_content(message), response))
+                    for message, response in get_message_views(responses)]
+        return run
+
+    return [
+        ('parse_question',
+         lambda responses: parse_question(responses[0], serialize=serialize),
+         lambda golden: golden['question'],
+         lambda responses: (1, 1)),
+        ('parse_answers',
+         lambda responses: [a for r in responses for a in parse_answers(r, serialize=serialize)],
+         lambda golden: golden['answers'],
+         all_pages),
+        ('process_message_view',
+         lambda responses: [process_message_view(message, response, serialize=serialize)
+                            for message, response in get_message_views(responses)],
+         lambda golden: [golden['question']] + golden['answers'],
+         all_pages),
+        ('parse_thread',
+         lambda responses: parse_thread(responses, serialize=serialize),
+         lambda golden: golden,
+         all_pages),
+        ('serialize_elem',
+         serialize_with(serialize_elem),
+         lambda golden: posts_as_serialized([golden['question']] + golden['answers']),
+         all_pages),
+        ('serialize_elem_tree',
+         serialize_with(serialize_elem_tree),
+         lambda golden: posts_as_serialized([golden['question']] + golden['answers']),
+         all_pages),
+    ]
+
+
+def get_reparse_case(pages, serialize):
+    """
+    Returns the case reparse_answers (as get_cases): collect all answers of the thread with iter_thread_answers and
+    run_inline (as questionscraper.reparse does), but a page in the middle is missing in the raw html store. As in the
+    spider, only the answers of that page have to be skipped, i.e. the output are the golden answers without them.
+    """
+    responses = create_responses(pages)
+    page_answer_urls = [[a['url'] for a in parse_answers(r, serialize=serialize)] for r in responses]
+    answer_urls = [url for urls in page_answer_urls for url in urls]
+    missing = len(pages) // 2 if len(pages) > 1 else None
+    # the raw html store: answer url (and the pager link to the first page) -> page
+    store = {}
+    for i, (url, body) in enumerate(pages):
+        if i != missing:
+            store.update((answer_url, (url, body)) for answer_url in page_answer_urls[i])
+    for response in responses:
+        page_1_url = response.css('.lia-paging-page-first > a::attr(href)').extract_first()
+        if page_1_url is not None:
+            store[response.urljoin(page_1_url)] = pages[0]
+
+    def fetch(url):
+        if url not in store:
+            raise KeyError('not in raw html store: %s' % url)
+        page_url, body = store[url]
+        return HtmlResponse(url=page_url, body=body, encoding='utf-8', request=scrapy.Request(url))
+
+    def run(responses):
+        # the skipped answers are logged as errors, which is expected here
+        logging.disable(logging.ERROR)
+        try:
+            return run_inline(iter_thread_answers(fetch(answer_urls[0]), answer_urls, QuestionUrlCache(),
+                                                  serialize=serialize), fetch=fetch)
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def expected(golden):
+        skipped = set(page_answer_urls[missing]) if missing is not None else set()
+        return [dict(a, question_url=golden['question']['url']) for a in golden['answers'] if a['url'] not in skipped]
+
+    return ('reparse_answers', run, expected, lambda responses: (len(responses), len(answer_urls)))
+
+
+def benchmark_case(func, pages, repeat):
+    # best of `repeat` runs, every run gets fresh responses (but already parsed html)
+    best = None
+    output = None
+    for _ in range(repeat):
+        responses = create_responses(pages)
+        start = time.perf_counter()
+        output = func(responses)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    responses = create_responses(pages)
+    tracemalloc.start()
+    func(responses)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return output, best, peak
+
+
+def fixture_dirs(fixtures_dir, only=None):
+    names = sorted(n for n in os.listdir(fixtures_dir) if os.path.isfile(os.path.join(fixtures_dir, n, MANIFEST)))
+    if only is not None:
+        names = [n for n in names if n in only.split(',')]
+    return [os.path.join(fixtures_dir, n) for n in names]
+
+
+def write_golden(fixture_dir):
+    _, pages = load_fixture(fixture_dir)
+    item = parse_thread(create_responses(pages))
+    with open(os.path.join(fixture_dir, GOLDEN), 'w', encoding='utf-8') as f:
+        json.dump(item, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    logging.info('wrote %s (%i answers)' % (os.path.join(fixture_dir, GOLDEN), len(item['answers'])))
+
+
+def record(url, fixture_dir):
+    """
+    Download all pages of the thread at url (following the pager) and save them as fixture.
+    """
+    os.makedirs(fixture_dir, exist_ok=True)
+    manifest = {'url': url, 'pages': []}
+    while url is not None:
+        logging.info('fetch %s' % url)
+        req = urllib.request.Request(url, headers={'User-Agent': 'questionscraper-benchmark'})
+        with urllib.request.urlopen(req) as f:
+            body = f.read()
+        fn = 'page_%02i.html' % (len(manifest['pages']) + 1)
+        with open(os.path.join(fixture_dir, fn), 'wb') as f:
+            f.write(body)
+        manifest['pages'].append({'url': url, 'file': fn})
+        response = HtmlResponse(url=url, body=body, encoding='utf-8', request=scrapy.Request(url))
+        url = get_next_page_url(response)
+        if url is not None:
+            url = response.urljoin(url)
+    with open(os.path.join(fixture_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=4)
+    write_golden(fixture_dir)
+
+
+def run(fixtures_dir, repeat, serializer, only=None):
+    results = []
+    failed = []
+    print('%-16s %-22s %6s %6s %12s %12s %12s  %s' % ('fixture', 'function', 'pages', 'posts', 'pages/s', 'posts/s',
+                                                      'peak KiB', 'golden'))
+    for fixture_dir in fixture_dirs(fixtures_dir, only):
+        fixture = os.path.basename(fixture_dir)
+        _, pages = load_fixture(fixture_dir)
+        with open(os.path.join(fixture_dir, GOLDEN), encoding='utf-8') as f:
+            golden = json.load(f)
+        serialize = SERIALIZERS[serializer]
+        for name, func, expected, count in get_cases(serialize) + [get_reparse_case(pages, serialize)]:
+            output, duration, peak = benchmark_case(func, pages, repeat)
+            nbr_pages, nbr_posts = count(create_responses(pages))
+            # compare via json to ignore tuple / list differences
+            ok = json.loads(json.dumps(output)) == expected(golden)
+            if not ok:
+                failed.append('%s/%s' % (fixture, name))
+            print('%-16s %-22s %6i %6i %12.1f %12.1f %12.1f  %s' % (fixture, name, nbr_pages, nbr_posts,
+                                                                     nbr_pages / duration, nbr_posts / duration,
+                                                                     peak / 1024, 'OK' if ok else 'DIFFERS'))
+            results.append({'fixture': fixture, 'function': name, 'pages': nbr_pages, 'posts': nbr_posts,
+                            'seconds': duration, 'pages_per_second': nbr_pages / duration,
+                            'posts_per_second': nbr_posts / duration, 'peak_memory_bytes': peak, 'golden_ok': ok})
+    return results, failed
+
+
+def main(mode: ('what to do', 'positional', None, str, ['run', 'update-golden', 'record']),
+         fixtures_dir: ('directory containing the fixture threads', 'option', 'f') = FIXTURES_DIR,
+         repeat: ('number of runs per function (the best one is reported)', 'option', 'r', int) = 5,
+         serializer: ('serializer used by the parse_* functions', 'option', 's', str, list(SERIALIZERS)) = SERIALIZER_XPATH,
+         only: ('comma separated list of fixture names to use', 'option', 'n', str) = None,
+         url: ('thread url to record', 'option', 'u', str) = None,
+         out: ('append the results as json line to this file', 'option', 'o', str) = None):
+    logging.getLogger().setLevel(logging.INFO)
+    if mode == 'record':
+        assert url is not None and only is not None, 'please provide a thread url (-u) and a fixture name (-n)'
+        record(url, os.path.join(fixtures_dir, only))
+        return
+    if mode == 'update-golden':
+        for fixture_dir in fixture_dirs(fixtures_dir, only):
+            write_golden(fixture_dir)
+        return
+
+    results, failed = run(fixtures_dir, repeat, serializer, only)
+    if out is not None:
+        with open(out, 'a') as f:
+            f.write(json.dumps({'commit': get_commit(), 'serializer': serializer, 'repeat': repeat,
+                                'results': results}) + '\n')
+    assert len(failed) == 0, 'output differs from golden for: %s' % ', '.join(failed)
+
+
+if __name__ == '__main__':
+    plac.call(main)
@@ -0,0 +1,130 @@
+"""
+Benchmark for the sentence splitters of helper (SPLITTERS: CoreNLP server, spaCy, rule based) on the paragraphs of a
+scraped questions / answers file (content_cleaned, markup replaced by PLACEHOLDER as in mark_answers) or on synthetic
+German text.
+
+Reports paragraphs/s and sentences/s per splitter and how often the sentence boundaries agree with the first splitter
+(boundaries are compared as positions in the text without whitespace, i.e. independent of how each splitter
+reproduces the whitespace). Splitters that are not available (spaCy or its model not installed, CoreNLP server can
+not be started) are skipped.
+
+usage:
+    python -m benchmarks.splitter_benchmark -s rules,spacy
+    python -m benchmarks.splitter_benchmark -i questions/scraped.jl -n 20000 -s corenlp,spacy,rules -o bench_splitter.jl
+"""
+import json
+import random
+import time
+
+import plac
+
+from benchmarks.common import get_commit
+from questionscraper.spiders.helper import iter_jl, split_placeholders, create_splitter, SPLITTERS
+
+SENTENCES = ['Hallo zusammen, mein Router geht seit gestern nicht mehr.', 'Was kann ich tun?',
+             'Ich habe z.B. den Speedport neu gestartet, bzw. den Stecker gezogen.', 'Danke!',
+             'Seit dem 3. Mai ist die Leitung gestört...', 'Der Techniker kommt am Montag (hoffentlich!) vorbei.',
+             'Siehe Nr. 5 im Vertrag, ca. 30 Euro mtl. mehr.', 'Vielleicht liegt es am WLAN?',
+             'Schau mal hier PLACEHOLDER.', 'Gruß Frank', 'Das hat leider nicht geholfen.',
+             'Die Hotline meinte: "Das dauert noch." Super.', 'Am 3. Mai war ich da.', 'Es gibt ca. 10. Stück.',
+             'Der Laden in der Hauptstr. 5 hat den Router.', 'Der Termin ist am 24. Dezember um 8 Uhr.']
+
+
+def create_synthetic_paragraphs(nbr_paragraphs, seed=0):
+    rnd = random.Random(seed)
+    return [' '.join(rnd.choice(SENTENCES) for _ in range(rnd.randint(1, 6))) for _ in range(nbr_paragraphs)]
+
+
+def load_paragraphs(path, nbr_paragraphs):
+    res = []
+    for item in iter_jl(path):
+        # thread items (QuestionsSpider) or answers (AnswersSpider)
+        posts = [item['question']] + item['answers'] if 'answers' in item else [item]
+        for post in posts:
+            res.extend(split_placeholders(post['content_cleaned'])[2])
+            if len(res) >= nbr_paragraphs:
+                return res[:nbr_paragraphs]
+    return res
+
+
+def get_boundaries(paragraph_sentences):
+    # end positions of all sentences but the last, counted in non whitespace characters
+    res = set()
+    pos = 0
+    for sentence in paragraph_sentences[:-1]:
+        pos += len(''.join(sentence.split()))
+        res.add(pos)
+    return res
+
+
+def get_agreement(reference, sentences):
+    """
+    :return: dict with precision, recall and f1 of the boundaries (reference: first splitter) and the share of
+        paragraphs with identical boundaries
+    """
+    tp, nbr_ref, nbr_pred, equal = 0, 0, 0, 0
+    for ref, pred in zip(reference, sentences):
+        b_ref, b_pred = get_boundaries(ref), get_boundaries(pred)
+        tp += len(b_ref & b_pred)
+        nbr_ref += len(b_ref)
+        nbr_pred += len(b_pred)
+        equal += b_ref == b_pred
+    precision = tp / nbr_pred if nbr_pred else 1.0
+    recall = tp / nbr_ref if nbr_ref else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1, 'paragraphs_equal': equal / max(len(reference), 1)}
+
+
+def benchmark(splitter, paragraphs, repeat):
+    # best of `repeat` runs
+    best = None
+    sentences = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sentences = splitter.split(paragraphs)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return sentences, best
+
+
+def main(input_jsonl: ('scraped questions or answers (json lines), default: synthetic text', 'option', 'i', str) = None,
+         nbr_paragraphs: ('number of paragraphs', 'option', 'n', int) = 10000,
+         splitters: ('comma separated splitters, the first one is the reference for the agreement', 'option', 's',
+                     str) = ','.join(SPLITTERS),
+         repeat: ('number of runs per splitter (the best one is reported)', 'option', 'r', int) = 3,
+         out: ('append the results as json line to this file', 'option', 'o', str) = None):
+    if input_jsonl is not None:
+        paragraphs = load_paragraphs(input_jsonl, nbr_paragraphs)
+    else:
+        paragraphs = create_synthetic_paragraphs(nbr_paragraphs)
+    print('%i paragraphs' % len(paragraphs))
+    results = {}
+    reference = None
+    for name in splitters.split(','):
+        try:
+            splitter = create_splitter(name)
+        except Exception as e:
+            print('%-8s skipped: %s' % (name, e))
+            continue
+        try:
+            sentences, duration = benchmark(splitter, paragraphs, repeat)
+        finally:
+            splitter.close()
+        nbr_sentences = sum(len(s) for s in sentences)
+        if reference is None:
+            reference = (name, sentences)
+        agreement = get_agreement(reference[1], sentences)
+        results[name] = {'seconds': duration, 'paragraphs_per_second': len(paragraphs) / duration,
+                         'sentences_per_second': nbr_sentences / duration, 'nbr_sentences': nbr_sentences,
+                         'agreement_with': reference[0], 'agreement': agreement}
+        print('%-8s %10.3f s %12.1f paragraphs/s %12.1f sentences/s  boundary f1 vs %s: %.3f (equal paragraphs: %.3f)'
+              % (name, duration, len(paragraphs) / duration, nbr_sentences / duration, reference[0],
+                 agreement['f1'], agreement['paragraphs_equal']))
+    if out is not None:
+        with open(out, 'a') as f:
+            f.write(json.dumps({'commit': get_commit(), 'input': input_jsonl, 'nbr_paragraphs': len(paragraphs),
+                                'repeat': repeat, 'results': results}) + '\n')
+
+
+if __name__ == '__main__':
+    plac.call(main)
@@ -0,0 +1,96 @@
+"""
+Benchmark for the statistics of calc_stats_questions (questionscraper.stats.PostTable) on synthetic scraped threads.
+
+The loading into columns and the grouped reductions are timed separately and compared with the previous
+implementation (per thread counts with list comprehensions, summed up per intent link), the counts have to be equal.
+
+usage:
+    python -m benchmarks.stats_benchmark
+    python -m benchmarks.stats_benchmark -i 5000 -t 100000 -a 10 -o bench_stats.jl
+"""
+import json
+import random
+import time
+
+import plac
+
+from benchmarks.common import WORDS, get_commit
+from questionscraper.stats import PostTable
+
+
+def create_synthetic_input(nbr_intents, nbr_threads, nbr_answers, links_per_intent, seed=0):
+    """
+    :return: tuple (intents, threads), threads is a list of tuples (url, thread item) with 0 to 2 * nbr_answers
+        answers per thread
+    """
+    rnd = random.Random(seed)
+    authors = ['user%i' % i for i in range(1000)]
+    texts = [' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 80))) for _ in range(1000)]
+    threads = []
+    for t in range(nbr_threads):
+        asker = rnd.choice(authors)
+        answers = [{'author_name': rnd.choice(authors[:50] + [asker]), 'kudos': rnd.choice([0, 0, 0, 1, 2, 5]),
+                    'content_cleaned': rnd.choice(texts),
+                    'solution_accepted_by': 'user' if rnd.random() < 0.05 else None}
+                   for _ in range(rnd.randint(0, 2 * nbr_answers))]
+        threads.append(('https://telekomhilft.telekom.de/t5/Board/Thread-%i/td-p/%i' % (t, t),
+                        {'question': {'author_name': asker}, 'answers': answers}))
+    intents = [{'links': [rnd.choice(threads)[0] for _ in range(links_per_intent)]} for _ in range(nbr_intents)]
+    return intents, threads
+
+
+def stats_per_row(intents, threads):
+    # the previous implementation of calc_stats_questions
+    questions_dict = {}
+    for url, question in threads:
+        q_author_name = question['question']['author_name']
+        questions_dict[url] = {
+            'nbr_answers': len(question['answers']),
+            'nbr_solutions': len([True for a in question['answers'] if a['solution_accepted_by'] is not None]),
+            'nbr_answers_from_question_author': len([True for a in question['answers']
+                                                     if a['author_name'] == q_author_name])
+        }
+    res = []
+    for intent in intents:
+        intent_answers = [questions_dict[a_url] for a_url in intent['links'] if a_url in questions_dict]
+        res.append((sum([a['nbr_answers'] for a in intent_answers]), sum([a['nbr_solutions'] for a in intent_answers])))
+    return res
+
+
+def main(nbr_intents: ('number of intents', 'option', 'i', int) = 2000,
+         nbr_threads: ('number of threads', 'option', 't', int) = 50000,
+         nbr_answers: ('mean number of answers per thread', 'option', 'a', int) = 8,
+         links_per_intent: ('number of thread links per intent', 'option', 'l', int) = 20,
+         out: ('append the results as json line to this file', 'option', 'o', str) = None):
+    intents, threads = create_synthetic_input(nbr_intents, nbr_threads, nbr_answers, links_per_intent)
+
+    start = time.perf_counter()
+    expected = stats_per_row(intents, threads)
+    per_row = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = PostTable.from_threads(threads, intents)
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    intent_stats = table.intent_stats()
+    table.thread_stats()
+    aggregate = time.perf_counter() - start
+
+    equal = expected == list(zip(intent_stats['nbr_answers'].tolist(), intent_stats['nbr_solutions'].tolist()))
+    results = {'answers': len(table), 'links': len(table.link_answer), 'per_row_seconds': per_row,
+               'load_seconds': load, 'aggregate_seconds': aggregate}
+    print('%i answers, %i intent-answer links' % (len(table), len(table.link_answer)))
+    print('previous (counts only) %8.3f s' % per_row)
+    print('load columns           %8.3f s' % load)
+    print('aggregate (all stats)  %8.3f s' % aggregate)
+    print('counts equal: %s' % equal)
+    if out is not None:
+        with open(out, 'a') as f:
+            f.write(json.dumps({'commit': get_commit(), 'nbr_intents': nbr_intents, 'nbr_threads': nbr_threads,
+                                'nbr_answers': nbr_answers, 'links_per_intent': links_per_intent,
+                                'results': results, 'counts_equal': equal}) + '\n')
+    assert equal, 'the counts differ from the previous implementation'
+
+
+if __name__ == '__main__':
+    plac.call(main)
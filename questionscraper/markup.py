@@ -0,0 +1,352 @@
+"""
+Tokenizer and renderers for the markup that questions_scraper.serialize_elem writes into content / content_cleaned:
+[CAPTION]{{arg0}}{{arg1}}..., e.g. [LINK]{{url}}{{text}}, [IMAGE]{{src}} or [BLOCKQUOTE]{{...}}. Arguments can contain
+markup themselves (e.g. links in quotes). Texts that were split into sentences (crowd jobs) additionally contain
+sentence marks: ##sentence||.
+
+A text is tokenized once, every renderer walks the tokens once.
+"""
+import html
+import re
+
+CAPTION_IMAGE = 'IMAGE'
+CAPTION_BLOCKQUOTE = 'BLOCKQUOTE'
+CAPTION_UNKNOWN = 'UNKNOWN'
+CAPTION_LINK = 'LINK'
+CAPTION_LINK_PROFILE = 'LINK_PROFILE'
+
+CAPTIONS = [CAPTION_IMAGE, CAPTION_BLOCKQUOTE, CAPTION_UNKNOWN, CAPTION_LINK, CAPTION_LINK_PROFILE]
+
+# token types: (TEXT, text), (MARKUP, caption, args, raw), (SENTENCE_START, '##'), (SENTENCE_END, '||')
+# args is a tuple of token tuples (one per argument), raw is the markup as in the text
+TEXT = 'text'
+MARKUP = 'markup'
+SENTENCE_START = '##'
+SENTENCE_END = '||'
+
+TOKEN_RE = re.compile(r'\[([A-Z_]+)\]{{|}}{{|}}')
+TOKEN_RE_SENTENCES = re.compile(r'\[([A-Z_]+)\]{{|}}{{|}}|##|\|\|')
+# markup with arguments that do not contain "}" (see tokenize, nested=False)
+FLAT_MARKUP_RE = re.compile(r'\[([^\]]+)\]((?:{{[^}]*}})+)')
+# anything that must not be left in a rendered text
+LEFTOVER_RE = re.compile(r'{{|}}|\[(%s)\]' % '|'.join(CAPTIONS))
+SCHRIEB_RE = re.compile(r'schrieb:\s*')
+# marks the positions of html tags in the visible text collected by HtmlRenderer (removed at the end)
+TAG_BOUNDARY = '\x00'
+HTML_EMOJIS = ['🙂', '💕', '😀', '😊']
+
+
+def tokenize(text, sentence_marks=False, nested=True):
+    """
+    Tokenize the markup of a text. Markup that is not closed is kept as text.
+
+    :param sentence_marks: also create SENTENCE_START / SENTENCE_END tokens for "##" and "||" (only if nested)
+    :param nested: if False, markup arguments are plain text without "}" and markup ends at the first argument that
+        is not followed by another one. E.g. a quote that starts with a link ends after the link and the rest of the
+        quote is text (as the sentence splitting has always seen the markup, see helper.split_placeholders).
+    :return: tuple of tokens (see TEXT, MARKUP, SENTENCE_START, SENTENCE_END)
+    """
+    if not nested:
+        return tokenize_flat(text)
+    regex = TOKEN_RE_SENTENCES if sentence_marks else TOKEN_RE
+    root = []
+    current = root
+    # open markups: (caption, start, args, parent)
+    stack = []
+    pos = 0
+    for m in regex.finditer(text):
+        token = m.group()
+        caption = m.group(1)
+        if caption is None and not stack and token in ('}}{{', '}}'):
+            # not within markup, i.e. part of the text
+            continue
+        if m.start() > pos:
+            current.append((TEXT, text[pos:m.start()]))
+        pos = m.end()
+        if caption is not None:
+            args = [[]]
+            stack.append((caption, m.start(), args, current))
+            current = args[-1]
+        elif token == '}}{{':
+            args = stack[-1][2]
+            args.append([])
+            current = args[-1]
+        elif token == '}}':
+            caption, start, args, parent = stack.pop()
+            parent.append((MARKUP, caption, tuple(tuple(arg) for arg in args), text[start:m.end()]))
+            current = parent
+        else:
+            current.append((token, token))
+    if pos < len(text):
+        current.append((TEXT, text[pos:]))
+    while stack:
+        caption, start, args, parent = stack.pop()
+        parent.append((TEXT, '[%s]{{' % caption))
+        for i, arg in enumerate(args):
+            if i > 0:
+                parent.append((TEXT, '}}{{'))
+            parent.extend(arg)
+    return tuple(root)
+
+
+def tokenize_flat(text):
+    res = []
+    pos = 0
+    for m in FLAT_MARKUP_RE.finditer(text):
+        if m.start() > pos:
+            res.append((TEXT, text[pos:m.start()]))
+        args = tuple(((TEXT, arg),) if arg != '' else () for arg in m.group(2)[2:-2].split('}}{{'))
+        res.append((MARKUP, m.group(1), args, m.group()))
+        pos = m.end()
+    if pos < len(text):
+        res.append((TEXT, text[pos:]))
+    return tuple(res)
+
+
+def get_captions(tokens, res=None):
+    """
+    :return: set of the captions of all (also nested) markup
+    """
+    if res is None:
+        res = set()
+    for token in tokens:
+        if token[0] == MARKUP:
+            res.add(token[1])
+            for arg in token[2]:
+                get_captions(arg, res)
+    return res
+
+
+def split_markup(tokens):
+    """
+    :return: tuple (texts, markups): the texts between the top level markup and the markup (raw), i.e.
+        len(texts) == len(markups) + 1
+    """
+    texts = [[]]
+    markups = []
+    for token in tokens:
+        if token[0] == MARKUP:
+            markups.append(token[3])
+            texts.append([])
+        else:
+            texts[-1].append(token[1])
+    return [''.join(parts) for parts in texts], markups
+
+
+def get_arg(text):
+    # as matched by {{\s*([^}]+)\s*}} before: leading whitespace is removed, but at least one character is kept
+    stripped = text.lstrip()
+    return stripped if stripped else text[-1:]
+
+
+def check_args(token, nbr_args, args):
+    # every argument has to be not empty (and there has to be the expected number of them)
+    if len(args) not in nbr_args or any(arg == '' for arg in args):
+        raise AssertionError('unexpected markup: %s' % token[3])
+
+
+class Output(object):
+    """
+    Collects the rendered parts of a text and their visible text (without tags). After a link, following spaces are
+    skipped (the link ends with one).
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.text_parts = []
+        self.skip_spaces = False
+
+    def append(self, s, text=''):
+        if self.skip_spaces:
+            s = s.lstrip(' ')
+            if s == '':
+                return
+            text = text.lstrip(' ')
+            self.skip_spaces = False
+        self.parts.append(s)
+        self.text_parts.append(text)
+
+    def get(self):
+        return ''.join(self.parts)
+
+    def get_text(self):
+        return ''.join(self.text_parts)
+
+
+def render_plain(tokens):
+    """
+    Render as plain text: link captions (or the url), "IMAGE" and "BLOCKQUOTE" instead of images and quotes,
+    sentence marks are removed.
+    """
+    out = Output()
+    for token in tokens:
+        if token[0] == TEXT:
+            out.append(token[1])
+        elif token[0] == MARKUP:
+            caption = token[1]
+            args = [render_plain(arg) for arg in token[2]]
+            if caption == CAPTION_LINK:
+                check_args(token, (1, 2), args)
+                out.append(get_arg(args[-1]) + ' ')
+                out.skip_spaces = True
+            elif caption == CAPTION_LINK_PROFILE:
+                check_args(token, (2,), args)
+                out.append(get_arg(args[1]))
+            elif caption == CAPTION_IMAGE:
+                check_args(token, (1,), args)
+                out.append(CAPTION_IMAGE + ' ')
+            elif caption == CAPTION_BLOCKQUOTE:
+                # empty quotes are removed (but end the spaces after a link)
+                out.skip_spaces = False
+                if args != ['']:
+                    check_args(token, (1,), args)
+                    out.append(CAPTION_BLOCKQUOTE + ' ')
+            else:
+                raise AssertionError('unexpected markup: %s' % token[3])
+    return out.get()
+
+
+def get_segments(tokens, res=None):
+    """
+    Split the tokens at the sentence ends (in text order, also within markup).
+
+    :return: list of [has_image, blank] per segment, blank segments contain only whitespace
+    """
+    if res is None:
+        res = [[False, True]]
+    for token in tokens:
+        if token[0] == TEXT:
+            if token[1].strip() != '':
+                res[-1][1] = False
+            if '[%s]' % CAPTION_IMAGE in token[1]:
+                res[-1][0] = True
+        elif token[0] == SENTENCE_END:
+            res.append([False, True])
+        elif token[0] == SENTENCE_START:
+            res[-1][1] = False
+        else:
+            res[-1][1] = False
+            if token[1] == CAPTION_IMAGE:
+                res[-1][0] = True
+            for arg in token[2]:
+                # the separators / the end of the markup are in the current segment
+                get_segments(arg, res)
+                res[-1][1] = False
+    return res
+
+
+class HtmlRenderer(object):
+    """
+    Render as html: links, images and quotes as html elements, sentence marks replaced by sentence_start /
+    sentence_end.
+
+    :param escape: html escape the text
+    :param segments: render sentences as segments (the text up to the next sentence end): blank segments are
+        removed, all others are closed by sentence_end and sentence_start_image is used in segments with images
+    :param count_tags: strings (e.g. '<div') that render_with_text counts in the html
+    """
+
+    def __init__(self, sentence_start='', sentence_end='', escape=False, quote_open='<blockquote>',
+                 quote_close='</blockquote>', segments=False, sentence_start_image=None, emojis=HTML_EMOJIS,
+                 count_tags=()):
+        self.sentence_start = sentence_start
+        self.sentence_end = sentence_end
+        self.escape = escape
+        self.quote_open = quote_open
+        self.quote_close = quote_close
+        self.segments = segments
+        self.sentence_start_image = sentence_start_image if sentence_start_image is not None else sentence_start
+        self.emojis = {ord(emoji): '&#%i;' % ord(emoji) for emoji in emojis}
+        self.count_tags = tuple(count_tags)
+        # counts of count_tags per constant html snippet (sentence_start, quote_open, ...)
+        self.snippet_counts = {}
+
+    def render_text(self, text):
+        if self.escape:
+            text = html.escape(text)
+        return text.translate(self.emojis)
+
+    def render(self, tokens):
+        return self.render_with_text(tokens)[0]
+
+    def render_with_text(self, tokens):
+        """
+        :return: tuple (html, text, tag_counts): text is the visible text of the html as html parsers extract it
+            (e.g. for word counts), tag_counts is a dict with the number of occurrences of every count_tags entry
+            in the html
+        """
+        state = {'segment': 0, 'quote': False, 'tags': [0] * len(self.count_tags),
+                 'segments': get_segments(tokens) if self.segments else None}
+        out = self._render(tokens, state)
+        res, text = out.get(), out.get_text()
+        if self.segments and not state['segments'][-1][1]:
+            res += self.count(self.sentence_end, state)
+        if state['quote']:
+            # the line break replaces the whitespace up to the next tag, i.e. it is dropped from the visible text
+            res = SCHRIEB_RE.sub('schrieb:<br/>', res)
+            text = SCHRIEB_RE.sub('schrieb:', text)
+        text = text.replace(TAG_BOUNDARY, '')
+        return res, text, dict(zip(self.count_tags, state['tags']))
+
+    def count(self, s, state, snippet=True):
+        # add the occurrences of count_tags in s to the state, the rendered arguments of markup are counted before
+        if self.count_tags:
+            counts = self.snippet_counts.get(s) if snippet else None
+            if counts is None:
+                counts = [s.count(tag) for tag in self.count_tags]
+                if snippet:
+                    self.snippet_counts[s] = counts
+            state['tags'] = [a + b for a, b in zip(state['tags'], counts)]
+        return s
+
+    def _render(self, tokens, state):
+        out = Output()
+        segments = state['segments']
+        for token in tokens:
+            if token[0] == TEXT:
+                if segments is None or not segments[state['segment']][1]:
+                    s = self.render_text(token[1])
+                    if not self.escape:
+                        # the text may contain html
+                        self.count(s, state, snippet=False)
+                    out.append(s, token[1])
+            elif token[0] == SENTENCE_START:
+                out.append(self.count(self.sentence_start_image if segments is not None
+                                      and segments[state['segment']][0] else self.sentence_start, state),
+                           TAG_BOUNDARY)
+            elif token[0] == SENTENCE_END:
+                if segments is None:
+                    out.append(self.count(self.sentence_end, state), TAG_BOUNDARY)
+                else:
+                    if not segments[state['segment']][1]:
+                        out.append(self.count(self.sentence_end, state), TAG_BOUNDARY)
+                    state['segment'] += 1
+            else:
+                caption = token[1]
+                outs = [self._render(arg, state) for arg in token[2]]
+                args = [o.get() for o in outs]
+                if caption == CAPTION_LINK:
+                    check_args(token, (1, 2), args)
+                    out.append('<a href="%s" target="_blank">%s</a> ' % (get_arg(args[0]), get_arg(args[-1])),
+                               TAG_BOUNDARY + get_arg(outs[-1].get_text()) + TAG_BOUNDARY + ' ')
+                    out.skip_spaces = True
+                elif caption == CAPTION_LINK_PROFILE:
+                    check_args(token, (2,), args)
+                    out.append('<a class="profile-link" href="%s" target="_blank">%s</a>'
+                               % (get_arg(args[0]), get_arg(args[1])),
+                               TAG_BOUNDARY + get_arg(outs[1].get_text()) + TAG_BOUNDARY)
+                elif caption == CAPTION_IMAGE:
+                    check_args(token, (1,), args)
+                    out.append('<img src="%s" />' % get_arg(args[0]), TAG_BOUNDARY)
+                elif caption == CAPTION_BLOCKQUOTE:
+                    # empty quotes are removed (but end the spaces after a link)
+                    out.skip_spaces = False
+                    if args != ['']:
+                        check_args(token, (1,), args)
+                        state['quote'] = True
+                        out.append('%s%s%s' % (self.count(self.quote_open, state), get_arg(args[0]),
+                                               self.count(self.quote_close, state)),
+                               TAG_BOUNDARY + get_arg(outs[0].get_text()) + TAG_BOUNDARY)
+                else:
+                    raise AssertionError('unexpected markup: %s' % token[3])
+        return out
@@ -6,6 +6,11 @@
 # https://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+from questionscraper.rawstore import RawHtmlStore
 
 
 class QuestionscraperSpiderMiddleware(object):
@@ -101,3 +106,53 @@ class QuestionscraperDownloaderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class RawHtmlStoreMiddleware(object):
+    # Writes every downloaded response to a RawHtmlStore (setting RAW_HTML_STORE: directory of the store). With
+    # RAW_HTML_REPLAY = True, responses are served from the store instead and requests for urls that are not in the
+    # store are dropped, i.e. the network is not used at all.
+    #
+    # Should be placed close to the downloader (e.g. 950), so that redirects, compression etc. are handled by the
+    # other middlewares in the same way when replaying.
+
+    def __init__(self, store, replay=False):
+        self.store = store
+        self.replay = replay
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('RAW_HTML_STORE')
+        if not path:
+            raise NotConfigured
+        s = cls(RawHtmlStore(path), replay=crawler.settings.getbool('RAW_HTML_REPLAY'))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider):
+        if not self.replay:
+            return None
+        stored = self.store.get(request.url)
+        if stored is None:
+            spider.logger.warning('not in raw html store, skip: %s' % request.url)
+            raise IgnoreRequest('not in raw html store: %s' % request.url)
+        entry, body = stored
+        headers = Headers(entry['headers'])
+        respcls = responsetypes.from_args(headers=headers, url=entry['response_url'], body=body)
+        return respcls(url=entry['response_url'], status=entry['status'], headers=headers, body=body,
+                       request=request, flags=['raw_html_store'])
+
+    def process_response(self, request, response, spider):
+        if not self.replay:
+            headers = {k.decode('latin-1'): [v.decode('latin-1') for v in vs] for k, vs in response.headers.items()}
+            self.store.put(request.url, response.body, status=response.status, headers=headers,
+                           response_url=response.url)
+        return response
+
+    def spider_opened(self, spider):
+        spider.logger.info('raw html store: %s (%i urls, %s)'
+                           % (self.store.path, len(self.store), 'replay' if self.replay else 'record'))
+
+    def spider_closed(self, spider):
+        self.store.close()
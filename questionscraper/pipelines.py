@@ -4,8 +4,46 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://doc.scrapy.org/en/latest/topics/item-pipeline.html
+from scrapy.exceptions import NotConfigured
+
+from questionscraper.poststore import PostStore
 
 
 class QuestionscraperPipeline(object):
     def process_item(self, item, spider):
         return item
+
+
+class PostStorePipeline(object):
+    # Writes the thread items of QuestionsSpider and the answers of AnswersSpider to a PostStore (setting POST_STORE:
+    # path of the sqlite file). The items are passed on unchanged, i.e. the json lines feed (-o) is still written.
+
+    def __init__(self, path, commit_every=100):
+        self.path = path
+        self.commit_every = commit_every
+        self.store = None
+        self.count = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('POST_STORE')
+        if not path:
+            raise NotConfigured
+        return cls(path, commit_every=crawler.settings.getint('POST_STORE_COMMIT_EVERY', 100))
+
+    def open_spider(self, spider):
+        self.store = PostStore(self.path)
+
+    def close_spider(self, spider):
+        spider.logger.info('wrote %i items to post store: %s' % (self.count, self.path))
+        self.store.close()
+
+    def process_item(self, item, spider):
+        if 'question' in item and 'answers' in item:
+            self.store.put_thread(item)
+        else:
+            self.store.put_answer(item)
+        self.count += 1
+        if self.count % self.commit_every == 0:
+            self.store.commit()
+        return item
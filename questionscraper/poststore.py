@@ -0,0 +1,287 @@
+"""
+SQLite store for scraped threads, posts and intents, as an alternative to the json lines intermediates.
+
+Threads and posts are written by PostStorePipeline (setting POST_STORE) or imported from json lines files, intents
+with their link lists by merge_answers_to_intents (--store) or the import. The helper functions accept the store path
+wherever they take a scraped questions / answers file or an intents file, e.g.:
+
+    python -m questionscraper.poststore import-jl scraped.sqlite -q scrape_10/scraped_questions_10.jl -i scrape_10/intents_questions_10.jl
+    python questionscraper/spiders/helper.py -i scraped.sqlite -o scrape_10 -q scraped.sqlite
+"""
+import logging
+import os
+import sqlite3
+from collections.abc import Mapping
+
+import plac
+
+from questionscraper.spiders.helper import json_loads, json_dumps, iter_jl, INTENT_ID
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS threads (
+    url TEXT PRIMARY KEY,
+    question_url TEXT,
+    title TEXT,
+    solved INTEGER,
+    tags TEXT,
+    nbr_answers INTEGER
+);
+CREATE TABLE IF NOT EXISTS posts (
+    url TEXT PRIMARY KEY,
+    thread_url TEXT,
+    question_url TEXT,
+    position INTEGER,
+    author_name TEXT,
+    solution_accepted_by TEXT,
+    has_quote INTEGER,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS posts_thread ON posts (thread_url, position);
+CREATE INDEX IF NOT EXISTS posts_question ON posts (question_url);
+CREATE TABLE IF NOT EXISTS intents (
+    intent_id TEXT PRIMARY KEY,
+    position INTEGER,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS intent_links (
+    intent_id TEXT,
+    kind TEXT,
+    position INTEGER,
+    url TEXT,
+    PRIMARY KEY (intent_id, kind, position)
+);
+CREATE INDEX IF NOT EXISTS intent_links_url ON intent_links (url);
+'''
+
+# intent fields whose urls are (additionally to intents.data) stored in intent_links
+LINK_KINDS = ('links', 'relevant_answer_links', 'original_relevant_answer_links')
+# merged intents contain the complete scraped items, these are not copied into intents.data
+INTENT_SKIP_FIELDS = ('questions', 'answers')
+
+
+def dumps(obj):
+    return json_dumps(obj).decode('utf-8')
+
+
+class PostStore(object):
+    """
+    Threads (one row per thread item of QuestionsSpider), posts (questions and answers, the complete post as json in
+    data plus some columns for queries), intents and intent_links (one row per url in the link lists of an intent),
+    indexed by url and Intent-ID.
+
+    Posts are keyed by their url, so an answer scraped by AnswersSpider and the same answer as part of a thread are
+    stored once. Intents are keyed by their Intent-ID, i.e. putting an intent again (e.g. of a later pipeline stage)
+    replaces it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def put_thread(self, item):
+        """
+        Insert or replace a thread item (as yielded by QuestionsSpider) and all of its posts.
+        """
+        question = item['question']
+        self.db.execute('INSERT OR REPLACE INTO threads (url, question_url, title, solved, tags, nbr_answers) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (item['url'], question['url'], item['title'], int(item['solved']), dumps(item['tags']),
+                         len(item['answers'])))
+        # remove answers that are no longer in the thread
+        self.db.execute('DELETE FROM posts WHERE thread_url = ?', (item['url'],))
+        self.db.executemany('INSERT OR REPLACE INTO posts (url, thread_url, question_url, position, author_name, '
+                            'solution_accepted_by, has_quote, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (self._post_row(post, item['url'], question['url'], position)
+                             for position, post in enumerate([question] + item['answers'])))
+
+    def put_answer(self, answer):
+        """
+        Insert or update an answer (as yielded by AnswersSpider, i.e. with question_url). If the answer is already
+        stored as part of a thread, its position in the thread is kept.
+        """
+        self.db.execute('INSERT INTO posts (url, thread_url, question_url, position, author_name, '
+                        'solution_accepted_by, has_quote, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                        'ON CONFLICT (url) DO UPDATE SET question_url = excluded.question_url, '
+                        'author_name = excluded.author_name, solution_accepted_by = excluded.solution_accepted_by, '
+                        'has_quote = excluded.has_quote, data = excluded.data',
+                        self._post_row(answer, None, answer['question_url'], None))
+
+    @staticmethod
+    def _post_row(post, thread_url, question_url, position):
+        data = {k: v for k, v in post.items() if k != 'question_url'}
+        return (post['url'], thread_url, question_url, position, post.get('author_name'),
+                post.get('solution_accepted_by'), int(bool(post.get('has_quote'))), dumps(data))
+
+    def put_intent(self, intent, position=None):
+        """
+        Insert or replace an intent. The link lists (see LINK_KINDS) are additionally stored in intent_links, scraped
+        items that were merged into the intent (questions, answers) are not stored.
+        """
+        intent_id = intent[INTENT_ID]
+        data = {k: v for k, v in intent.items() if k not in INTENT_SKIP_FIELDS}
+        if position is None:
+            position = self.db.execute('SELECT position FROM intents WHERE intent_id = ?', (intent_id,)).fetchone()
+            position = position[0] if position is not None else \
+                self.db.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM intents').fetchone()[0]
+        self.db.execute('INSERT OR REPLACE INTO intents (intent_id, position, data) VALUES (?, ?, ?)',
+                        (intent_id, position, dumps(data)))
+        self.db.execute('DELETE FROM intent_links WHERE intent_id = ?', (intent_id,))
+        self.db.executemany('INSERT INTO intent_links (intent_id, kind, position, url) VALUES (?, ?, ?, ?)',
+                            ((intent_id, kind, i, url) for kind in LINK_KINDS if kind in intent
+                             for i, url in enumerate(intent[kind])))
+
+    def get_post(self, url):
+        row = self.db.execute('SELECT data, question_url FROM posts WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        return self._answer(row)
+
+    @staticmethod
+    def _answer(row):
+        # answers as yielded by AnswersSpider
+        answer = json_loads(row[0])
+        answer['question_url'] = row[1]
+        return answer
+
+    def get_thread(self, url):
+        """
+        :return: the thread item as yielded by QuestionsSpider or None
+        """
+        row = self.db.execute('SELECT title, solved, tags FROM threads WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        posts = [json_loads(data) for data, in
+                 self.db.execute('SELECT data FROM posts WHERE thread_url = ? ORDER BY position', (url,))]
+        return {'url': url, 'title': row[0], 'solved': bool(row[1]), 'tags': json_loads(row[2]),
+                'question': posts[0], 'answers': posts[1:]}
+
+    def get_intent(self, intent_id):
+        row = self.db.execute('SELECT data FROM intents WHERE intent_id = ?', (intent_id,)).fetchone()
+        if row is None:
+            return None
+        return json_loads(row[0])
+
+    def get_relevant_answers(self, intent_id):
+        """
+        :return: the relevant answers (relevant_answer_links) of the intent that are in the store, in link order
+        """
+        return [self._answer(row) for row in self.db.execute(
+            'SELECT p.data, p.question_url FROM intent_links l JOIN posts p ON p.url = l.url '
+            'WHERE l.intent_id = ? AND l.kind = ? ORDER BY l.position', (intent_id, 'relevant_answer_links'))]
+
+    def iter_thread_urls(self):
+        return (url for url, in self.db.execute('SELECT url FROM threads ORDER BY rowid'))
+
+    def iter_threads(self):
+        for url in list(self.iter_thread_urls()):
+            yield self.get_thread(url)
+
+    def iter_answers(self):
+        """
+        Yield all answers (posts that are not the question of a thread), with question_url.
+        """
+        for row in self.db.execute('SELECT data, question_url FROM posts WHERE position IS NULL OR position > 0 '
+                                   'ORDER BY rowid'):
+            yield self._answer(row)
+
+    def iter_intents(self):
+        for data, in self.db.execute('SELECT data FROM intents ORDER BY position'):
+            yield json_loads(data)
+
+    def get_done_urls(self):
+        """
+        :return: set of the urls of all stored threads and posts (see skip_done_urls)
+        """
+        res = set(self.iter_thread_urls())
+        res.update(url for url, in self.db.execute('SELECT url FROM posts'))
+        return res
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def threads(self):
+        return StoreLookup(self, 'SELECT 1 FROM threads WHERE url = ?', self.get_thread, self.iter_thread_urls)
+
+    def answers(self):
+        return StoreLookup(self, 'SELECT 1 FROM posts WHERE url = ? AND (position IS NULL OR position > 0)',
+                           self.get_post,
+                           lambda: (url for url, in self.db.execute('SELECT url FROM posts WHERE position IS NULL '
+                                                                    'OR position > 0 ORDER BY rowid')))
+
+
+class StoreLookup(Mapping):
+    """
+    Read only mapping of url to thread item or answer, reading from a PostStore (see PostStore.threads / answers).
+    Every lookup returns a new dict.
+    """
+
+    def __init__(self, store, contains_sql, get, iter_urls):
+        self.store = store
+        self.contains_sql = contains_sql
+        self.get_func = get
+        self.iter_urls = iter_urls
+
+    def __getitem__(self, url):
+        res = self.get_func(url)
+        if res is None:
+            raise KeyError(url)
+        return res
+
+    def __contains__(self, url):
+        return self.store.db.execute(self.contains_sql, (url,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter(list(self.iter_urls()))
+
+    def __len__(self):
+        return sum(1 for _ in self.iter_urls())
+
+    def close(self):
+        self.store.close()
+
+
+def main(mode: ('what to do', 'positional', None, str, ['import-jl', 'export-jl']),
+         store: ('path to the sqlite file', 'positional'),
+         questions: ('scraped questions (json lines) of QuestionsSpider', 'option', 'q', str) = None,
+         answers: ('scraped answers (json lines) of AnswersSpider', 'option', 'a', str) = None,
+         intents: ('intents (json lines)', 'option', 'i', str) = None):
+    """
+    Import json lines files into the store (import-jl) or write the content of the store to json lines files
+    (export-jl, the files must not exist).
+    """
+    from questionscraper.spiders.helper import JlWriter
+    logging.getLogger().setLevel(logging.INFO)
+    if mode == 'export-jl':
+        for path in (questions, answers, intents):
+            if path is not None and os.path.exists(path):
+                raise ValueError('file exists, please remove it or choose another path: %s' % path)
+    s = PostStore(store)
+    if mode == 'import-jl':
+        if answers is not None:
+            for answer in iter_jl(answers):
+                s.put_answer(answer)
+        if questions is not None:
+            for item in iter_jl(questions):
+                s.put_thread(item)
+        if intents is not None:
+            for intent in iter_jl(intents):
+                s.put_intent(intent)
+        s.commit()
+    else:
+        for path, records in [(questions, s.iter_threads), (answers, s.iter_answers), (intents, s.iter_intents)]:
+            if path is not None:
+                with JlWriter(path) as writer:
+                    writer.writelines(records())
+                logging.info('wrote %i records to %s' % (writer.count, path))
+    s.close()
+
+
+if __name__ == '__main__':
+    plac.call(main)
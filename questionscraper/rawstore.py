@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import zlib
+
+INDEX_FILE = 'index.jl'
+OBJECTS_DIR = 'objects'
+
+
+def get_header(headers, name):
+    # headers: dict of header name to list of values (as stored in the index)
+    for k, values in headers.items():
+        if k.lower() == name.lower() and len(values) > 0:
+            return values[0]
+    return None
+
+
+def decode_body(body, content_encoding):
+    """
+    Undo the content encoding of a stored body (bodies are stored as received from the downloader).
+    """
+    if content_encoding is None or content_encoding.lower() == 'identity':
+        return body
+    content_encoding = content_encoding.lower()
+    if content_encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if content_encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # raw deflate stream without zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    if content_encoding == 'br':
+        import brotli
+        return brotli.decompress(body)
+    raise ValueError('unknown content encoding: %s' % content_encoding)
+
+
+class RawHtmlStore(object):
+    """
+    Content addressed store for raw response bodies.
+
+    Every body is written gzip compressed to objects/XX/SHA1.gz, where SHA1 is the hash of the uncompressed body, so
+    identical pages are stored only once. index.jl maps the request url to the hash and the response metadata
+    (one json line per stored response; for urls that were stored multiple times, the last entry wins).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        os.makedirs(os.path.join(path, OBJECTS_DIR), exist_ok=True)
+        index_fn = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_fn):
+            with open(index_fn) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.index[entry['url']] = entry
+        logging.info('raw html store %s: %i urls' % (path, len(self.index)))
+        self.index_file = None
+
+    def object_path(self, sha1):
+        return os.path.join(self.path, OBJECTS_DIR, sha1[:2], sha1 + '.gz')
+
+    def put(self, url, body, status=200, headers=None, response_url=None):
+        """
+        Store the body for the url.
+
+        :param url: the request url (key)
+        :param body: bytes
+        :param headers: dict of header name to list of values
+        :param response_url: url of the response, if it differs from url
+        :return: the content hash
+        """
+        sha1 = hashlib.sha1(body).hexdigest()
+        fn = self.object_path(sha1)
+        if not os.path.exists(fn):
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            # write to a temporary file first, so that an interrupted crawl does not leave truncated objects
+            with gzip.open(fn + '.tmp', 'wb') as f:
+                f.write(body)
+            os.replace(fn + '.tmp', fn)
+        entry = {'url': url, 'sha1': sha1, 'status': status, 'headers': headers or {},
+                 'response_url': response_url or url}
+        if self.index.get(url) != entry:
+            if self.index_file is None:
+                self.index_file = open(os.path.join(self.path, INDEX_FILE), 'a')
+            self.index_file.write(json.dumps(entry) + '\n')
+            self.index_file.flush()
+            self.index[url] = entry
+        return sha1
+
+    def get(self, url):
+        """
+        :return: tuple (index entry, body) or None, if the url is not in the store
+        """
+        entry = self.index.get(url)
+        if entry is None:
+            return None
+        return entry, self.read_body(entry['sha1'])
+
+    def read_body(self, sha1):
+        with gzip.open(self.object_path(sha1), 'rb') as f:
+            return f.read()
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
@@ -0,0 +1,147 @@
+"""
+Re-parse a crawl offline from a raw html store (see RAW_HTML_STORE in settings.py) with a process pool.
+
+Produces the same json lines output as QuestionsSpider / AnswersSpider (and the same intents backup file next to the
+intent file), but runs parse_thread / iter_thread_answers for many threads in parallel, one thread per task.
+
+usage:
+    python -m questionscraper.reparse questions -s raw -i scrape_10/intents_answers_10_merged.jl -m 10 -o scrape_10/scraped_questions_10.jl
+    python -m questionscraper.reparse answers -s raw -i scrape_10/Crowdsourcing-Intents-Intent-Answers_List.tsv -m 10 -o scrape_10/scraped_answers_10.jl -w 32
+    # the output is compressed, if the file name ends with .gz or .zst
+    python -m questionscraper.reparse questions -s raw -i scrape_10/intents_answers_10_merged.jl -m 10 -o scrape_10/scraped_questions_10.jl.zst
+"""
+import logging
+import os
+from multiprocessing import Pool
+from urllib.parse import urljoin
+
+import plac
+import scrapy
+from scrapy.http import HtmlResponse
+
+from questionscraper.rawstore import RawHtmlStore, get_header, decode_body
+from questionscraper.spiders.helper import JlWriter
+from questionscraper.spiders.questions_scraper import parse_thread, get_next_page_url, iter_thread_answers, \
+    group_by_thread, prepare_question_intents, prepare_answer_intents, QuestionUrlCache, SERIALIZERS, SERIALIZER_XPATH
+
+MODE_QUESTIONS = 'questions'
+MODE_ANSWERS = 'answers'
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+# set per worker process by init_worker
+_store = None
+_serialize = None
+
+
+def init_worker(store_path, serializer):
+    global _store, _serialize
+    _store = RawHtmlStore(store_path)
+    _serialize = SERIALIZERS[serializer]
+
+
+def get_response(store, url, max_redirects=20):
+    """
+    Create the response for url from the store, like the downloader (incl. RedirectMiddleware and
+    HttpCompressionMiddleware) would have returned it.
+    """
+    for _ in range(max_redirects + 1):
+        stored = store.get(url)
+        if stored is None:
+            raise KeyError('not in raw html store: %s' % url)
+        entry, body = stored
+        location = get_header(entry['headers'], 'Location')
+        if entry['status'] in REDIRECT_STATUS and location is not None:
+            url = urljoin(entry['response_url'], location)
+            continue
+        body = decode_body(body, get_header(entry['headers'], 'Content-Encoding'))
+        headers = {k: v for k, v in entry['headers'].items() if k.lower() != 'content-encoding'}
+        return HtmlResponse(url=entry['response_url'], status=entry['status'], headers=headers, body=body,
+                            request=scrapy.Request(url))
+    raise ValueError('too many redirects for: %s' % url)
+
+
+def run_inline(generator, fetch):
+    """
+    Run a generator that yields scrapy.Requests (and expects their responses back, see inline_requests) and items.
+    If fetch fails, the exception is thrown into the generator (as inline_requests does for failed requests).
+
+    :return: list of the yielded items
+    """
+    items = []
+    try:
+        output = generator.send(None)
+        while True:
+            if isinstance(output, scrapy.Request):
+                try:
+                    response = fetch(output.url)
+                except Exception as e:
+                    output = generator.throw(e)
+                    continue
+                output = generator.send(response)
+            else:
+                items.append(output)
+                output = generator.send(None)
+    except StopIteration:
+        return items
+
+
+def reparse_thread(url):
+    try:
+        responses = [get_response(_store, url)]
+        while True:
+            next_url = get_next_page_url(responses[-1])
+            if next_url is None:
+                break
+            responses.append(get_response(_store, responses[-1].urljoin(next_url)))
+        return [parse_thread(responses, serialize=_serialize)]
+    except Exception as e:
+        logging.error('could not re-parse thread %s: %s' % (url, e))
+        return []
+
+
+def reparse_thread_answers(urls):
+    try:
+        return run_inline(iter_thread_answers(get_response(_store, urls[0]), urls, QuestionUrlCache(),
+                                              serialize=_serialize),
+                          fetch=lambda url: get_response(_store, url))
+    except Exception as e:
+        logging.error('could not re-parse answers %s: %s' % (', '.join(urls), e))
+        return []
+
+
+def main(mode: ('what to re-parse', 'positional', None, str, [MODE_QUESTIONS, MODE_ANSWERS]),
+         store: ('directory of the raw html store', 'option', 's', str),
+         intent_file: ('intent file, as passed to the spider', 'option', 'i', str),
+         out: ('output json lines file', 'option', 'o', str),
+         max_answers: ('max_answers, as passed to the spider', 'option', 'm', int) = 10,
+         workers: ('number of worker processes (default: number of cpus)', 'option', 'w', int) = None,
+         serializer: ('post serializer', 'option', 'p', str, list(SERIALIZERS)) = SERIALIZER_XPATH,
+         chunksize: ('number of threads per task batch', 'option', 'c', int) = 8):
+    logging.getLogger().setLevel(logging.INFO)
+    assert store is not None and intent_file is not None and out is not None, \
+        'please provide the raw html store (-s), the intent file (-i) and the output file (-o)'
+    assert os.path.isdir(store), 'raw html store not found: %s' % store
+
+    if mode == MODE_QUESTIONS:
+        intents, urls = prepare_question_intents(intent_file, max_answers)
+        # the spider drops duplicated requests
+        tasks = list(dict.fromkeys(urls))
+        task_func = reparse_thread
+    else:
+        intents, urls = prepare_answer_intents(intent_file, max_answers)
+        tasks = group_by_thread(urls)
+        task_func = reparse_thread_answers
+
+    workers = workers or os.cpu_count()
+    logging.info('re-parse %i threads with %i workers ...' % (len(tasks), workers))
+    nbr_items = 0
+    with Pool(workers, initializer=init_worker, initargs=(store, serializer)) as pool, JlWriter(out) as writer:
+        # imap keeps the task order, so the output is deterministic
+        for items in pool.imap(task_func, tasks, chunksize=chunksize):
+            writer.writelines(items)
+            nbr_items += len(items)
+    logging.info('wrote %i items to %s' % (nbr_items, out))
+
+
+if __name__ == '__main__':
+    plac.call(main)
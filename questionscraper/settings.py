@@ -55,6 +55,10 @@ ROBOTSTXT_OBEY = True
 #DOWNLOADER_MIDDLEWARES = {
 #    'questionscraper.middlewares.QuestionscraperDownloaderMiddleware': 543,
 #}
+DOWNLOADER_MIDDLEWARES = {
+    # inactive as long as RAW_HTML_STORE is not set
+    'questionscraper.middlewares.RawHtmlStoreMiddleware': 950,
+}
 
 # Enable or disable extensions
 # See https://doc.scrapy.org/en/latest/topics/extensions.html
@@ -67,6 +71,10 @@ ROBOTSTXT_OBEY = True
 #ITEM_PIPELINES = {
 #    'questionscraper.pipelines.QuestionscraperPipeline': 300,
 #}
+ITEM_PIPELINES = {
+    # inactive as long as POST_STORE is not set
+    'questionscraper.pipelines.PostStorePipeline': 300,
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://doc.scrapy.org/en/latest/topics/autothrottle.html
@@ -88,3 +96,22 @@ ROBOTSTXT_OBEY = True
 #HTTPCACHE_DIR = 'httpcache'
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+
+# Serializer used to convert message bodies into content / content_cleaned:
+# 'xpath' (serialize_elem) or 'tree' (serialize_elem_tree, same output, but single pass over the lxml tree)
+POST_SERIALIZER = 'xpath'
+
+# How QuestionsSpider fetches the pages of a thread: 'sequential' (follow the next links one after another) or
+# 'parallel' (read the last page number from the pager of page 1 and request all remaining pages at once)
+THREAD_PAGINATION = 'sequential'
+
+# Directory of a compressed, content addressed store for all downloaded responses (see questionscraper/rawstore.py).
+# With RAW_HTML_REPLAY = True, both spiders are served from that store without touching the network, e.g.:
+#   scrapy crawl questions -s RAW_HTML_STORE=raw -s RAW_HTML_REPLAY=1 ...
+RAW_HTML_STORE = None
+RAW_HTML_REPLAY = False
+
+# Path of a sqlite file (see questionscraper/poststore.py) the scraped threads / answers are written to, additionally to
+# the json lines feed, e.g.: scrapy crawl questions -s POST_STORE=scraped.sqlite ...
+POST_STORE = None
+POST_STORE_COMMIT_EVERY = 100
@@ -1,7 +1,20 @@
 import csv
+import gzip
+import hashlib
+import heapq
+import io
 import json
 import logging
+import mmap
 import os
+import sqlite3
+import tempfile
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from multiprocessing import Pool
+from operator import itemgetter
 from pathlib import Path
 
 import corenlp
@@ -9,11 +22,68 @@ import corenlp
 import re
 import plac
 
+from questionscraper.markup import tokenize, split_markup
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 QUESTION_PREFIX = 'Question_'
 ANSWER_PREFIX = 'Answer_'
 INTENT_ID = 'Intent-ID'
 INTENT_TEXT = 'Intent-Text'
 
+JSON_BACKEND_JSON = 'json'
+JSON_BACKEND_ORJSON = 'orjson'
+# used to read and write json lines files, orjson (if installed) is considerably faster for large files
+JSON_BACKEND = JSON_BACKEND_ORJSON if orjson is not None else JSON_BACKEND_JSON
+ZSTD_LEVEL = 3
+JL_INDEX_TAIL = 4096
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+SCRAPED_THREADS = 'threads'
+SCRAPED_ANSWERS = 'answers'
+# sentence splitting: maximal size of one document sent to the CoreNLP server (its default maxCharLength is 100000)
+NLP_BATCH_CHARS = 50000
+# maximal number of concurrent requests (the server uses 5 threads by default)
+NLP_MAX_REQUESTS = 4
+NLP_SSPLIT_PROPERTIES = {'annotators': 'tokenize,ssplit', 'ssplit.newlineIsSentenceBreak': 'two',
+                         'inputFormat': 'text', 'outputFormat': 'serialized',
+                         'serializer': 'edu.stanford.nlp.pipeline.ProtobufAnnotationSerializer'}
+SPLITTER_CORENLP = 'corenlp'
+SPLITTER_SPACY = 'spacy'
+SPLITTER_RULES = 'rules'
+SPLITTERS = (SPLITTER_CORENLP, SPLITTER_SPACY, SPLITTER_RULES)
+SPACY_MODEL = 'de_core_news_sm'
+# spaCy components that are not needed for sentence boundaries
+SPACY_DISABLE = ('tagger', 'morphologizer', 'lemmatizer', 'attribute_ruler', 'ner')
+RULE_SENTENCE_END = re.compile(r'([.!?\u2026]+)(["\'\u00bb\u00ab\u201c\u201d\u201e)\]]*)(?=\s)')
+GERMAN_ABBREVIATIONS = frozenset(['z.b', 'bzw', 'ca', 'nr', 'usw', 'etc', 'd.h', 'u.a', 'ggf', 'inkl', 'exkl', 'evtl',
+                                  'dr', 'hr', 'fr', 'st', 'str', 'tel', 'vgl', 'bspw', 'z.t', 'u.u', 'o.ä', 'mio',
+                                  'mrd', 'max', 'min', 'zzgl', 'ggü', 'jh', 'abs', 'mtl', 'tägl', 'lt', 'gem', 'allg',
+                                  'mind', 'ff', 'vs', 'zb', 'dh', 'usf'])
+# a number followed by a month (e.g. "am 3. Mai") is a date, not a sentence end
+GERMAN_MONTHS = frozenset(['januar', 'jänner', 'februar', 'märz', 'april', 'mai', 'juni', 'juli', 'august',
+                           'september', 'oktober', 'november', 'dezember', 'jan', 'feb', 'mär', 'apr', 'jun', 'jul',
+                           'aug', 'sep', 'sept', 'okt', 'nov', 'dez'])
+# the least recently used entries of a SentenceCache are removed if its content exceeds this size (in bytes)
+SENTENCE_CACHE_MAX_SIZE = 2 ** 30
+
+# see load_mdswriter
+MDSWRITER_BATCH_ROWS = 1000
+# max size (utf-8 encoded strings) of the rows per INSERT, well below max_allowed_packet of MySQL (4 MiB by default
+# in 5.6/5.7), which additionally counts the escaping and the statement
+MDSWRITER_BATCH_BYTES = 2 ** 20
+# max size of the (json encoded) records that iter_sorted_records sorts in memory, larger inputs are sorted in runs
+# of this size in temporary files
+SORT_RUN_BYTES = 2 ** 26
+# see SqlChunkWriter
+SQL_ROWS_PER_INSERT = 500
+SQL_ROWS_PER_FILE = 50000
+# escaping of string literals as mysql_real_escape_string
+SQL_ESCAPES = str.maketrans({'\\': '\\\\', "'": "\\'", '"': '\\"', '\0': '\\0', '\n': '\\n', '\r': '\\r',
+                             '\x1a': '\\Z'})
+
 
 def flatten(l):
     return [item for sublist in l for item in sublist]
@@ -51,35 +121,373 @@ def get_intents_from_tsv(path, filter_columns=None, scrape_flag_column=None, scr
     return intents
 
 
+def json_loads(line):
+    if JSON_BACKEND == JSON_BACKEND_ORJSON:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def json_dumps(obj):
+    """
+    :return: the json encoded object as utf-8 encoded bytes
+    """
+    if JSON_BACKEND == JSON_BACKEND_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def open_jl(path, mode='rb'):
+    """
+    Open a (json lines) file in binary mode. Files ending with .gz or .zst are (de)compressed transparently.
+
+    :param mode: one of 'rb', 'wb' or 'ab'
+    """
+    assert mode in ('rb', 'wb', 'ab'), 'unsupported mode: %s' % mode
+    path = str(path)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    if path.endswith('.zst'):
+        import zstandard
+        if mode == 'rb':
+            # appending creates multiple frames
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True))
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, mode))
+    return open(path, mode)
+
+
+def iter_jl(path, key=None):
+    """
+    Yield the records of a json lines file one by one (see open_jl for compressed files).
+
+    :param key: if not None, yield tuples (record[key], record)
+    """
+    with open_jl(path) as f:
+        for line in f:
+            if line.strip() == b'':
+                continue
+            record = json_loads(line)
+            if key is not None:
+                yield record[key], record
+            else:
+                yield record
+
+
 def load_jl(path, key=None):
-    with open(path, 'r') as f:
-        res = [json.loads(q) for q in f.readlines()]
     if key is not None:
-        return {q[key]: q for q in res}
+        return dict(iter_jl(path, key=key))
     else:
+        return list(iter_jl(path))
+
+
+def load_jl_filtered(path, values, key='url'):
+    """
+    Load only the records whose key is in values, as dict of record[key] to record.
+    """
+    return {k: record for k, record in iter_jl(path, key=key) if k in values}
+
+
+def get_jl_stem(path):
+    # the file name without the .jl / .jsonl (and compression) extension
+    name = Path(path).name
+    for ext in ('.gz', '.zst'):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return os.path.splitext(name)[0]
+
+
+class JlWriter(object):
+    """
+    Write records to a json lines file one by one (see open_jl for compressed files).
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.file = open_jl(path, 'ab' if append else 'wb')
+        self.count = 0
+
+    def write(self, row):
+        self.file.write(json_dumps(row) + b'\n')
+        self.count += 1
+
+    def writelines(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def truncate_incomplete_line(path):
+    """
+    Cut off a trailing line without newline (written by a process that was killed), so that new lines can be appended.
+    """
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = end
+        # search backwards for the last newline
+        while pos > 0:
+            step = min(pos, 65536)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            idx = chunk.rfind(b'\n')
+            if idx >= 0:
+                pos = pos - step + idx + 1
+                break
+            pos -= step
+        if pos < end:
+            logging.warning('truncate incomplete last line of %s (%i bytes)' % (path, end - pos))
+            f.truncate(pos)
+
+
+def load_done_urls(path, key='url'):
+    """
+    Collect the values of key from the items of a json lines file, e.g. the output of an interrupted crawl. Lines that
+    can not be decoded (e.g. the last line, if the crawl was killed while writing) are skipped.
+    """
+    res = set()
+    if path is None or not os.path.exists(path):
+        return res
+    if is_sqlite(path):
+        from questionscraper.poststore import PostStore
+        store = PostStore(path)
+        res = store.get_done_urls()
+        store.close()
         return res
+    with open_jl(path) as f:
+        for i, line in enumerate(f):
+            try:
+                res.add(json_loads(line)[key])
+            except (ValueError, KeyError):
+                logging.warning('skip incomplete line %i in %s' % (i + 1, path))
+    return res
 
 
 def dump_jl(rows, path, tsv_fieldnames=None):
     if isinstance(rows, dict):
         rows = rows.values()
     print('dump to %s' % path)
-    with open(path, 'w') as f:
-        if tsv_fieldnames is not None:
+    if tsv_fieldnames is not None:
+        with open(path, 'w') as f:
             w = csv.DictWriter(f, fieldnames=tsv_fieldnames, delimiter='\t', extrasaction='ignore', quoting=csv.QUOTE_ALL)
             w.writeheader()
             w.writerows(rows)
-        else:
-            f.writelines((json.dumps(row) + '\n' for row in rows))
-        f.flush()
+            f.flush()
+    else:
+        with JlWriter(path) as w:
+            w.writelines(rows)
+
+
+def is_compressed(path):
+    return str(path).endswith(('.gz', '.zst'))
+
+
+def get_jl_index_path(path, key='url'):
+    return '%s.%s.idx' % (path, key)
+
+
+def _tail_sha1(f, end):
+    # hash of the last (up to) JL_INDEX_TAIL bytes before end, used to check that an indexed file was only appended to
+    start = max(0, end - JL_INDEX_TAIL)
+    f.seek(start)
+    return hashlib.sha1(f.read(end - start)).hexdigest()
+
+
+def build_jl_index(path, key='url', index=None):
+    """
+    Record the byte offset and length of every complete line of the uncompressed json lines file path, per value of
+    key (for values that occur multiple times, the last line wins).
+
+    :param index: a previous index of the same file. If given, only the lines after index['size'] are scanned.
+    :return: dict with key, size (indexed bytes), file_size, mtime_ns, tail_sha1 and offsets (value of key to
+             [offset, length])
+    """
+    assert not is_compressed(path), 'random access needs an uncompressed json lines file: %s' % path
+    offsets = {} if index is None else index['offsets']
+    pos = 0 if index is None else index['size']
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        f.seek(pos)
+        for line in f:
+            if not line.endswith(b'\n'):
+                # incomplete last line (the file is still written)
+                break
+            if line.strip() != b'':
+                offsets[json_loads(line)[key]] = [pos, len(line)]
+            pos += len(line)
+        tail_sha1 = _tail_sha1(f, pos)
+    return {'key': key, 'size': pos, 'file_size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'tail_sha1': tail_sha1,
+            'offsets': offsets}
+
+
+def load_jl_index(path, key='url'):
+    """
+    Load the index of path (see build_jl_index) from the index file next to it. The index is rebuilt (or extended, if
+    lines were only appended to the file) and saved again, if the file changed since the index was created.
+    """
+    index_path = get_jl_index_path(path, key)
+    index = None
+    if os.path.exists(index_path):
+        with open(index_path, 'rb') as f:
+            index = json_loads(f.read())
+        stat = os.stat(path)
+        if index['key'] == key and index['file_size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+            return index
+        # check that the indexed part is unchanged, i.e. the file was only appended to
+        with open(path, 'rb') as f:
+            appended = stat.st_size >= index['size'] and _tail_sha1(f, index['size']) == index['tail_sha1']
+        if index['key'] != key or not appended:
+            index = None
+        logging.info('%s index of %s: %s' % ('extend' if index is not None else 'rebuild', path, index_path))
+    index = build_jl_index(path, key=key, index=index)
+    try:
+        with open(index_path + '.tmp', 'wb') as f:
+            f.write(json_dumps(index))
+        os.replace(index_path + '.tmp', index_path)
+    except OSError as e:
+        logging.warning('could not save index %s: %s' % (index_path, e))
+    return index
+
+
+class JlIndex(Mapping):
+    """
+    Read only mapping of the values of key to the records of an uncompressed json lines file. The file is accessed via
+    mmap and only the records that are looked up are decoded (every lookup returns a new dict).
+    """
+
+    def __init__(self, path, key='url'):
+        self.path = path
+        self.offsets = load_jl_index(path, key=key)['offsets']
+        self.file = open(path, 'rb')
+        # mmap does not support empty files
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if len(self.offsets) > 0 else None
+
+    def __getitem__(self, k):
+        offset, length = self.offsets[k]
+        return json_loads(self.mm[offset:offset + length])
+
+    def __contains__(self, k):
+        return k in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load_jl_lookup(path, values, key='url'):
+    """
+    Get a mapping of the values of key to records of the json lines file path that contains (at least) the records
+    for values: a JlIndex for uncompressed files, otherwise the loaded records for values (see load_jl_filtered).
+    """
+    if is_compressed(path):
+        return load_jl_filtered(path, values, key=key)
+    return JlIndex(path, key=key)
+
+
+def is_sqlite(path):
+    return str(path).endswith(SQLITE_EXTENSIONS)
+
+
+def iter_intents(path):
+    """
+    Yield the intents from a json lines file or a PostStore (sqlite file, see questionscraper/poststore.py).
+    """
+    if is_sqlite(path):
+        from questionscraper.poststore import PostStore
+        store = PostStore(path)
+        yield from store.iter_intents()
+        store.close()
+    else:
+        yield from iter_jl(path)
 
 
-def get_link_to_intent_mapping(intends, links_key):
-    res = {}
-    for intent in intends:
-        for link in intent[links_key]:
-            res[link] = intent[INTENT_TEXT].strip()
-    return res
+def iter_scraped(path, kind):
+    """
+    Yield tuples (url, item) from a scraped json lines file or a PostStore (sqlite file).
+
+    :param kind: SCRAPED_THREADS (items of QuestionsSpider) or SCRAPED_ANSWERS (items of AnswersSpider)
+    """
+    if is_sqlite(path):
+        from questionscraper.poststore import PostStore
+        store = PostStore(path)
+        items = store.iter_threads() if kind == SCRAPED_THREADS else store.iter_answers()
+        yield from ((item['url'], item) for item in items)
+        store.close()
+    else:
+        yield from iter_jl(path, key='url')
+
+
+def load_scraped_lookup(path, urls, kind):
+    """
+    Get a mapping of url to scraped item that contains (at least) the items for urls: a lookup into the PostStore for
+    sqlite files, otherwise see load_jl_lookup.
+
+    :param kind: SCRAPED_THREADS (items of QuestionsSpider) or SCRAPED_ANSWERS (items of AnswersSpider)
+    """
+    if is_sqlite(path):
+        from questionscraper.poststore import PostStore
+        store = PostStore(path)
+        return store.threads() if kind == SCRAPED_THREADS else store.answers()
+    return load_jl_lookup(path, urls, key='url')
+
+
+class LinkIndex(Mapping):
+    """
+    Inverted index of the links of intents: mapping of url to the list of the ids of all intents that link it (in
+    intent order). The intent texts (stripped) are kept in texts (intent id -> text).
+
+        index = LinkIndex(intents)
+        if url in index:
+            topics = [index.texts[intent_id] for intent_id in index[url]]
+
+    :param links_key: the links that are indexed, e.g. 'links' or 'relevant_answer_links'
+    """
+
+    def __init__(self, intents, links_key='links'):
+        self.index = {}
+        self.texts = {}
+        for intent in intents:
+            intent_id = intent[INTENT_ID]
+            self.texts[intent_id] = intent[INTENT_TEXT].strip()
+            for link in intent[links_key]:
+                ids = self.index.setdefault(link, [])
+                # an intent may contain a link more than once
+                if intent_id not in ids:
+                    ids.append(intent_id)
+
+    def __getitem__(self, url):
+        return self.index[url]
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
 
 
 def create_sql_inserts_answers(directory='answers'):
@@ -92,50 +500,407 @@ def create_sql_inserts_questions(directory='questions'):
                        scraped_questions_jsonl=os.path.join(directory, 'scraped.jl'), insert=False)
 
 
-def join_answers_marked(answers, nlp=None):
+def split_placeholders(content):
+    """
+    Replace the markup ([CAPTION]{{arg0}}{{arg1}}..., see questionscraper.markup) of content_cleaned by PLACEHOLDER.
+
+    :return: tuple (texts, markups, paragraphs), paragraphs are the non empty paragraphs of the text with placeholders
+    """
+    assert 'PLACEHOLDER' not in content, 'PLACEHOLDER in content_cleaned'
+    # flat: the text of quotes that start with other markup (e.g. "[LINK_PROFILE]{{..}}{{..}} schrieb:") is split
+    texts, markups = split_markup(tokenize(content, nested=False))
+    paragraphs = [p for p in 'PLACEHOLDER'.join(texts).split('\n\n') if p.strip() != '']
+    return texts, markups, paragraphs
+
+
+def join_sentences_marked(texts, markups, paragraphs_sentences):
+    """
+    Join the split sentences (list of sentences per paragraph, see split_placeholders) by "|\n" (paragraphs by
+    "|\n\n") and put the markup back in place of the placeholders.
+    """
+    text_marked = '|\n\n'.join(['|\n'.join(sentences) for sentences in paragraphs_sentences])
+    parts_marked = text_marked.split('PLACEHOLDER')
+    assert len(parts_marked) == len(texts), 'wrong length'
+    return ''.join([parts_marked[i] + markups[i] for i in range(len(markups))] + [parts_marked[-1]])
+
+
+def utf16_len(s):
+    # CoreNLP (java) counts character offsets in UTF-16 code units
+    return len(s.encode('utf-16-le')) // 2
+
+
+def get_ssplit_properties(nlp):
+    properties = dict(getattr(nlp, 'default_properties', None) or {})
+    properties.update(NLP_SSPLIT_PROPERTIES)
+    return properties
+
+
+class SentenceCache(object):
+    """
+    Sqlite file that maps paragraphs to their split sentences. The key is the sha1 of the tokenizer properties and
+    the paragraph, i.e. entries of other properties (e.g. another language) are not used. If the stored sentences
+    exceed max_size bytes, the least recently used entries are removed (when the cache is closed).
+
+    Several processes can use the same file (see merge_answers_to_intents --workers).
+    """
+
+    def __init__(self, path, properties, max_size=SENTENCE_CACHE_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.prefix = json.dumps(properties, sort_keys=True).encode('utf-8') + b'\0'
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sentences (key TEXT PRIMARY KEY, sentences TEXT, size INTEGER, '
+                        'last_used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS sentences_last_used ON sentences (last_used)')
+        self.db.commit()
+
+    def get_key(self, paragraph):
+        return hashlib.sha1(self.prefix + paragraph.encode('utf-8')).hexdigest()
+
+    def get_many(self, paragraphs):
+        """
+        :return: list of sentences per paragraph, None for paragraphs that are not in the cache
+        """
+        keys = [self.get_key(p) for p in paragraphs]
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # stay below the maximal number of sql variables
+        for i in range(0, len(unique_keys), 500):
+            chunk = unique_keys[i:i + 500]
+            found.update(self.db.execute('SELECT key, sentences FROM sentences WHERE key IN (%s)'
+                                         % ','.join('?' * len(chunk)), chunk))
+        if found:
+            now = int(time.time())
+            self.db.executemany('UPDATE sentences SET last_used = ? WHERE key = ?', ((now, k) for k in found))
+            self.db.commit()
+        res = [json.loads(found[k]) if k in found else None for k in keys]
+        self.hits += sum(1 for r in res if r is not None)
+        self.misses += sum(1 for r in res if r is None)
+        return res
+
+    def put_many(self, paragraphs, sentences):
+        now = int(time.time())
+        rows = []
+        for p, ss in zip(paragraphs, sentences):
+            value = json.dumps(ss, ensure_ascii=False)
+            rows.append((self.get_key(p), value, len(value.encode('utf-8')), now))
+        self.db.executemany('INSERT OR REPLACE INTO sentences (key, sentences, size, last_used) VALUES (?, ?, ?, ?)',
+                            rows)
+        self.db.commit()
+
+    def get_size(self):
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM sentences').fetchone()[0]
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the size is below max_size.
+
+        :return: number of removed entries
+        """
+        excess = self.get_size() - self.max_size
+        if excess <= 0:
+            return 0
+        keys = []
+        for key, size in self.db.execute('SELECT key, size FROM sentences ORDER BY last_used'):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.db.executemany('DELETE FROM sentences WHERE key = ?', keys)
+        self.db.commit()
+        return len(keys)
+
+    def close(self):
+        if self.db is not None:
+            removed = self.evict()
+            logging.info('sentence cache %s: %i hits, %i misses, %i entries removed'
+                         % (self.path, self.hits, self.misses, removed))
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def annotate_paragraphs(nlp, paragraphs):
+    """
+    Split the paragraphs into sentences with one request: the paragraphs are sent as one document, separated by
+    empty lines (always a sentence break, see NLP_SSPLIT_PROPERTIES), and the sentences are mapped back to the
+    paragraphs by their character offsets.
+
+    :return: list of sentences (strings) per paragraph
+    """
+    doc = nlp.annotate('\n\n'.join(paragraphs), properties=get_ssplit_properties(nlp))
+    ends = []
+    pos = 0
+    for p in paragraphs:
+        pos += utf16_len(p)
+        ends.append(pos)
+        pos += 2
+    res = [[] for _ in paragraphs]
+    i = 0
+    for sentence in doc.sentence:
+        if len(sentence.token) == 0:
+            continue
+        begin = sentence.token[0].beginChar
+        while begin >= ends[i]:
+            i += 1
+        res[i].append(corenlp.to_text(sentence))
+    return res
+
+
+class SentenceSplitter(object):
+    """
+    Interface of the sentence splitters used by mark_answers / merge_questions. split gets a list of paragraphs and
+    returns the list of sentences (strings) per paragraph, get_properties identifies the splitter and its
+    configuration (key of the SentenceCache entries).
+    """
+    name = None
+
+    def get_properties(self):
+        return {'splitter': self.name}
+
+    def split(self, paragraphs):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CoreNLPSplitter(SentenceSplitter):
+    """
+    Sentence splitting with a CoreNLP server: the paragraphs are packed into documents of at most NLP_BATCH_CHARS
+    characters, up to NLP_MAX_REQUESTS of them are annotated concurrently.
+    """
+    name = 'corenlp'
+
+    def __init__(self, client=None, start_server=True):
+        self.client = client if client is not None else create_nlp_client(start_server=start_server)
+
+    def get_properties(self):
+        # the properties of the server request (as used as cache key before there were other splitters)
+        return get_ssplit_properties(self.client)
+
+    def ensure_alive(self):
+        self.client.ensure_alive()
+
+    def split(self, paragraphs):
+        batches = []
+        size = 0
+        for p in paragraphs:
+            if not batches or size + len(p) > NLP_BATCH_CHARS:
+                batches.append([])
+                size = 0
+            batches[-1].append(p)
+            size += len(p) + 2
+        if len(batches) <= 1:
+            return flatten(annotate_paragraphs(self.client, batch) for batch in batches)
+        # start the server (if needed) before the concurrent requests, each of them would start one otherwise
+        self.ensure_alive()
+        with ThreadPoolExecutor(min(NLP_MAX_REQUESTS, len(batches))) as executor:
+            return flatten(executor.map(lambda batch: annotate_paragraphs(self.client, batch), batches))
+
+
+class SpacySplitter(SentenceSplitter):
+    """
+    Sentence splitting with a spaCy model (in process, no server needed). The paragraphs are processed with
+    nlp.pipe, i.e. in batches of batch_size and, if n_process > 1, by several processes. Only the components that
+    are needed for the sentence boundaries are enabled.
+    """
+    name = 'spacy'
+
+    def __init__(self, model=SPACY_MODEL, n_process=1, batch_size=256):
+        import spacy
+        self.model = model
+        self.n_process = n_process
+        self.batch_size = batch_size
+        self.nlp = spacy.load(model)
+        self.nlp.select_pipes(disable=[p for p in SPACY_DISABLE if p in self.nlp.pipe_names])
+        self.version = spacy.__version__
+
+    def get_properties(self):
+        return {'splitter': self.name, 'model': self.model, 'version': self.version}
+
+    def split(self, paragraphs):
+        return [[sent.text.strip() for sent in doc.sents if sent.text.strip() != '']
+                for doc in self.nlp.pipe(paragraphs, batch_size=self.batch_size, n_process=self.n_process)]
+
+
+class RuleSplitter(SentenceSplitter):
+    """
+    Fast rule based splitter for German: a sentence ends with ".", "!", "?" or "…" (optionally followed by quotes or
+    closing brackets) before whitespace. A single "." does not end a sentence after an abbreviation (see
+    GERMAN_ABBREVIATIONS, also street names like "Hauptstr."), a single letter or an ordinal number: a number that is
+    followed by a month (e.g. "am 3. Mai", see GERMAN_MONTHS), a word in lower case or another number, and a number
+    with one or two digits that is followed by any word (e.g. "ca. 10. Stück"). An ellipsis ends a sentence only if
+    the next word starts in upper case.
+    """
+    name = 'rules'
+    # increase if the rules change (part of the cache key)
+    version = 2
+
+    def get_properties(self):
+        return {'splitter': self.name, 'version': self.version}
+
+    @staticmethod
+    def is_sentence_end(paragraph, m):
+        punct = m.group(1)
+        following = paragraph[m.end():].lstrip()[:1]
+        if '!' in punct or '?' in punct:
+            # not within brackets, e.g. "nein (wirklich!) das ..."
+            return not (following.islower() and (')' in m.group(2) or ']' in m.group(2)))
+        if punct != '.':
+            # ellipsis, often used within a sentence
+            return following.isupper()
+        word_start = m.start()
+        while word_start > 0 and not paragraph[word_start - 1].isspace():
+            word_start -= 1
+        word = paragraph[word_start:m.start()]
+        if word.lower() in GERMAN_ABBREVIATIONS or word.lower().endswith('str') or (len(word) == 1 and word.isalpha()):
+            return False
+        if word.isdigit():
+            if following.islower() or following.isdigit() or (len(word) <= 2 and following.isalpha()):
+                return False
+            following_word = re.match(r'\w*', paragraph[m.end():].lstrip()).group(0)
+            return following_word.lower() not in GERMAN_MONTHS
+        return True
+
+    def split_paragraph(self, paragraph):
+        res = []
+        start = 0
+        for m in RULE_SENTENCE_END.finditer(paragraph):
+            if self.is_sentence_end(paragraph, m):
+                res.append(paragraph[start:m.end(2)])
+                start = m.end(2)
+        res.append(paragraph[start:])
+        return [sentence.strip() for sentence in res if sentence.strip() != '']
+
+    def split(self, paragraphs):
+        return [self.split_paragraph(p) for p in paragraphs]
+
+
+def create_splitter(name=SPLITTER_CORENLP, start_server=True):
+    """
+    :param name: one of SPLITTERS
+    :param start_server: start the CoreNLP server (corenlp only), otherwise connect to a running one
+    """
+    if name == SPLITTER_CORENLP:
+        return CoreNLPSplitter(start_server=start_server)
+    elif name == SPLITTER_SPACY:
+        return SpacySplitter()
+    elif name == SPLITTER_RULES:
+        return RuleSplitter()
+    raise ValueError('unknown splitter: %s (use one of: %s)' % (name, ', '.join(SPLITTERS)))
+
+
+def get_splitter(nlp):
+    # a CoreNLPClient can be passed wherever a splitter is expected
+    if nlp is None or isinstance(nlp, SentenceSplitter):
+        return nlp
+    return CoreNLPSplitter(client=nlp)
+
+
+def split_sentences(nlp, paragraphs, cache=None):
+    """
+    Split paragraphs into sentences.
+
+    :param nlp: the SentenceSplitter (or CoreNLPClient)
+    :param paragraphs: list of paragraphs (without empty lines)
+    :param cache: optional SentenceCache, only paragraphs that are not in it are passed to the splitter
+    :return: list of sentences (strings) per paragraph
+    """
+    splitter = get_splitter(nlp)
+    if cache is None:
+        return splitter.split(paragraphs)
+    res = cache.get_many(paragraphs)
+    missing = list(dict.fromkeys(p for p, r in zip(paragraphs, res) if r is None))
+    if missing:
+        missing_sentences = splitter.split(missing)
+        cache.put_many(missing, missing_sentences)
+        missing = dict(zip(missing, missing_sentences))
+        res = [missing[p] if r is None else r for p, r in zip(paragraphs, res)]
+    return res
+
+
+def mark_answers(answers, nlp=None, cache=None):
+    """
+    Create the marked texts of the answers: "----- URL -----" followed by content_cleaned. If nlp (SentenceSplitter)
+    is given, the sentences are split and separated by "|\n" (paragraphs by "|\n\n"). The paragraphs of all answers
+    are split together (see split_sentences).
+
+    :param cache: optional SentenceCache
+    :return: list of marked texts, one per answer
+    """
+    if nlp is None:
+        return ['----- %s -----\n%s' % (a['url'], a['content_cleaned']) for a in answers]
+    prepared = [split_placeholders(a['content_cleaned']) for a in answers]
+    sentences = split_sentences(nlp, flatten(paragraphs for _, _, paragraphs in prepared), cache=cache)
     res = []
+    pos = 0
+    for a, (texts, markups, paragraphs) in zip(answers, prepared):
+        merged = join_sentences_marked(texts, markups, sentences[pos:pos + len(paragraphs)])
+        pos += len(paragraphs)
+        res.append('----- %s -----\n%s' % (a['url'], merged))
+    #paragraphs = ['|\n'.join(map(lambda x: re.sub(r' +', ' ', str(x).strip().replace('\n', ' ')), nlp(p).sents))
+    #              for p in a['content_cleaned'].split('\n\n') if p.strip() != '']
+    return res
+
+
+def mark_answer(a, nlp=None):
+    """
+    Create the marked text of one answer, see mark_answers.
+    """
+    return mark_answers([a], nlp=nlp)[0]
+
+
+def join_answers_marked(answers, nlp=None, cache=None):
+    res = mark_answers(answers, nlp=nlp, cache=cache)
     if nlp is not None:
-        for a in answers:
-            # re.split returns: TEXT, CAPTION, ALL_ARGUMENTS, LAST_ARGUMENT, TEXT, ..., TEXTAFTER
-            # where TYPE = [caption_text] and ALL_ARGUMENTS = {arg0}{arg1}...
-            # LAST_ARGUMENT is required for splitting and should NOT be used any further
-            assert 'PLACEHOLDER' not in a['content_cleaned'], 'PLACEHOLDER in content_cleaned'
-            parts = re.split(r'(\[[^\]]+\])(({{[^}]*}})+)', a['content_cleaned'])
-            if len(parts) > 1:
-                parts_arranged = [(parts[i], parts[i + 1] + parts[i + 2]) for i in range(0, len(parts) - 1, 4)]
-                texts, captions_args = zip(*parts_arranged)
-                # append TEXTAFTER
-                texts += (parts[-1],)
-            else:
-                texts, captions_args = (parts[0],), ()
-            text_placeholders = ''.join(['%sPLACEHOLDER' % texts[i] for i in range(len(captions_args))] + [texts[-1]])
-            #texts_marked = []
-            #for text in texts:
-            paragraphs = [p for p in text_placeholders.split('\n\n') if p.strip() != '']
-            paragraphs_marked = []
-            for p in paragraphs:
-                if p.strip() != '':
-                    ann = nlp.annotate(p)
-                    paragraphs_marked.append('|\n'.join([corenlp.to_text(s) for s in ann.sentence]))
-                #else:
-                #    paragraphs_marked.append(p)
-            text_marked = '|\n\n'.join(paragraphs_marked)
-            parts_marked = re.split(r'(PLACEHOLDER)', text_marked)
-            assert len(parts_marked) == len(texts) + len(captions_args), 'wrong length'
-            merged = ''.join([parts_marked[i*2] + captions_args[i] for i in range(len(captions_args))] + [parts_marked[-1]])
-            #parts_marked = [texts_marked[i] + captions_args[i] for i in range(len(captions_args))] + [texts_marked[-1]]
-            #paragraphs_marked.append('|\n'.join([part for part in parts_marked if part.strip() != '']))
-
-
-            #paragraphs = ['|\n'.join(map(lambda x: re.sub(r' +', ' ', str(x).strip().replace('\n', ' ')), nlp(p).sents))
-            #              for p in a['content_cleaned'].split('\n\n') if p.strip() != '']
-            res.append('----- %s -----\n%s' % (a['url'], merged))
         return '|\n\n'.join(res)
     else:
-        res = ['----- %s -----\n%s' % (a['url'], a['content_cleaned']) for a in answers]
         return '\n\n'.join(res)
 
 
+def create_nlp_client(start_server=True):
+    """
+    Create the CoreNLPClient used for sentence splitting (server at localhost:9001).
+
+    :param start_server: if False, connect to an already running server
+    """
+    props = {'tokenize.language': 'de'}
+    #props = {'tokenize.language': 'en'}
+    return corenlp.CoreNLPClient(start_server=start_server, annotators="tokenize ssplit".split(),
+                                 endpoint="http://localhost:9001", properties=props)
+
+
+# set per worker process by init_merge_worker
+_merge_worker = {}
+
+
+def init_merge_worker(scraped_path, urls, kind, splitter=None, sentence_cache=None):
+    # every worker opens the scraped file (or store) on its own: JlIndex maps the file read only, i.e. the pages are
+    # shared via the page cache. Compressed files are loaded once per worker.
+    _merge_worker['scraped'] = load_scraped_lookup(scraped_path, urls, kind)
+    _merge_worker['kind'] = kind
+    _merge_worker['nlp'] = create_splitter(splitter, start_server=False) if splitter is not None else None
+    # the entries are committed immediately, eviction is done by the main process
+    _merge_worker['cache'] = SentenceCache(sentence_cache, _merge_worker['nlp'].get_properties()) \
+        if splitter is not None and sentence_cache is not None else None
+
+
+def merge_intent(intent):
+    if _merge_worker['kind'] == SCRAPED_ANSWERS:
+        return next(merge_answers([intent], _merge_worker['scraped']))
+    return next(merge_questions([intent], _merge_worker['scraped'], nlp=_merge_worker['nlp'],
+                                cache=_merge_worker['cache']))
+
+
 @plac.annotations(
     intents_jsonl=('path to intents_jsonl', 'option', 'i', str),
     out_dir=('path to out_dir', 'option', 'o', str),
@@ -143,145 +908,467 @@ def join_answers_marked(answers, nlp=None):
     scraped_answers_jsonl=('path to scraped_answers_jsonl', 'option', 'a', str),
     split_sentences=('create split-sentences field', 'flag', 's'),
     debug=('enable debug mode', 'flag', 'd'),
+    store=('additionally write the merged intents to this PostStore (sqlite file)', 'option', 'S', str),
+    workers=('number of worker processes that merge the intents', 'option', 'w', int),
+    sentence_cache=('sqlite file that caches the split sentences of paragraphs (with -s)', 'option', 'c', str),
+    splitter=('sentence splitter (with -s)', 'option', 'p', str, SPLITTERS),
 )
 def merge_answers_to_intents(intents_jsonl, out_dir, scraped_questions_jsonl=None, scraped_answers_jsonl=None,
-                             split_sentences=False, debug=False):
+                             split_sentences=False, debug=False, store=None, workers=1, sentence_cache=None,
+                             splitter=SPLITTER_CORENLP):
     logging.info('intents_jsonl=%s  out_dir=%s  scraped_questions_jsonl=%s  scraped_answers_jsonl=%s'
                  % (intents_jsonl, out_dir, scraped_questions_jsonl, scraped_answers_jsonl))
+    # the intents are read while the merged ones are written, a second connection to the same file would block
+    assert store is None or os.path.abspath(store) != os.path.abspath(intents_jsonl), \
+        'the store (-S) must not be the intents file, please write the merged intents to another store'
     if split_sentences:
         #nlp = spacy.load('de')
         #logging.info('german spacy model loaded successfully')
-        if debug:
+        if debug and splitter == SPLITTER_CORENLP:
             os.environ['CORENLP_HOME'] = '/mnt/DATA2/TMP/stanford-corenlp-full-2018-02-27'
 
-        props = {'tokenize.language': 'de'}
-        #props = {'tokenize.language': 'en'}
-        logging.info('enable sentence splitting')
-        nlp = corenlp.CoreNLPClient(annotators="tokenize ssplit".split(), endpoint="http://localhost:9001", properties=props)
+        logging.info('enable sentence splitting (%s)' % splitter)
+        nlp = create_splitter(splitter)
     else:
         nlp = None
+    cache = SentenceCache(sentence_cache, nlp.get_properties()) \
+        if nlp is not None and sentence_cache is not None else None
     #try:
-    intents = load_jl(intents_jsonl)
     assert scraped_questions_jsonl is None or scraped_answers_jsonl is None, \
         'please provide just one question OR answer file'
     if scraped_answers_jsonl is not None:
-        answers = load_jl(scraped_answers_jsonl, key='url')
-        for i in range(len(intents)):
-            intents[i]['answers'] = [answers[url] for url in intents[i]['links'] if url in answers]
-
-            dif = len(intents[i]['links']) - len(set(intents[i]['links']))
-            intents[i]['links'] = list(set(intents[i]['links']))
-            if dif > 0:
-                print('DUPLICATED LINKS FOR INTENT (id: %s; different: %i; duplicates: %i): %s' % (intents[i][INTENT_ID], len(intents[i]['links']), dif, intents[i][INTENT_TEXT]))
-            intents[i]['answers_plain'] = '\n\n'.join((a['content_cleaned'] for a in intents[i]['answers'] if not a['has_quote']))
+        scraped_path, kind = scraped_answers_jsonl, SCRAPED_ANSWERS
     elif scraped_questions_jsonl is not None:
-        questions = load_jl(scraped_questions_jsonl, key='url')
-        for i, intent in enumerate(intents):
-            dif = len(intents[i]['links']) - len(set(intents[i]['links']))
-            if dif > 0:
-                print('DUPLICATED LINKS FOR INTENT (id: %s; different: %i; duplicates: %i): %s' % (intents[i][INTENT_ID], len(intents[i]['links']), dif, intents[i][INTENT_TEXT]))
-            intents[i]['questions'] = [questions[url] for url in set(intents[i]['links']) if url in questions]
-            for j, q in enumerate(intents[i]['questions']):
-                intents[i]['questions'][j]['nbr_answers'] = len(intents[i]['questions'][j]['answers'])
-                intents[i]['questions'][j]['nbr_answers_relevant'] = 0
-                for k, a in enumerate(q['answers']):
-                    if a['url'] in intent.get('relevant_answer_links', []):
-                        intents[i]['questions'][j]['answers'][k]['is_relevant'] = True
-                        intents[i]['questions'][j]['nbr_answers_relevant'] += 1
-                    else:
-                        intents[i]['questions'][j]['answers'][k]['is_relevant'] = False
-            answers = flatten([[a for a in q['answers']] for q in intents[i]['questions']])
-            answers_relevant = flatten([[a for a in q['answers'] if a['is_relevant']] for q in intents[i]['questions']])
-            intents[i]['answers_plain'] = '\n\n'.join([a['content_cleaned'] for a in answers])
-            intents[i]['answers_plain_relevant'] = '\n\n'.join([a['content_cleaned'] for a in answers_relevant])
-
-
-
-            intents[i]['answers_plain_marked'] = join_answers_marked(answers)
-            intents[i]['answers_plain_marked_relevant'] = join_answers_marked(answers_relevant)
-
-            if split_sentences:
-                intents[i]['answers_plain_marked_sentences'] = join_answers_marked(answers, nlp=nlp)
-                intents[i]['answers_plain_marked_sentences_relevant'] = join_answers_marked(answers_relevant, nlp=nlp)
-
-            intents[i]['nbr_answers'] = sum([q['nbr_answers'] for q in intents[i]['questions']])
-            intents[i]['nbr_answers_relevant'] = sum([q['nbr_answers_relevant'] for q in intents[i]['questions']])
-
-            intents[i]['nbr_words'] = len(intents[i]['answers_plain'].split())
-            intents[i]['nbr_words_relevant'] = len(intents[i]['answers_plain_relevant'].split())
-
-            intents[i]['nbr_original_relevant_answer_links'] = len(intents[i]['original_relevant_answer_links'])
-            intents[i]['nbr_questions'] = len(intents[i]['questions'])
-
+        scraped_path, kind = scraped_questions_jsonl, SCRAPED_THREADS
     else:
         raise AssertionError('please provide a question or answer file')
+    # load only the scraped items that are linked from any intent
+    intent_links = set(flatten(intent['links'] for intent in iter_intents(intents_jsonl)))
+    fn_out_stem = (Path(out_dir) / (get_jl_stem(intents_jsonl) + '_merged')).resolve()
+    if isinstance(nlp, CoreNLPSplitter):
+        # start the server once, the workers (and concurrent requests) connect to it
+        nlp.ensure_alive()
+    if workers > 1:
+        logging.info('merge with %i workers' % workers)
+        with Pool(workers, initializer=init_merge_worker,
+                  initargs=(scraped_path, intent_links, kind, splitter if nlp is not None else None,
+                            sentence_cache)) as pool:
+            # imap keeps the order of the intents
+            dump_merged_intents(pool.imap(merge_intent, iter_intents(intents_jsonl)), fn_out_stem, store=store)
+    else:
+        scraped = load_scraped_lookup(scraped_path, intent_links, kind)
+        if kind == SCRAPED_ANSWERS:
+            intents = merge_answers(iter_intents(intents_jsonl), scraped)
+        else:
+            intents = merge_questions(iter_intents(intents_jsonl), scraped, nlp=nlp, cache=cache)
+        dump_merged_intents(intents, fn_out_stem, store=store)
+        if hasattr(scraped, 'close'):
+            scraped.close()
+    if cache is not None:
+        cache.close()
+    if nlp is not None:
+        nlp.close()
     #finally:
     #    pass
         #if nlp is not None:
         #    nlp.stop()
 
-    fn_out_stem = (Path(out_dir) / (Path(intents_jsonl).stem + '_merged')).resolve()
-    dump_jl(intents, fn_out_stem.with_suffix('.jl'))
-    tsv_fieldnames = [k for k in intents[0].keys() if k not in ['answers', 'questions'] and not k.startswith('answers_plain')]
-    tsv_fieldnames += [k for k in intents[0].keys() if k.startswith('answers_plain')]
-    dump_jl(intents, fn_out_stem.with_suffix('.tsv'), tsv_fieldnames=tsv_fieldnames)
 
-
-def get_answers_and_intent_and_mapping(intents_jsonl, scraped_questions_jsonl=None, scraped_answers_jsonl=None):
-    intents = load_jl(intents_jsonl)
+def merge_answers(intents, answers):
+    """
+    Add the scraped answers to the intents.
+
+    :param intents: iterable of intents
+    :param answers: dict of answer url to scraped answer
+    :return: generator of the merged intents
+    """
+    for intent in intents:
+        intent['answers'] = [answers[url] for url in intent['links'] if url in answers]
+
+        dif = len(intent['links']) - len(set(intent['links']))
+        # remove duplicates, but keep the order (independent of the hash seed, e.g. of worker processes)
+        intent['links'] = list(dict.fromkeys(intent['links']))
+        if dif > 0:
+            print('DUPLICATED LINKS FOR INTENT (id: %s; different: %i; duplicates: %i): %s' % (intent[INTENT_ID], len(intent['links']), dif, intent[INTENT_TEXT]))
+        intent['answers_plain'] = '\n\n'.join((a['content_cleaned'] for a in intent['answers'] if not a['has_quote']))
+        yield intent
+
+
+def merge_questions(intents, questions, nlp=None, cache=None):
+    """
+    Add the scraped questions (threads) to the intents and mark the relevant answers. Every answer is visited once
+    and split into sentences at most once (the relevant fields reuse the texts of all answers).
+
+    :param intents: iterable of intents
+    :param questions: dict of thread url to scraped question
+    :param nlp: if not None, the SentenceSplitter (or CoreNLPClient) used to create the sentence split fields
+    :param cache: optional SentenceCache for the sentence splitting
+    :return: generator of the merged intents
+    """
+    for intent in intents:
+        dif = len(intent['links']) - len(set(intent['links']))
+        if dif > 0:
+            print('DUPLICATED LINKS FOR INTENT (id: %s; different: %i; duplicates: %i): %s' % (intent[INTENT_ID], len(intent['links']), dif, intent[INTENT_TEXT]))
+        # in link order, without duplicates
+        intent['questions'] = [questions[url] for url in dict.fromkeys(intent['links']) if url in questions]
+        relevant_links = set(intent.get('relevant_answer_links', []))
+        # collect all derived fields in one pass over the answers
+        plain, plain_relevant = [], []
+        marked, marked_relevant = [], []
+        sentences, sentences_relevant = [], []
+        nbr_words, nbr_words_relevant = 0, 0
+        if nlp is not None:
+            # split the sentences of all answers of the intent with a few requests
+            answers_sentences = iter(mark_answers(flatten(q['answers'] for q in intent['questions']), nlp=nlp,
+                                                  cache=cache))
+        for q in intent['questions']:
+            q['nbr_answers'] = len(q['answers'])
+            q['nbr_answers_relevant'] = 0
+            for a in q['answers']:
+                a['is_relevant'] = a['url'] in relevant_links
+                # equals the number of words of the joined text
+                words = len(a['content_cleaned'].split())
+                a_marked = mark_answer(a)
+                a_sentences = next(answers_sentences) if nlp is not None else None
+                plain.append(a['content_cleaned'])
+                marked.append(a_marked)
+                sentences.append(a_sentences)
+                nbr_words += words
+                if a['is_relevant']:
+                    q['nbr_answers_relevant'] += 1
+                    plain_relevant.append(a['content_cleaned'])
+                    marked_relevant.append(a_marked)
+                    sentences_relevant.append(a_sentences)
+                    nbr_words_relevant += words
+        intent['answers_plain'] = '\n\n'.join(plain)
+        intent['answers_plain_relevant'] = '\n\n'.join(plain_relevant)
+
+        intent['answers_plain_marked'] = '\n\n'.join(marked)
+        intent['answers_plain_marked_relevant'] = '\n\n'.join(marked_relevant)
+
+        if nlp is not None:
+            intent['answers_plain_marked_sentences'] = '|\n\n'.join(sentences)
+            intent['answers_plain_marked_sentences_relevant'] = '|\n\n'.join(sentences_relevant)
+
+        intent['nbr_answers'] = sum([q['nbr_answers'] for q in intent['questions']])
+        intent['nbr_answers_relevant'] = sum([q['nbr_answers_relevant'] for q in intent['questions']])
+
+        intent['nbr_words'] = nbr_words
+        intent['nbr_words_relevant'] = nbr_words_relevant
+
+        intent['nbr_original_relevant_answer_links'] = len(intent['original_relevant_answer_links'])
+        intent['nbr_questions'] = len(intent['questions'])
+        # the is_relevant flags of shared questions are overwritten by the next intent, so write this one out now
+        yield intent
+
+
+def dump_merged_intents(intents, fn_out_stem, store=None):
+    """
+    Write the merged intents one by one to FN_OUT_STEM.jl and FN_OUT_STEM.tsv (without answers and questions).
+
+    :param store: if not None, path of a PostStore (sqlite file) the intents are written to as well
+    """
+    if store is not None:
+        from questionscraper.poststore import PostStore
+        post_store = PostStore(store)
+    fn_out_stem = Path(fn_out_stem)
+    print('dump to %s and %s' % (fn_out_stem.with_suffix('.jl'), fn_out_stem.with_suffix('.tsv')))
+    with JlWriter(fn_out_stem.with_suffix('.jl')) as jl_out, open(fn_out_stem.with_suffix('.tsv'), 'w') as tsv_out:
+        tsv_writer = None
+        for intent in intents:
+            if tsv_writer is None:
+                tsv_fieldnames = [k for k in intent.keys() if k not in ['answers', 'questions'] and not k.startswith('answers_plain')]
+                tsv_fieldnames += [k for k in intent.keys() if k.startswith('answers_plain')]
+                tsv_writer = csv.DictWriter(tsv_out, fieldnames=tsv_fieldnames, delimiter='\t', extrasaction='ignore',
+                                            quoting=csv.QUOTE_ALL)
+                tsv_writer.writeheader()
+            jl_out.write(intent)
+            tsv_writer.writerow(intent)
+            if store is not None:
+                post_store.put_intent(intent)
+    if store is not None:
+        post_store.close()
+
+
+def iter_batches(rows, batch_rows, batch_bytes):
+    # lists of at most batch_rows rows whose strings take at most batch_bytes bytes (utf-8), a single larger row is
+    # a batch on its own
+    batch = []
+    nbr_bytes = 0
+    for row in rows:
+        row_bytes = sum(len(v.encode('utf-8')) for v in row if isinstance(v, str))
+        if batch and (len(batch) >= batch_rows or nbr_bytes + row_bytes > batch_bytes):
+            yield batch
+            batch = []
+            nbr_bytes = 0
+        batch.append(row)
+        nbr_bytes += row_bytes
+    if batch:
+        yield batch
+
+
+def insert_rows(cursor, table, columns, rows, placeholder='%s', batch_rows=MDSWRITER_BATCH_ROWS,
+                batch_bytes=MDSWRITER_BATCH_BYTES):
+    """
+    Insert rows with multi-row INSERT statements (bound parameters).
+
+    :return: number of inserted rows
+    """
+    values = '(%s)' % ', '.join([placeholder] * len(columns))
+    nbr_rows = 0
+    for batch in iter_batches(rows, batch_rows, batch_bytes):
+        cursor.execute('INSERT INTO %s (%s) VALUES %s' % (table, ', '.join(columns), ', '.join([values] * len(batch))),
+                       [v for row in batch for v in row])
+        nbr_rows += len(batch)
+    return nbr_rows
+
+
+def load_mdswriter(db, docsets, docs, placeholder='%s', batch_rows=MDSWRITER_BATCH_ROWS,
+                   batch_bytes=MDSWRITER_BATCH_BYTES):
+    """
+    Bulk load intents (st_docset) and their answers (st_doc) into the mdswriter database in one transaction. The
+    docsets are inserted first and their ids are read back with one query (they are assigned in insert order), so
+    the docs reference them directly.
+
+    :param db: DB-API connection, e.g. MySQLdb or sqlite3 (as stand-in)
+    :param docsets: list of tuples (key, topic), e.g. (intent id, intent text), one docset per entry
+    :param docs: iterable of tuples (doc_title, doc_text, key), the key of the docset of the doc
+    :param placeholder: parameter placeholder of the driver: '%s' (MySQLdb) or '?' (sqlite3)
+    :param batch_rows: max number of rows per INSERT statement (sqlite allows 32766 parameters, i.e. 10922 docs)
+    :param batch_bytes: max size of the texts per INSERT statement in bytes (keep it well below max_allowed_packet of
+        MySQL)
+    :return: tuple (number of docsets, number of docs)
+    """
+    missing = []
+
+    def iter_doc_rows(docset_ids):
+        for title, text, key in docs:
+            if key in docset_ids:
+                yield docset_ids[key], title, text
+            else:
+                missing.append(title)
+
+    c = db.cursor()
+    try:
+        c.execute('SELECT MAX(id) FROM st_docset')
+        max_id = c.fetchone()[0] or 0
+        nbr_docsets = insert_rows(c, 'st_docset', ['topic'], ((topic,) for _, topic in docsets),
+                                  placeholder=placeholder, batch_rows=batch_rows, batch_bytes=batch_bytes)
+        c.execute('SELECT id FROM st_docset WHERE id > %s ORDER BY id' % placeholder, (max_id,))
+        ids = [row[0] for row in c.fetchall()]
+        if len(ids) != nbr_docsets:
+            raise ValueError('expected %i new docsets, but found %i (concurrent inserts into st_docset?)'
+                             % (nbr_docsets, len(ids)))
+        docset_ids = {key: docset_id for docset_id, (key, _) in zip(ids, docsets)}
+        nbr_docs = insert_rows(c, 'st_doc', ['docset_id', 'doc_title', 'doc_text'], iter_doc_rows(docset_ids),
+                               placeholder=placeholder, batch_rows=batch_rows, batch_bytes=batch_bytes)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        c.close()
+    if missing:
+        logging.warning('no docset for %i docs, e.g. %s' % (len(missing), missing[0]))
+    return nbr_docsets, nbr_docs
+
+
+def iter_scraped_linked(path, urls, kind):
+    """
+    Yield tuples (url, item) for the scraped items of the urls, one item at a time (lookups into the index or store,
+    compressed files are read sequentially).
+    """
+    if is_compressed(path):
+        yield from ((url, item) for url, item in iter_scraped(path, kind) if url in urls)
+        return
+    lookup = load_scraped_lookup(path, urls, kind)
+    for url in lookup:
+        if url in urls:
+            yield url, lookup[url]
+
+
+def iter_linked_answers(link_index, scraped_questions_jsonl=None, scraped_answers_jsonl=None):
+    """
+    Yield tuples (answer url, answer, intent ids) for the answers that are linked from the intents (for scraped
+    questions: all answers of the linked threads) in the order of the scraped file, without loading all of them.
+
+    :param link_index: LinkIndex of the intents (for scraped questions: of the thread urls)
+    """
     assert scraped_questions_jsonl is None or scraped_answers_jsonl is None, 'please provide just one question OR answer file'
     if scraped_questions_jsonl is not None:
-        _links_to_intents = get_link_to_intent_mapping(intents, links_key='links')
-        questions = load_jl(scraped_questions_jsonl, key='url')
-        answers = {}
-        links_to_intents = {}
-        for question_url in questions:
-            # collect answers
-            answers.update({a['url']: a for a in questions[question_url]['answers']})
-            # map links again
-            links_to_intents.update(
-                {a['url']: _links_to_intents[question_url] for a in questions[question_url]['answers'] if
-                 question_url in _links_to_intents})
+        seen = set()
+        for question_url, question in iter_scraped_linked(scraped_questions_jsonl, link_index, SCRAPED_THREADS):
+            answers = {a['url']: a for a in question['answers'] if a['url'] not in seen}
+            seen.update(answers)
+            for answer_url, answer in answers.items():
+                yield answer_url, answer, link_index[question_url]
     elif scraped_answers_jsonl is not None:
-        links_to_intents = get_link_to_intent_mapping(intents, links_key='links')
-        answers = load_jl(scraped_answers_jsonl, key='url')
+        for answer_url, answer in iter_scraped_linked(scraped_answers_jsonl, link_index, SCRAPED_ANSWERS):
+            yield answer_url, answer, link_index[answer_url]
     else:
         raise AssertionError('please provide a question or answer file')
 
-    return answers, intents, links_to_intents
 
+def sql_quote(s):
+    return "'%s'" % s.translate(SQL_ESCAPES)
+
+
+class SqlChunkWriter(object):
+    """
+    Write rows as multi-row INSERT statements (rows_per_insert rows per statement) to a series of sql files
+    PREFIX.00001.sql, PREFIX.00002.sql, ... with rows_per_file rows each (or to PREFIX.sql, if rows_per_file is None).
+    Every file is one transaction, i.e. an import that failed can be resumed with the file that failed. Only the rows
+    of the current statement are kept in memory.
+
+    :param compression: None, 'gz' or 'zst' (see open_jl), e.g. PREFIX.00001.sql.gz
+    """
+
+    def __init__(self, prefix, table, columns, rows_per_insert=SQL_ROWS_PER_INSERT, rows_per_file=SQL_ROWS_PER_FILE,
+                 compression=None):
+        self.prefix = str(prefix)
+        self.insert = 'INSERT INTO %s (%s) VALUES\n' % (table, ', '.join(columns))
+        self.rows_per_insert = rows_per_insert
+        self.rows_per_file = rows_per_file
+        self.compression = compression
+        self.paths = []
+        self.file = None
+        self.rows = []
+        self.nbr_rows_file = 0
+        self.nbr_rows = 0
+        # the variables that are set in the current file
+        self.variables = set()
+
+    def open_file(self):
+        if self.rows_per_file is None:
+            path = '%s.sql' % self.prefix
+        else:
+            path = '%s.%05i.sql' % (self.prefix, len(self.paths) + 1)
+        if self.compression is not None:
+            path = '%s.%s' % (path, self.compression)
+        self.paths.append(path)
+        self.file = io.TextIOWrapper(open_jl(path, 'wb'), encoding='utf-8')
+        self.file.write('SET NAMES utf8mb4;\nSTART TRANSACTION;\n')
+        self.nbr_rows_file = 0
+        self.variables = set()
+
+    def write(self, row, variables=None):
+        """
+        :param row: sql expressions, one per column (e.g. sql_quote(text))
+        :param variables: dict of variables (e.g. '@docset_1') that the row uses to the sql expression that sets it,
+            it is set once per file before the first statement that uses it
+        """
+        if self.file is None:
+            self.open_file()
+        for name, expression in (variables or {}).items():
+            if name not in self.variables:
+                self.file.write('SET %s = %s;\n' % (name, expression))
+                self.variables.add(name)
+        self.rows.append('(%s)' % ', '.join(row))
+        self.nbr_rows_file += 1
+        self.nbr_rows += 1
+        if len(self.rows) >= self.rows_per_insert:
+            self.flush_insert()
+        if self.rows_per_file is not None and self.nbr_rows_file >= self.rows_per_file:
+            self.close_file()
+
+    def flush_insert(self):
+        if self.rows:
+            self.file.write(self.insert + ',\n'.join(self.rows) + ';\n')
+            self.rows = []
+
+    def close_file(self):
+        if self.file is not None:
+            self.flush_insert()
+            self.file.write('COMMIT;\n')
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        self.close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def get_docset_lookups(docsets):
+    """
+    Get the sql variable and the expression that looks up the docset of each intent after insert_intents.sql was
+    executed: the last docset with its text or, for intents with the same text, the one at the same position among
+    the last inserted docsets with that text.
+
+    :param docsets: list of tuples (intent id, topic) in insert order
+    :return: dict of intent id to tuple (variable, expression), the variables are numbered by the insert order
+    """
+    later = {}
+    res = {}
+    for row in reversed(range(len(docsets))):
+        intent_id, topic = docsets[row]
+        offset = later.get(topic, 0)
+        later[topic] = offset + 1
+        if offset == 0:
+            expression = '(SELECT MAX(id) FROM st_docset WHERE topic = %s)' % sql_quote(topic)
+        else:
+            expression = '(SELECT id FROM st_docset WHERE topic = %s ORDER BY id DESC LIMIT 1 OFFSET %i)' \
+                         % (sql_quote(topic), offset)
+        # the last intent wins for duplicated ids, as in load_mdswriter
+        res.setdefault(intent_id, ('@docset_%i' % (row + 1), expression))
+    return res
 
-def create_sql_inserts(intents_jsonl, scraped_questions_jsonl=None, scraped_answers_jsonl=None, insert=False):
-    #with open(intent_file_json, 'r') as f:
-    #    intents = json.load(f)
 
-    answers, intents, links_to_intents = get_answers_and_intent_and_mapping(intents_jsonl, scraped_questions_jsonl, scraped_answers_jsonl)
+def create_sql_inserts(intents_jsonl, scraped_questions_jsonl=None, scraped_answers_jsonl=None, insert=False,
+                       rows_per_insert=SQL_ROWS_PER_INSERT, rows_per_file=SQL_ROWS_PER_FILE, compression=None):
+    """
+    Write the sql files for mdswriter next to the intents file: insert_intents.sql (st_docset, one per intent),
+    insert_answers.00001.sql, ... (st_doc, the linked answers once per linking intent, see SqlChunkWriter) and
+    adjust_tables.sql. Every answers file looks up the docset of each intent once (see get_docset_lookups, i.e.
+    insert_intents.sql has to be executed before) and inserts rows_per_insert answers per statement. The answers are
+    streamed, i.e. memory does not depend on the size of the export.
+
+    :param insert: also load the intents and answers into the database (see load_mdswriter)
+    :param compression: None, 'gz' or 'zst'
+    """
+    intents = list(iter_intents(intents_jsonl))
+    # docsets for intents with text
+    docsets = [(intent[INTENT_ID], intent[INTENT_TEXT]) for intent in intents if intent[INTENT_TEXT] != '']
+    docset_lookups = get_docset_lookups(docsets)
+    link_index = LinkIndex(intents)
+    del intents
 
     dir = Path(intents_jsonl).parent
 
     # create inserts for st_docset (intents) like this:
     #
-    # INSERT INTO st_docset(topic)
-    # VALUES
-    # ("Mein WLAN ist langsam."),
-    # ("TESTTEST")
-
-    with open((dir / 'insert_intents.sql').resolve(), 'w') as insert_intents:
-        insert_intents.write('INSERT INTO st_docset(topic)\n')
-        insert_intents.write('VALUES\n')
-        lines = ',\n'.join(('("%s")' % intend[INTENT_TEXT].replace('"', '\'') for intend in intents if intend[INTENT_TEXT] != ''))
-        insert_intents.write(lines + ';')
-
-
-    # create inserts for st_doc like this:
-    # INSERT INTO st_doc(docset_id, doc_title, doc_text) SELECT id, "DOC_TITLE", "DOC_CONTENT" FROM st_docset WHERE topic = "Test topicX";
-
-    entries = [(answer_url, answers[answer_url]['content'].replace('"', '\''), links_to_intents[answer_url])
-               for answer_url in answers if answer_url in links_to_intents]
-    with open((dir / 'insert_answers.sql').resolve(), 'w') as insert_answers:
-        lines = ('INSERT INTO st_doc(docset_id, doc_title, doc_text) SELECT id, "%s", "%s" FROM st_docset WHERE topic = "%s";'
-                 % e for e in entries)
-        insert_answers.writelines(lines)
+    # INSERT INTO st_docset (topic) VALUES
+    # ('Mein WLAN ist langsam.'),
+    # ('TESTTEST');
+    with SqlChunkWriter(dir / 'insert_intents', 'st_docset', ['topic'], rows_per_insert=rows_per_insert,
+                        rows_per_file=None, compression=compression) as insert_intents:
+        for _, topic in docsets:
+            insert_intents.write([sql_quote(topic)])
+
+    # create inserts for st_doc like this (the variables are numbered by the row in insert_intents.sql):
+    # SET @docset_1 = (SELECT MAX(id) FROM st_docset WHERE topic = 'Test topicX');
+    # INSERT INTO st_doc (docset_id, doc_title, doc_text) VALUES
+    # (@docset_1, 'DOC_TITLE', 'DOC_CONTENT'),
+    # (@docset_1, 'DOC_TITLE2', 'DOC_CONTENT2');
+    with SqlChunkWriter(dir / 'insert_answers', 'st_doc', ['docset_id', 'doc_title', 'doc_text'],
+                        rows_per_insert=rows_per_insert, rows_per_file=rows_per_file,
+                        compression=compression) as insert_answers:
+        for answer_url, answer, intent_ids in iter_linked_answers(link_index, scraped_questions_jsonl,
+                                                                  scraped_answers_jsonl):
+            # once per intent, there is no docset for empty texts
+            for intent_id in intent_ids:
+                if intent_id not in docset_lookups:
+                    continue
+                name, expression = docset_lookups[intent_id]
+                insert_answers.write([name, sql_quote(answer_url), sql_quote(answer['content'])],
+                                     variables={name: expression})
+    print('wrote %i intents to %s and %i answers to %i files %s.*' % (
+        insert_intents.nbr_rows, insert_intents.paths[0] if insert_intents.paths else None, insert_answers.nbr_rows,
+        len(insert_answers.paths), insert_answers.prefix))
 
     # create adjust_table.sql that sets required character sets (for smileys, etc)
     with open((dir / 'adjust_tables.sql').resolve(), 'w') as adjust_tables:
@@ -296,88 +1383,174 @@ def create_sql_inserts(intents_jsonl, scraped_questions_jsonl=None, scraped_answ
         c = db.cursor()
         c.execute('ALTER TABLE st_doc CONVERT TO CHARACTER SET utf8mb4 COLLATE utf8mb4_bin')
         c.execute('ALTER TABLE st_docset CONVERT TO CHARACTER SET utf8mb4 COLLATE utf8mb4_bin')
-        c.executemany('INSERT INTO st_docset (topic) VALUES (%s)', (intend[INTENT_TEXT].replace('"', '\'') for intend in intents if intend[INTENT_TEXT] != ''))
-        db.commit()
-        c.executemany(
-            'INSERT INTO st_doc(docset_id, doc_title, doc_text) SELECT id, %s, %s FROM st_docset WHERE topic = %s',
-            entries)
+        c.close()
+        # the texts are passed as parameters, i.e. they are not changed
+        docs = ((answer_url, answer['content'], intent_id) for answer_url, answer, intent_ids
+                in iter_linked_answers(link_index, scraped_questions_jsonl, scraped_answers_jsonl)
+                for intent_id in intent_ids if intent_id in docset_lookups)
+        start = time.time()
+        nbr_docsets, nbr_docs = load_mdswriter(db, docsets, docs)
+        print('inserted %i docsets and %i docs in %.1f s' % (nbr_docsets, nbr_docs, time.time() - start))
+        db.close()
+
+
+def write_stats_tsv(path, rows):
+    logging.info('write stats to: %s' % path)
+    with open(path, 'w') as f:
+        assert len(rows) > 0, 'no rows'
+        writer = csv.DictWriter(f, fieldnames=rows[0].keys(), delimiter='\t')
+        writer.writeheader()
+        writer.writerows(rows)
 
 
-def calc_stats_questions(intent_file_json='questions/intents.jl', question_file_jsonl='questions/scraped.jl'):
+def write_stats(intents, table, directory, exclude=()):
+    """
+    Add the per intent stats of the PostTable to the intents and write them to intents_stats.tsv, the per thread stats
+    to threads_stats.tsv.
+    """
+    from questionscraper.stats import to_rows, distribution
+    for intent, stats in zip(intents, to_rows(table.intent_stats())):
+        intent.update((k, v) for k, v in stats.items() if k not in exclude)
+    write_stats_tsv((directory / 'intents_stats.tsv').resolve(), intents)
 
-    #with open(intent_file_json, 'r') as f:
-    #    intents = json.load(f)
-
-    intents = load_jl(intent_file_json)
-    questions_dict = load_jl(question_file_jsonl, key='url')
-
-    for url in questions_dict:
-        questions_dict[url]['nbr_answers'] = len(questions_dict[url]['answers'])
-        questions_dict[url]['nbr_solutions'] = len([True for a in questions_dict[url]['answers'] if a['solution_accepted_by'] is not None])
-        q_author_name = questions_dict[url]['question']['author_name']
-        questions_dict[url]['nbr_answers_from_question_author'] = len([True for a in questions_dict[url]['answers'] if a['author_name'] == q_author_name])
-
-    for i in range(len(intents)):
-        intents[i]['nbr_questions'] = len(intents[i]['links'])
-        intent_answers = [questions_dict[a_url] for a_url in intents[i]['links'] if a_url in questions_dict]
-        intents[i]['nbr_answers'] = sum([a['nbr_answers'] for a in intent_answers])
-        intents[i]['nbr_solutions'] = sum([a['nbr_solutions'] for a in intent_answers])
-
-    # intents_stats_fn = out_file or 'intents_questions_stats.tsv'
-    dir = Path(intent_file_json).parent
-    intents_stats_fn = (dir / 'intents_stats.tsv').resolve()
-    logging.info('write intents with stats to: %s' % intents_stats_fn)
-    with open(intents_stats_fn, 'w') as intents_stats_file:
-        assert len(intents) > 0, 'no intents'
-        writer = csv.DictWriter(intents_stats_file, fieldnames=intents[0].keys(), delimiter='\t')
-        writer.writeheader()
-        writer.writerows(intents)
+    thread_stats = table.thread_stats()
+    logging.info('answers per thread (number of answers: number of threads): %s'
+                 % distribution(thread_stats['nbr_answers']))
+    threads = [dict(url=url, **stats) for url, stats in zip(table.thread_urls, to_rows(thread_stats))]
+    if len(threads) > 0:
+        write_stats_tsv((directory / 'threads_stats.tsv').resolve(), [
+            {k: v for k, v in thread.items() if k not in exclude} for thread in threads])
 
-    #return intents, questions_dict
 
+def calc_stats_questions(intent_file_json='questions/intents.jl', question_file_jsonl='questions/scraped.jl'):
+    from questionscraper.stats import PostTable
 
-def calc_stats_answers(intent_file_jsonl='answers/intents.jl', answer_file_jsonl='answers/scraped.jl'):
-    #with open(intent_file_json, 'r') as f:
-    #    intents = json.load(f)
-
-    intents = load_jl(intent_file_jsonl)
-    answers_dict = load_jl(answer_file_jsonl, key='url')
-
-    for i in range(len(intents)):
-        intent_answers = [answers_dict[a_url] for a_url in intents[i]['links'] if a_url in answers_dict]
-        intents[i]['nbr_answers'] = len(intent_answers)
-        intents[i]['nbr_solutions'] = len([True for a in intent_answers if a['solution_accepted_by'] is not None])
-
-    #intents_stats_fn = out_file or 'intents_answers_stats.tsv'
-    dir = Path(intent_file_jsonl).parent
-    intents_stats_fn = (dir / 'intents_stats.tsv').resolve()
-    logging.info('write intents with stats to: %s' % intents_stats_fn)
-    with open(intents_stats_fn, 'w') as intents_stats_file:
-        assert len(intents) > 0, 'no intents'
-        writer = csv.DictWriter(intents_stats_file, fieldnames=intents[0].keys(), delimiter='\t')
-        writer.writeheader()
-        writer.writerows(intents)
+    intents = list(iter_intents(intent_file_json))
+    # load the answers of the linked threads into columns
+    table = PostTable.from_threads(iter_scraped_linked(question_file_jsonl, LinkIndex(intents), SCRAPED_THREADS),
+                                   intents)
+    for intent in intents:
+        intent['nbr_questions'] = len(intent['links'])
+    write_stats(intents, table, Path(intent_file_json).parent)
 
-    #return intents, answers_dict
 
+def calc_stats_answers(intent_file_jsonl='answers/intents.jl', answer_file_jsonl='answers/scraped.jl'):
+    from questionscraper.stats import PostTable
+
+    intents = list(iter_intents(intent_file_jsonl))
+    # load the linked answers into columns
+    table = PostTable.from_answers(iter_scraped_linked(answer_file_jsonl, LinkIndex(intents), SCRAPED_ANSWERS),
+                                   intents)
+    # the question authors are not scraped with the answers
+    write_stats(intents, table, Path(intent_file_jsonl).parent, exclude=('nbr_answers_from_question_author',))
+
+
+def iter_sorted_records(records, key, run_bytes=SORT_RUN_BYTES):
+    """
+    Yield the records sorted by record[key] (stable). If they exceed run_bytes (json encoded), sorted runs of that
+    size are written to temporary files and merged, i.e. the memory is bounded by run_bytes and a single record.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        runs = []
+        run = []
+        size = 0
+        for record in records:
+            line = json_dumps(record)
+            run.append((record[key], line))
+            size += len(line)
+            if size >= run_bytes:
+                runs.append(write_sorted_run(run, os.path.join(directory, 'run%i.jl' % len(runs))))
+                run = []
+                size = 0
+        if len(runs) == 0:
+            run.sort(key=itemgetter(0))
+            yield from (json_loads(line) for _, line in run)
+            return
+        if len(run) > 0:
+            runs.append(write_sorted_run(run, os.path.join(directory, 'run%i.jl' % len(runs))))
+        del run
+        # ties are taken from the earlier runs first
+        yield from heapq.merge(*(iter_jl(path) for path in runs), key=itemgetter(key))
+
+
+def write_sorted_run(run, path):
+    run.sort(key=itemgetter(0))
+    with open_jl(path, 'wb') as f:
+        for _, line in run:
+            f.write(line + b'\n')
+    return path
+
+
+def iter_last_per_key(records, key):
+    # records are sorted by key, yield tuples (key, record) with the last record per key (as a dict would keep)
+    previous = None
+    for record in records:
+        if previous is not None and previous[key] != record[key]:
+            yield previous[key], previous
+        previous = record
+    if previous is not None:
+        yield previous[key], previous
+
+
+def merge_join(left, right, key):
+    """
+    Join two iterables of records that are sorted by key in one pass: yield tuples (key value, left record, right
+    record), one of the records is None if the key value is missing on that side. For duplicate key values only the
+    last record is taken.
+    """
+    left = iter_last_per_key(left, key)
+    right = iter_last_per_key(right, key)
+    l, r = next(left, None), next(right, None)
+    while l is not None or r is not None:
+        if r is None or (l is not None and l[0] < r[0]):
+            yield l[0], l[1], None
+            l = next(left, None)
+        elif l is None or r[0] < l[0]:
+            yield r[0], None, r[1]
+            r = next(right, None)
+        else:
+            yield l[0], l[1], r[1]
+            l, r = next(left, None), next(right, None)
+
+
+def merge_questions_answers(merged_intents_questions='questions/intents_merged.jl', merged_intents_answers='answers/intents_merged.jl',
+                            out='intents_merged_all.tsv', run_bytes=SORT_RUN_BYTES):
+    """
+    Join the merged answer intents with the answers_plain of the merged question intents (as question_answers_plain)
+    by Intent-ID and write them sorted by Intent-ID to the tsv file out. Both files are read once, sorted externally
+    (see iter_sorted_records) and merged, only the needed fields are kept.
+    """
+    # only answers_plain is taken from the question intents and answers / questions are not written to the tsv file
+    intents_questions = ({INTENT_ID: intent[INTENT_ID], 'answers_plain': intent['answers_plain']}
+                         for intent in iter_intents(merged_intents_questions))
+    intents_answers = ({f: v for f, v in intent.items() if f not in ['answers', 'questions']}
+                       for intent in iter_intents(merged_intents_answers))
+
+    not_in_intents_answers = []
+    not_in_intents_questions = []
+
+    def iter_merged():
+        for intent_id, intent_questions, intent_answers in merge_join(
+                iter_sorted_records(intents_questions, INTENT_ID, run_bytes),
+                iter_sorted_records(intents_answers, INTENT_ID, run_bytes), key=INTENT_ID):
+            if intent_answers is None:
+                not_in_intents_answers.append(intent_id)
+                continue
+            if intent_questions is None:
+                not_in_intents_questions.append(intent_id)
+            else:
+                intent_answers['question_answers_plain'] = intent_questions['answers_plain']
+            yield intent_answers
 
-def merge_questions_answers(merged_intents_questions='questions/intents_merged.jl', merged_intents_answers='answers/intents_merged.jl'):
-    intents_questions =load_jl(merged_intents_questions, key=INTENT_ID)
-    intents_answers = load_jl(merged_intents_answers, key=INTENT_ID)
+    intents_merged_all = iter_merged()
+    first = next(intents_merged_all, None)
+    assert first is not None, 'no intents in %s' % merged_intents_answers
+    dump_jl(chain([first], intents_merged_all), out, tsv_fieldnames=list(first.keys()))
 
-    not_in_intents_answers = set(intents_questions.keys()) - set(intents_answers.keys())
     if len(not_in_intents_answers) > 0:
-        print('not in intents_answers, but in intents_questions: %s' % str(list(not_in_intents_answers)))
-    not_in_intents_questions = set(intents_answers.keys()) - set(intents_questions.keys())
+        print('not in intents_answers, but in intents_questions: %s' % str(not_in_intents_answers))
     if len(not_in_intents_questions):
-        print('not in intents_questions, but in intents_answers: %s' % str(list(not_in_intents_questions)))
-
-    for k in intents_questions.keys():
-        intents_answers[k]['question_answers_plain'] = intents_questions[k]['answers_plain']
-
-    intents_merged_all = sorted(intents_answers.values(), key=lambda x: x[INTENT_ID])
-    dump_jl(intents_merged_all, 'intents_merged_all.tsv',
-            tsv_fieldnames=[k for k in intents_merged_all[0].keys() if k not in ['answers', 'questions']])
+        print('not in intents_questions, but in intents_answers: %s' % str(not_in_intents_questions))
 
 
 if __name__ == "__main__":
@@ -2,19 +2,27 @@
 import json
 import logging
 import os
+import re
+from itertools import chain
 from pathlib import Path
 
 import scrapy
 from inline_requests import inline_requests
+from lxml import etree
 
-from questionscraper.spiders.helper import flatten, get_intents_from_tsv, QUESTION_PREFIX, ANSWER_PREFIX, load_jl
+from questionscraper.markup import tokenize, get_captions, CAPTION_IMAGE, CAPTION_BLOCKQUOTE, CAPTION_UNKNOWN, \
+    CAPTION_LINK, CAPTION_LINK_PROFILE
+from questionscraper.spiders.helper import flatten, get_intents_from_tsv, QUESTION_PREFIX, ANSWER_PREFIX, load_jl, \
+    load_done_urls, truncate_incomplete_line, open_jl, json_loads, is_sqlite, is_compressed, \
+    load_scraped_lookup, SCRAPED_THREADS
 
 URL_MAIN = 'https://telekomhilft.telekom.de'
-CAPTION_IMAGE = 'IMAGE'
-CAPTION_BLOCKQUOTE = 'BLOCKQUOTE'
-CAPTION_UNKNOWN = 'UNKNOWN'
-CAPTION_LINK = 'LINK'
-CAPTION_LINK_PROFILE = 'LINK_PROFILE'
+
+SERIALIZER_XPATH = 'xpath'
+SERIALIZER_TREE = 'tree'
+
+PAGINATION_SEQUENTIAL = 'sequential'
+PAGINATION_PARALLEL = 'parallel'
 
 
 def get_message_url(message, response):
@@ -122,7 +130,177 @@ def serialize_elem(elem, response, in_quote=False, embed_plain=False):
     return [res.replace('\u00a0', ' ').strip() for res in results]
 
 
-def process_message_view(message, response, embed_plain=False):
+def _has_class(node, class_name):
+    # same semantics as the xpath test: contains(concat(" ", @class, " "), " CLASS_NAME ")
+    return ' %s ' % class_name in ' %s ' % node.get('class', '')
+
+
+def _first_text(node):
+    # equivalent to node.xpath('text()').extract_first()
+    if node.text is not None:
+        return node.text
+    for child in node:
+        if child.tail is not None:
+            return child.tail
+    return None
+
+
+def _selected_nodes(node):
+    """
+    Yield the text nodes and elements that serialize_elem selects via NODE_STR for the context node, in document order.
+    """
+    if node.text is not None:
+        yield node.text
+    for child in node:
+        tag = child.tag
+        if tag in ('br', 'a', 'p', 'span', 'font', 'strong', 'blockquote') \
+                or (tag == 'div' and _has_class(child, 'accordion-content')):
+            yield child
+        if tag == 'span':
+            # span//img
+            yield from child.iter('img')
+        elif tag in ('ul', 'ol'):
+            yield from (li for li in child if li.tag == 'li')
+        elif tag == 'div' and _has_class(child, 'page'):
+            for layout_area in child:
+                if layout_area.tag == 'div' and _has_class(layout_area, 'layoutArea'):
+                    yield from (column for column in layout_area
+                                if column.tag == 'div' and _has_class(column, 'column'))
+        if child.tail is not None:
+            yield child.tail
+
+
+def serialize_elem_tree(elem, response, in_quote=False, embed_plain=False):
+    """
+    Drop-in replacement for serialize_elem that produces the same (content, content_cleaned) pair, but walks the
+    underlying lxml tree with an explicit stack instead of evaluating NODE_STR and recursing for every element.
+    Results are collected in list buffers and every href / src is resolved only once.
+
+    :param elem: parsel Selector or SelectorList
+    :param response: the response the element belongs to (used to resolve relative links)
+    :return: list [content, content_cleaned]
+    """
+    roots = [s.root for s in elem] if isinstance(elem, list) else [elem.root]
+    # frame: [node iterator, content buffer, content_cleaned buffer, in_quote, tag name of the frame element]
+    stack = [[chain.from_iterable(_selected_nodes(root) for root in roots), [], [], in_quote, None]]
+    while True:
+        frame = stack[-1]
+        nodes, res, res_cleaned, in_quote, _ = frame
+        e = next(nodes, None)
+        if e is None:
+            stack.pop()
+            content = ''.join(res).replace('\u00a0', ' ').strip()
+            content_cleaned = ''.join(res_cleaned).replace('\u00a0', ' ').strip()
+            if len(stack) == 0:
+                return [content, content_cleaned]
+            tag_name = frame[4]
+            parent = stack[-1]
+            if tag_name == 'blockquote':
+                if parent[3]:
+                    parent[1].append(content)
+                    parent[2].append(content_cleaned)
+                else:
+                    parent[1].append('\n\n[%s]{{%s}}' % (CAPTION_BLOCKQUOTE, content))
+                    parent[2].append('\n\n[%s]{{%s}}' % (CAPTION_BLOCKQUOTE, content_cleaned))
+            else:
+                if tag_name == 'li':
+                    prefix = '\n\n * '
+                elif tag_name in ('p', 'div'):
+                    prefix = '\n\n'
+                else:
+                    prefix = ' '
+                if content != '':
+                    parent[1].append(prefix + content)
+                if content_cleaned != '':
+                    parent[2].append(prefix + content_cleaned)
+            continue
+
+        if isinstance(e, str):
+            res.append(' ' + e)
+            res_cleaned.append(' ' + e)
+            continue
+
+        tag_name = e.tag
+        if tag_name == 'br':
+            res.append('\n\n')
+            res_cleaned.append('\n\n')
+        elif tag_name == 'a':
+            a_text = _first_text(e)
+            href = response.urljoin(e.get('href'))
+            if a_text is None:
+                if not (embed_plain and in_quote):
+                    link = '[%s]{{%s}}' % (CAPTION_LINK, href)
+                    res.append(link)
+                    res_cleaned.append(link)
+                else:
+                    res.append(href)
+                    res_cleaned.append(href)
+            elif 'user/viewprofilepage/user-id' in href:
+                if not (embed_plain and in_quote):
+                    link = '[%s]{{%s}}{{%s}}' % (CAPTION_LINK_PROFILE, href, a_text.strip())
+                    res.append(link)
+                    res_cleaned.append(link)
+                else:
+                    res.append(a_text)
+                    res_cleaned.append(a_text)
+            elif a_text in href or (len(a_text) > 3 and href.startswith(a_text[:-3])):
+                if not (embed_plain and in_quote):
+                    res.append('[%s]{{%s}}{{%s}}' % (CAPTION_LINK, href, a_text.strip()))
+                    res_cleaned.append('[%s]{{%s}}' % (CAPTION_LINK, href))
+                else:
+                    res.append(href)
+                    res_cleaned.append(href)
+            else:
+                if not embed_plain:
+                    link = '[%s]{{%s}}{{%s}}' % (CAPTION_LINK, href, a_text.strip())
+                    res.append(link)
+                    res_cleaned.append(link)
+                else:
+                    res.append(href)
+                    res_cleaned.append(href)
+        elif tag_name == 'img':
+            img_src = response.urljoin(e.get('src'))
+            if not (embed_plain and in_quote):
+                img = '[%s]{{%s}}' % (CAPTION_IMAGE, img_src)
+                res.append(img)
+                res_cleaned.append(img)
+            else:
+                res.append(img_src)
+                res_cleaned.append(img_src)
+        elif tag_name in ('blockquote', 'li', 'p', 'div', 'span', 'font', 'strong'):
+            if tag_name == 'blockquote':
+                if in_quote:
+                    print('QUOTE-IN-QUOTE: %s' % response.url)
+                child_in_quote = True
+            else:
+                child_in_quote = in_quote
+            stack.append([_selected_nodes(e), [], [], child_in_quote, tag_name])
+        else:
+            e_html = etree.tostring(e, method='html', encoding='unicode', with_tail=False)
+            if not (embed_plain and in_quote):
+                res.append('[%s]{{%s}} ' % (CAPTION_UNKNOWN, e_html))
+            else:
+                res.append(e_html)
+
+
+SERIALIZERS = {SERIALIZER_XPATH: serialize_elem, SERIALIZER_TREE: serialize_elem_tree}
+
+
+def get_serializer(settings):
+    name = settings.get('POST_SERIALIZER', SERIALIZER_XPATH)
+    assert name in SERIALIZERS, 'unknown POST_SERIALIZER: %s. Use one of: %s' % (name, ', '.join(SERIALIZERS))
+    return SERIALIZERS[name]
+
+
+def get_message_content(message):
+    # try to get rich text
+    message_content = message.css('.lia-message-body-content .outerRichtextDiv')
+    if message_content.extract_first() is None:
+        message_content = message.css('.lia-message-body-content')
+    return message_content
+
+
+def process_message_view(message, response, embed_plain=False, serialize=serialize_elem):
 
     result = {}
     # get author data
@@ -135,20 +313,18 @@ def process_message_view(message, response, embed_plain=False):
     # get message metadata
     result['kudos'] = int(message.css('span.MessageKudosCount::text').extract_first().strip())
 
-    # try to get rich text
-    message_content = message.css('.lia-message-body-content .outerRichtextDiv')
-    if message_content.extract_first() is None:
-        message_content = message.css('.lia-message-body-content')
-    text, text_cleaned = serialize_elem(message_content, response, embed_plain=embed_plain)
+    message_content = get_message_content(message)
+    text, text_cleaned = serialize(message_content, response, embed_plain=embed_plain)
     # replace double spaces (were inserted between inline elements)
     text_cleaned = text_cleaned.replace('  ', ' ')
     # replace double quotes (these would destroy table entries when downloaded later from google sheets)
     result['content'] = text.strip().replace('"', '\'\'')
     result['content_cleaned'] = text_cleaned.strip().replace('"', '\'\'')
 
-    result['has_quote'] = '[%s]' % CAPTION_BLOCKQUOTE in result['content']
-    result['has_image'] = '[%s]' % CAPTION_IMAGE in result['content']
-    result['has_link'] = '[%s]' % CAPTION_LINK in result['content']
+    captions = get_captions(tokenize(result['content']))
+    result['has_quote'] = CAPTION_BLOCKQUOTE in captions
+    result['has_image'] = CAPTION_IMAGE in captions
+    result['has_link'] = CAPTION_LINK in captions
 
     result['url'] = get_message_url(message, response)
     result['solution_accepted_by'] = message.css('.lia-component-solution-info .solution-accepter > a::text').extract_first()
@@ -174,16 +350,16 @@ def process_message_view(message, response, embed_plain=False):
     return result
 
 
-def parse_question(response, url_only=False):
+def parse_question(response, url_only=False, serialize=serialize_elem):
     q = response.css('.lia-thread-topic')
     assert len(q) == 1, 'unexpected number of questions: %i for url: %s' % (len(q), response.request.url)
     if url_only:
         question_message_url = get_message_url(q[0], response)
         return {'url': question_message_url}
-    return process_message_view(q[0], response)
+    return process_message_view(q[0], response, serialize=serialize)
 
 
-def parse_answers(response):
+def get_answer_views(response):
     m_list = response.css('.message-list')[0]
     replies_header = m_list.css('.lia-replies-header')
     # get lia-thread-reply_s (MessageView_s)
@@ -194,10 +370,440 @@ def parse_answers(response):
     else:
         raise ValueError(
             'Unexpected number of replies header in message-list: %i. Expected 0 or 1.' % len(replies_header))
-    answers = [process_message_view(answ, response) for answ in answers]
     return answers
 
 
+def parse_answers(response, serialize=serialize_elem):
+    return [process_message_view(answ, response, serialize=serialize) for answ in get_answer_views(response)]
+
+
+def parse_thread_info(response):
+    title = response.css('.PageTitle > span::text').extract_first()
+    solved = response.css('.icon-confirm').extract_first() is not None
+    tags = [t.strip() for t in response.css('.TagList .lia-tag-list-item > .lia-tag::text').extract()]
+    return {'title': title, 'solved': solved, 'tags': tags}
+
+
+def get_next_page_url(response):
+    return response.css('.lia-component-message-list > .lia-paging-pager .lia-paging-page-next a::attr(href)').extract_first()
+
+
+def get_last_page(response):
+    """
+    Get the number and url of the last thread page from the pager.
+
+    :return: tuple (page number, url) or None, if the pager does not link the last page
+    """
+    last = response.css('.lia-component-message-list > .lia-paging-pager .lia-paging-page-last > a')
+    url = last.css('::attr(href)').extract_first()
+    page = last.css('::text').extract_first()
+    if url is None or page is None or not page.strip().isdigit() or re.search(r'/page/\d+', url) is None:
+        return None
+    return int(page.strip()), response.urljoin(url)
+
+
+def get_page_url(last_page_url, page):
+    return re.sub(r'/page/\d+', '/page/%i' % page, last_page_url)
+
+
+def get_thread_key(url):
+    # message urls look like: https://telekomhilft.telekom.de/t5/BOARD/THREAD-SLUG/m-p/MESSAGE_ID#M...
+    match = re.search(r'/t5/([^/]+)/([^/]+)/', url)
+    if match is None:
+        return url
+    return '%s/%s' % match.groups()
+
+
+def get_thread_id(url):
+    # the thread id equals the message id of the question, i.e. it works for thread urls (.../td-p/ID/page/N) and
+    # for question message urls (.../m-p/ID#M...)
+    match = re.search(r'/(?:td|m)-p/(\d+)', url)
+    if match is None:
+        return url
+    return match.group(1)
+
+
+def skip_done_urls(urls, resume):
+    """
+    Remove the urls that already have an item in the json lines file resume (None: keep all urls). A trailing incomplete
+    line in resume is removed (if it is neither compressed nor a sqlite store).
+    """
+    if resume is None:
+        return urls
+    if os.path.exists(resume) and not is_sqlite(resume) and not is_compressed(resume):
+        # new items are appended to the same file (a compressed file can not be appended to and is read as it is)
+        truncate_incomplete_line(resume)
+    done = load_done_urls(resume)
+    res = [url for url in urls if url not in done]
+    logging.info('resume from %s: skip %i of %i urls (%i items found)' % (resume, len(urls) - len(res), len(urls), len(done)))
+    return res
+
+
+def group_by_thread(urls):
+    """
+    Group message urls by the thread (board and thread slug) they belong to. Duplicated urls are removed.
+
+    :return: list of url lists, in order of the first appearance of the thread
+    """
+    groups = {}
+    for url in urls:
+        group = groups.setdefault(get_thread_key(url), [])
+        if url not in group:
+            group.append(url)
+    return list(groups.values())
+
+
+def parse_thread(responses, serialize=serialize_elem):
+    """
+    Create the thread item (as yielded by QuestionsSpider) from all pages of a thread.
+
+    :param responses: the responses of all thread pages, in page order
+    :return: dict with url, title, solved, tags, question and answers
+    """
+    response = responses[0]
+    question = parse_question(response, serialize=serialize)
+    answers = flatten([parse_answers(resp, serialize=serialize) for resp in responses])
+    thread_info = parse_thread_info(response)
+    return {'url': response.request.url, 'title': thread_info['title'], 'solved': thread_info['solved'],
+            'tags': thread_info['tags'], 'question': question, 'answers': answers}
+
+
+def get_message_id(url):
+    match = re.search(r'/m-p/(\d+)', url)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def get_reply_count(response):
+    """
+    Get the number of replies from the replies header (e.g. "Antworten (23)").
+
+    :return: the number of replies or None, if the header does not show it
+    """
+    header = response.css('.message-list .lia-replies-header').xpath('string()').extract_first()
+    if header is None:
+        return None
+    match = re.search(r'\d+', header)
+    if match is None:
+        return None
+    return int(match.group(0))
+
+
+def create_thread_state(item, page_urls, page_sizes):
+    """
+    Create the metadata that is needed to refresh the thread item later on without fetching all of its pages again.
+
+    :param item: thread item (see parse_thread)
+    :param page_urls: urls of all thread pages, in page order
+    :param page_sizes: number of answers per page
+    :return: dict with url, nbr_pages, last_page_url, last_message_id, nbr_answers, page_sizes and page_first_ids
+    """
+    answers = item['answers']
+    assert sum(page_sizes) == len(answers), 'page sizes (%i answers) do not match the number of answers: %i' \
+                                            % (sum(page_sizes), len(answers))
+    page_first_ids = []
+    start = 0
+    for size in page_sizes:
+        page_first_ids.append(get_message_id(answers[start]['url']) if size > 0 else None)
+        start += size
+    last_message = answers[-1] if len(answers) > 0 else item['question']
+    return {'url': item['url'], 'nbr_pages': len(page_urls), 'last_page_url': page_urls[-1],
+            'last_message_id': get_message_id(last_message['url']), 'nbr_answers': len(answers),
+            'page_sizes': page_sizes, 'page_first_ids': page_first_ids}
+
+
+def get_page_answers(item, state, first_page, last_page):
+    """
+    Get the answers of the pages first_page to last_page (1-based, inclusive) from a previously scraped thread item.
+    """
+    sizes = state['page_sizes']
+    return item['answers'][sum(sizes[:first_page - 1]):sum(sizes[:last_page])]
+
+
+def load_previous_items(path, urls):
+    """
+    Load the items for urls from the json lines file path (for urls that occur multiple times, the last item wins).
+    For a PostStore (sqlite file), a lookup into the store is returned.
+    """
+    urls = set(urls)
+    res = {}
+    if path is None or not os.path.exists(path):
+        return res
+    if is_sqlite(path):
+        return load_scraped_lookup(path, urls, SCRAPED_THREADS)
+    with open_jl(path) as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                # incomplete last line
+                break
+            item = json_loads(line)
+            if item['url'] in urls:
+                res[item['url']] = item
+    logging.info('loaded %i previous items from: %s' % (len(res), path))
+    return res
+
+
+def prepare_question_intents(intent_file, max_answers):
+    """
+    Load the intents with the scraped answers (json lines) and replace their links with the urls of the threads
+    that contain the first max_answers answers. The prepared intents are backed up as intents_questions_MAX_ANSWERS.jl
+    next to the intent file.
+
+    :return: tuple (intents, thread urls to scrape)
+    """
+    logging.info('load %s from file: %s' % (QUESTION_PREFIX, intent_file))
+
+    f_ext = os.path.splitext(intent_file)[1]
+    if f_ext.lower() == 'tsv':
+        # TODO: filter columns? see prepare_answer_intents
+        raise NotImplementedError('only intent files in json line file format are implemented for scraping question')
+    elif f_ext.lower() in ['.jl', '.jsonl']:
+        intents = load_jl(intent_file)
+        #question_links = []
+        #relevant_answer_links = []
+        for i, intent in enumerate(intents):
+            intents[i]['original_relevant_answer_links'] = intents[i]['links']
+            answers = intent['answers'][:max_answers]
+            intents[i]['relevant_answer_links'] = [a['url'] for a in answers]
+            #relevant_answer_links.extend(intents[i]['relevant_answer_links'])
+            intents[i]['links'] = sorted(list(set([a['question_url'] for a in answers])))
+            #question_links.extend(intents[i]['question_links'])
+            del intents[i]['answers']
+
+    else:
+        raise ValueError('unknown intent file extension: %s' % f_ext)
+    urls = flatten([intent['links'] for intent in intents])
+    dir = Path(intent_file).parent
+    intents_backup_fn = (dir / ('intents_questions_%i.jl' % max_answers)).resolve()
+    logging.info('backup intents to %s' % intents_backup_fn)
+    with open(intents_backup_fn, 'w') as intents_out:
+        #json.dump(intents, intents_out)
+        intents_out.writelines(json.dumps(intent)+'\n' for intent in intents)
+    return intents, urls
+
+
+def prepare_answer_intents(intent_file, max_answers):
+    """
+    Load the intents from the intent tsv file (only rows marked with "Scrapen?") and collect the links from the first
+    max_answers answer columns. The intents are backed up as intents_answers_MAX_ANSWERS.jl next to the intent file.
+
+    :return: tuple (intents, answer urls to scrape)
+    """
+    logging.info('load %s from file: %s' % (ANSWER_PREFIX, intent_file))
+    intents = get_intents_from_tsv(
+        intent_file,
+        filter_columns=['Intent-ID', 'DT-Example', 'Basis-Intent-Text', 'Intent-Text', 'Answers-Searcher',
+                        'Intent-Type', 'Summary-Must-Haves',
+                        'Scrapen?', 'SEGMENTED', 'answers_plain_marked_relevant_segmented',
+                        'Trainingsbeispiel'
+                        #'Answer_0', 'Answer_1', 'Answer_2', 'Answer_3', 'Answer_4', 'Answer_5', 'Answer_6',
+                        #'Answer_7', 'Answer_8', 'Answer_9',
+                        #'Answer_10', 'Answer_11', 'Answer_12', 'Answer_13', 'Answer_14', 'Answer_15', 'Answer_16',
+                        #'Answer_17', 'Answer_18', 'Answer_19'
+                        ] + [ANSWER_PREFIX + str(i) for i in range(max_answers)],
+        scrape_flag_column='Scrapen?'
+    )
+    urls = flatten([intent['links'] for intent in intents])
+    for url in urls:
+        logging.debug(url)
+    dir = Path(intent_file).parent
+    intents_backup_fn = (dir / ('intents_answers_%i.jl' % max_answers)).resolve()
+    logging.info('backup intents to %s' % intents_backup_fn)
+    with open(intents_backup_fn, 'w') as intents_out:
+        #json.dump(intents, intents_out)
+        intents_out.writelines(json.dumps(intent) + '\n' for intent in intents)
+    return intents, urls
+
+
+class QuestionUrlCache(object):
+    """
+    Question message url per thread id. If a path is given, the mapping is loaded from that json lines file and
+    new entries are appended to it.
+    """
+
+    def __init__(self, path=None):
+        self.urls = {}
+        self.hits = 0
+        self.file = None
+        if path is not None:
+            if os.path.exists(path):
+                truncate_incomplete_line(path)
+                self.urls = {e['thread_id']: e['question_url'] for e in load_jl(path)}
+            logging.info('loaded %i question urls from cache: %s' % (len(self.urls), path))
+            self.file = open(path, 'a')
+
+    def get(self, thread_id):
+        question_url = self.urls.get(thread_id)
+        if question_url is not None:
+            self.hits += 1
+        return question_url
+
+    def add(self, thread_id, question_url):
+        if thread_id in self.urls:
+            return
+        self.urls[thread_id] = question_url
+        if self.file is not None:
+            self.file.write(json.dumps({'thread_id': thread_id, 'question_url': question_url}) + '\n')
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ThreadStates(object):
+    """
+    Thread metadata (see create_thread_state) per thread url. If a path is given, the states are loaded from that json
+    lines file (the last entry per url wins) and new states are appended to it.
+    """
+
+    def __init__(self, path=None):
+        self.states = {}
+        # number of added states per refresh mode
+        self.counts = {}
+        self.file = None
+        if path is not None:
+            if os.path.exists(path):
+                truncate_incomplete_line(path)
+                self.states = {s['url']: s for s in load_jl(path)}
+            logging.info('loaded %i thread states from: %s' % (len(self.states), path))
+            self.file = open(path, 'a')
+
+    def get(self, url):
+        return self.states.get(url)
+
+    def add(self, state, mode='full'):
+        self.counts[mode] = self.counts.get(mode, 0) + 1
+        self.states[state['url']] = state
+        if self.file is not None:
+            self.file.write(json.dumps(state) + '\n')
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def iter_thread_refresh(response, state, previous, thread_states, serialize=serialize_elem):
+    """
+    Refresh a previously scraped thread item. Replies are only appended to a thread, so the pages before the
+    previously last one are taken from the previous item, if the first answers of page 1 and of the previously last
+    page did not change. If the replies header shows the number of replies and neither that nor the number of pages
+    changed, only page 1 is fetched. Otherwise, the previously last page and all pages after it are fetched. If
+    answers were removed (the pages are shifted), all pages are fetched again.
+
+    This generator yields scrapy.Request objects whose response has to be sent back into it (see inline_requests)
+    and finally the thread item. The new state of the thread is added to thread_states.
+
+    :param response: response for page 1 of the thread
+    :param state: thread state of the previous item (see create_thread_state)
+    :param previous: the previous thread item
+    :param thread_states: ThreadStates
+    """
+    item = parse_thread([response], serialize=serialize)
+    page_1_answers = item['answers']
+    last_page = get_last_page(response)
+    if last_page is None:
+        # no link to the last page: follow the next links (a single page thread has none)
+        responses = [response]
+        answers = [page_1_answers]
+        next_url = get_next_page_url(response)
+        while next_url is not None:
+            resp = yield scrapy.Request(response.urljoin(next_url), dont_filter=True)
+            responses.append(resp)
+            answers.append(parse_answers(resp, serialize=serialize))
+            next_url = get_next_page_url(resp)
+        item['answers'] = flatten(answers)
+        thread_states.add(create_thread_state(item, [r.url for r in responses], [len(a) for a in answers]),
+                          mode='full')
+        yield item
+        return
+    nbr_pages, last_page_url = last_page
+    old_nbr_pages = state['nbr_pages']
+    page_first_ids = state['page_first_ids']
+    page_1_first_id = get_message_id(page_1_answers[0]['url']) if len(page_1_answers) > 0 else None
+    aligned = page_1_first_id == page_first_ids[0] and len(page_1_answers) == state['page_sizes'][0]
+
+    if aligned and nbr_pages == old_nbr_pages and get_reply_count(response) == state['nbr_answers']:
+        item['answers'] = page_1_answers + get_page_answers(previous, state, 2, old_nbr_pages)
+        page_urls = [response.url] + [get_page_url(last_page_url, p) for p in range(2, nbr_pages + 1)]
+        thread_states.add(create_thread_state(item, page_urls, state['page_sizes']), mode='unchanged')
+        yield item
+        return
+
+    answers = [page_1_answers]
+    first_fetched = 2
+    mode = 'full'
+    if aligned and 1 < old_nbr_pages <= nbr_pages:
+        resp = yield scrapy.Request(get_page_url(last_page_url, old_nbr_pages), dont_filter=True)
+        page_answers = parse_answers(resp, serialize=serialize)
+        if len(page_answers) > 0 and get_message_id(page_answers[0]['url']) == page_first_ids[old_nbr_pages - 1]:
+            answers = [page_1_answers] + [get_page_answers(previous, state, p, p) for p in range(2, old_nbr_pages)] \
+                      + [page_answers]
+            first_fetched = old_nbr_pages + 1
+            mode = 'updated'
+    for page in range(first_fetched, nbr_pages + 1):
+        resp = yield scrapy.Request(get_page_url(last_page_url, page), dont_filter=True)
+        answers.append(parse_answers(resp, serialize=serialize))
+    item['answers'] = flatten(answers)
+    page_urls = [response.url] + [get_page_url(last_page_url, p) for p in range(2, nbr_pages + 1)]
+    thread_states.add(create_thread_state(item, page_urls, [len(a) for a in answers]), mode=mode)
+    yield item
+
+
+def iter_thread_answers(response, answer_urls, question_urls, serialize=serialize_elem):
+    """
+    Collect the requested answers of one thread. Every page is fetched only once: all requested answers that are
+    on the current page are taken from it and the next request is made only for an answer that is still missing.
+    The question url is resolved once per thread.
+
+    This generator yields scrapy.Request objects whose response has to be sent back into it (see inline_requests)
+    and the answer items (dicts).
+
+    An answer whose page can not be fetched or parsed is logged and skipped, the other answers are collected anyway.
+
+    :param response: response for answer_urls[0]
+    :param answer_urls: requested answer urls of the thread
+    :param question_urls: QuestionUrlCache
+    """
+    pending = answer_urls
+    while len(pending) > 0:
+        try:
+            if response is None:
+                response = yield scrapy.Request(pending[0], dont_filter=True)
+            answers = parse_answers(response, serialize=serialize)
+            answers_dict = {a['url']: a for a in answers}
+            assert response.request.url in answers_dict, 'answers with response.request.url=%s not found at that page' % response.request.url
+
+            page_1_url = response.css('.lia-paging-page-first > a::attr(href)').extract_first()
+            if page_1_url is None:
+                question_url = parse_question(response, url_only=True)['url']
+                question_urls.add(get_thread_id(question_url), question_url)
+            else:
+                thread_id = get_thread_id(response.urljoin(page_1_url))
+                question_url = question_urls.get(thread_id)
+                if question_url is None:
+                    page_1_resp = yield scrapy.Request(response.urljoin(page_1_url), dont_filter=True)
+                    question_url = parse_question(page_1_resp, url_only=True)['url']
+                    question_urls.add(thread_id, question_url)
+        except Exception as e:
+            logging.error('skip answer %s: %s' % (pending[0], e))
+            pending = pending[1:]
+            response = None
+            continue
+
+        found = [url for url in pending if url in answers_dict]
+        for url in found:
+            answer = answers_dict[url]
+            answer['question_url'] = question_url
+            yield answer
+        pending = [url for url in pending if url not in found and url != response.request.url]
+        response = None
+
+
 class QuestionsSpider(scrapy.Spider):
     name = "questions"
 
@@ -207,34 +813,13 @@ class QuestionsSpider(scrapy.Spider):
         intent_file = getattr(self, 'intent_file', None)
         assert intent_file is not None, 'no intent_file set. Please specify a intent_file via scrapy parameters: "-a intent_file=PATH_TO_INTENT_FILE"'
 
-        logging.info('load %s from file: %s' % (QUESTION_PREFIX, intent_file))
-
-        f_ext = os.path.splitext(intent_file)[1]
-        if f_ext.lower() == 'tsv':
-            # TODO: filter columns? see AnswersSpider.start_requests
-            raise NotImplementedError('only intent files in json line file format are implemented for scraping question')
-        elif f_ext.lower() in ['.jl', '.jsonl']:
-            intents = load_jl(intent_file)
-            #question_links = []
-            #relevant_answer_links = []
-            for i, intent in enumerate(intents):
-                intents[i]['original_relevant_answer_links'] = intents[i]['links']
-                answers = intent['answers'][:max_answers]
-                intents[i]['relevant_answer_links'] = [a['url'] for a in answers]
-                #relevant_answer_links.extend(intents[i]['relevant_answer_links'])
-                intents[i]['links'] = sorted(list(set([a['question_url'] for a in answers])))
-                #question_links.extend(intents[i]['question_links'])
-                del intents[i]['answers']
+        intents, urls = prepare_question_intents(intent_file, max_answers)
+        urls = skip_done_urls(urls, getattr(self, 'resume', None))
 
-        else:
-            raise ValueError('unknown intent file extension: %s' % f_ext)
-        urls = flatten([intent['links'] for intent in intents])
-        dir = Path(intent_file).parent
-        intents_backup_fn = (dir / ('intents_questions_%i.jl' % max_answers)).resolve()
-        logging.info('backup intents to %s' % intents_backup_fn)
-        with open(intents_backup_fn, 'w') as intents_out:
-            #json.dump(intents, intents_out)
-            intents_out.writelines(json.dumps(intent)+'\n' for intent in intents)
+        # metadata of the scraped threads, optionally persisted to thread_state (json lines). If a previous output file
+        # is given, the threads from that file are refreshed by fetching only the pages that changed.
+        self.thread_states = ThreadStates(getattr(self, 'thread_state', None))
+        self.previous_items = load_previous_items(getattr(self, 'previous', None), urls)
 
         results = []
         logging.info('crawl %d urls ...' % len(urls))
@@ -243,24 +828,81 @@ class QuestionsSpider(scrapy.Spider):
             results.append(res)
             yield res
 
-    @inline_requests
     def parse(self, response):
-        question = parse_question(response)
-        answers = parse_answers(response)
-        title = response.css('.PageTitle > span::text').extract_first()
-        solved = response.css('.icon-confirm').extract_first() is not None
-        tags = [t.strip() for t in response.css('.TagList .lia-tag-list-item > .lia-tag::text').extract()]
+        state = self.thread_states.get(response.request.url)
+        previous = self.previous_items.get(response.request.url)
+        if state is not None and previous is not None:
+            return self.parse_refresh(response, state, previous)
+        pagination = self.settings.get('THREAD_PAGINATION', PAGINATION_SEQUENTIAL)
+        if pagination == PAGINATION_PARALLEL:
+            return self.parse_parallel(response)
+        assert pagination == PAGINATION_SEQUENTIAL, 'unknown THREAD_PAGINATION: %s' % pagination
+        return self.parse_sequential(response)
+
+    def parse_parallel(self, response):
+        """
+        Request all remaining pages of the thread at once (the last page number is taken from the pager) and yield
+        the thread item when all of them arrived.
+        """
+        last_page = get_last_page(response)
+        if last_page is None or last_page[0] <= 1:
+            # no pager, no link to the last page or no further page: fall back to following the next links (no page
+            # request would call thread_page_done)
+            yield from self.parse_sequential(response)
+            return
+        nbr_pages, last_page_url = last_page
+        thread = {'responses': [response] + [None] * (nbr_pages - 1), 'pending': nbr_pages - 1, 'failed': False}
+        for page in range(2, nbr_pages + 1):
+            yield scrapy.Request(get_page_url(last_page_url, page), callback=self.parse_thread_page,
+                                 errback=self.thread_page_failed, meta={'thread': thread, 'page': page}, priority=1,
+                                 dont_filter=True)
+
+    def parse_thread_page(self, response):
+        thread = response.meta['thread']
+        thread['responses'][response.meta['page'] - 1] = response
+        return self.thread_page_done(thread)
+
+    def thread_page_failed(self, failure):
+        thread = failure.request.meta['thread']
+        thread['failed'] = True
+        logging.error('could not fetch thread page %s: %s' % (failure.request.url, failure.value))
+        return self.thread_page_done(thread)
+
+    def thread_page_done(self, thread):
+        thread['pending'] -= 1
+        if thread['pending'] == 0:
+            if thread['failed']:
+                logging.error('skip thread %s, because not all pages could be fetched' % thread['responses'][0].url)
+            else:
+                yield self.create_item(thread['responses'])
 
-        next_resp = response
+    @inline_requests
+    def parse_sequential(self, response):
+        responses = [response]
         while True:
-            next_url = next_resp.css('.lia-component-message-list > .lia-paging-pager .lia-paging-page-next a::attr(href)').extract_first()
+            next_url = get_next_page_url(responses[-1])
             if next_url is not None:
                 next_resp = yield scrapy.Request(next_url)
-                next_answers = parse_answers(next_resp)
-                answers.extend(next_answers)
+                responses.append(next_resp)
             else:
                 break
-        yield {'url': response.request.url, 'title': title, 'solved': solved, 'tags': tags, 'question': question, 'answers': answers}
+        yield self.create_item(responses)
+
+    @inline_requests
+    def parse_refresh(self, response, state, previous):
+        yield from iter_thread_refresh(response, state, previous, self.thread_states,
+                                       serialize=get_serializer(self.settings))
+
+    def create_item(self, responses):
+        item = parse_thread(responses, serialize=get_serializer(self.settings))
+        self.thread_states.add(create_thread_state(item, [r.url for r in responses],
+                                                   [len(get_answer_views(r)) for r in responses]))
+        return item
+
+    def closed(self, reason):
+        logging.info('scraped threads per refresh mode: %s'
+                     % ', '.join('%s: %i' % (mode, n) for mode, n in sorted(self.thread_states.counts.items())))
+        self.thread_states.close()
 
 
 class AnswersSpider(scrapy.Spider):
@@ -280,52 +922,22 @@ class AnswersSpider(scrapy.Spider):
         else:
             intent_file = getattr(self, 'intent_file', None)
             assert intent_file is not None, 'no intent_file set. Please specify a intent_file via scrapy parameters: "-a intent_file=PATH_TO_INTENT_FILE"'
+            intents, urls = prepare_answer_intents(intent_file, max_answers)
+        urls = skip_done_urls(urls, getattr(self, 'resume', None))
 
-            logging.info('load %s from file: %s' % (ANSWER_PREFIX, intent_file))
-            intents = get_intents_from_tsv(
-                intent_file,
-                filter_columns=['Intent-ID', 'DT-Example', 'Basis-Intent-Text', 'Intent-Text', 'Answers-Searcher',
-                                'Intent-Type', 'Summary-Must-Haves',
-                                'Scrapen?', 'SEGMENTED', 'answers_plain_marked_relevant_segmented',
-                                'Trainingsbeispiel'
-                                #'Answer_0', 'Answer_1', 'Answer_2', 'Answer_3', 'Answer_4', 'Answer_5', 'Answer_6',
-                                #'Answer_7', 'Answer_8', 'Answer_9',
-                                #'Answer_10', 'Answer_11', 'Answer_12', 'Answer_13', 'Answer_14', 'Answer_15', 'Answer_16',
-                                #'Answer_17', 'Answer_18', 'Answer_19'
-                                ] + [ANSWER_PREFIX + str(i) for i in range(max_answers)],
-                scrape_flag_column='Scrapen?'
-            )
-            urls = flatten([intent['links'] for intent in intents])
-            for url in urls:
-                logging.debug(url)
-            dir = Path(intent_file).parent
-            intents_backup_fn = (dir / ('intents_answers_%i.jl' % max_answers)).resolve()
-            logging.info('backup intents to %s' % intents_backup_fn)
-            with open(intents_backup_fn, 'w') as intents_out:
-                #json.dump(intents, intents_out)
-                intents_out.writelines(json.dumps(intent) + '\n' for intent in intents)
-
-        results = []
-        logging.info('crawl %d urls ...' % len(urls))
-        for url in urls:
-            res = scrapy.Request(url=url, callback=self.parse)
-            results.append(res)
-            yield res
+        # question message url per thread id, optionally persisted to question_url_cache (json lines)
+        self.question_urls = QuestionUrlCache(getattr(self, 'question_url_cache', None))
+        url_groups = group_by_thread(urls)
+        logging.info('crawl %d urls from %d threads ...' % (len(urls), len(url_groups)))
+        for group in url_groups:
+            yield scrapy.Request(url=group[0], callback=self.parse, meta={'answer_urls': group})
 
     @inline_requests
     def parse(self, response):
-        answers = parse_answers(response)
-        answers_dict = {a['url']: a for a in answers}
-        assert response.request.url in answers_dict, 'answers with response.request.url=%s not found at that page' % response.request.url
-
-        answer = answers_dict[response.request.url]
-        page_1_url = response.css('.lia-paging-page-first > a::attr(href)').extract_first()
-        if page_1_url is not None:
-            page_1_resp = yield scrapy.Request(page_1_url, dont_filter=True)
-        else:
-            page_1_resp = response
-        question = parse_question(page_1_resp, url_only=True)
-        answer['question_url'] = question['url']
-        yield answer
-
+        yield from iter_thread_answers(response, response.meta.get('answer_urls', [response.request.url]),
+                                       self.question_urls, serialize=get_serializer(self.settings))
 
+    def closed(self, reason):
+        logging.info('question url lookups answered without requesting the first thread page: %i'
+                     % self.question_urls.hits)
+        self.question_urls.close()
@@ -0,0 +1,192 @@
+"""
+Statistics of scraped posts for calc_stats_questions / calc_stats_answers: the answers are loaded once into columnar
+NumPy arrays (one entry per answer) and aggregated per thread and per intent with grouped reductions (bincount over
+the thread index or over the (intent, answer) links) instead of rescanning the answer lists.
+
+    table = PostTable.from_threads(iter_scraped(...), intents)
+    per_intent = table.intent_stats()
+    per_thread = table.thread_stats()
+"""
+import numpy as np
+
+# percentiles of words and kudos per answer that are calculated per intent
+PERCENTILES = (50, 90)
+# columns of PostTable that are summed up per thread / intent
+SUM_COLUMNS = ('kudos', 'words')
+
+
+def count_words(text):
+    return len(text.split()) if text else 0
+
+
+def group_sum(groups, values, nbr_groups):
+    """
+    Sum of values per group, groups are indices in range(nbr_groups).
+    """
+    return np.bincount(groups, weights=values, minlength=nbr_groups)
+
+
+def group_count(groups, nbr_groups, mask=None):
+    """
+    Number of entries (where mask is True) per group.
+    """
+    if mask is not None:
+        groups = groups[mask]
+    return np.bincount(groups, minlength=nbr_groups)
+
+
+def group_percentiles(groups, values, nbr_groups, percentiles=PERCENTILES):
+    """
+    Percentiles (linear interpolation, as numpy.percentile) of values per group in one sort.
+
+    :return: float array of shape (nbr_groups, len(percentiles)), nan for empty groups
+    """
+    order = np.lexsort((values, groups))
+    values_sorted = values[order].astype(np.float64)
+    counts = np.bincount(groups, minlength=nbr_groups)
+    starts = np.cumsum(counts) - counts
+    res = np.full((nbr_groups, len(percentiles)), np.nan)
+    non_empty = counts > 0
+    starts, counts = starts[non_empty], counts[non_empty]
+    for i, p in enumerate(percentiles):
+        position = (counts - 1) * (p / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        fraction = position - lower
+        res[non_empty, i] = values_sorted[starts + lower] * (1 - fraction) + values_sorted[starts + upper] * fraction
+    return res
+
+
+def distribution(values):
+    """
+    Distribution of non negative integers: mapping of value to frequency (only values that occur).
+    """
+    frequencies = np.bincount(values)
+    return {int(v): int(frequencies[v]) for v in np.flatnonzero(frequencies)}
+
+
+class PostTable(object):
+    """
+    Columns of the scraped answers (one entry per answer):
+        thread: index into thread_urls (the thread, for scraped answers the question url)
+        kudos, words: number of kudos / words (of content_cleaned)
+        solution: the answer was accepted as solution
+        by_asker: the answer was written by the author of the thread question (always False for scraped answers)
+    and the links of the intents: (link_intent[i], link_answer[i]) is an intent index and the index of an answer it
+    links (directly or via the thread). Every occurrence of a link in the intent counts, as before.
+    """
+
+    def __init__(self, thread_urls, thread, kudos, words, solution, by_asker, nbr_intents, link_intent, link_answer):
+        self.thread_urls = thread_urls
+        self.thread = np.asarray(thread, dtype=np.int64)
+        self.kudos = np.asarray(kudos, dtype=np.int64)
+        self.words = np.asarray(words, dtype=np.int64)
+        self.solution = np.asarray(solution, dtype=bool)
+        self.by_asker = np.asarray(by_asker, dtype=bool)
+        self.nbr_intents = nbr_intents
+        self.link_intent = np.asarray(link_intent, dtype=np.int64)
+        self.link_answer = np.asarray(link_answer, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.thread)
+
+    @classmethod
+    def from_threads(cls, threads, intents, links_key='links'):
+        """
+        :param threads: iterable of tuples (url, item) of scraped threads (items of QuestionsSpider)
+        :param intents: list of intents, the intent indices refer to it
+        """
+        thread_urls, thread, kudos, words, solution, by_asker = [], [], [], [], [], []
+        # url -> range of the answer indices
+        thread_answers = {}
+        for url, item in threads:
+            asker = item['question']['author_name']
+            start = len(thread)
+            for a in item['answers']:
+                thread.append(len(thread_urls))
+                kudos.append(a['kudos'] or 0)
+                words.append(count_words(a['content_cleaned']))
+                solution.append(a['solution_accepted_by'] is not None)
+                by_asker.append(a['author_name'] == asker)
+            thread_urls.append(url)
+            thread_answers[url] = range(start, len(thread))
+        link_intent, link_answer = cls.get_links(intents, thread_answers, links_key)
+        return cls(thread_urls, thread, kudos, words, solution, by_asker, len(intents), link_intent, link_answer)
+
+    @classmethod
+    def from_answers(cls, answers, intents, links_key='links'):
+        """
+        :param answers: iterable of tuples (url, item) of scraped answers (items of AnswersSpider)
+        :param intents: list of intents, the intent indices refer to it
+        """
+        thread_urls, thread, kudos, words, solution = [], [], [], [], []
+        thread_indices = {}
+        answer_indices = {}
+        for url, a in answers:
+            question_url = a.get('question_url') or url
+            if question_url not in thread_indices:
+                thread_indices[question_url] = len(thread_urls)
+                thread_urls.append(question_url)
+            answer_indices[url] = range(len(thread), len(thread) + 1)
+            thread.append(thread_indices[question_url])
+            kudos.append(a['kudos'] or 0)
+            words.append(count_words(a['content_cleaned']))
+            solution.append(a['solution_accepted_by'] is not None)
+        link_intent, link_answer = cls.get_links(intents, answer_indices, links_key)
+        return cls(thread_urls, thread, kudos, words, solution, [False] * len(thread), len(intents), link_intent,
+                   link_answer)
+
+    @staticmethod
+    def get_links(intents, answer_ranges, links_key):
+        link_intent, link_answer = [], []
+        for i, intent in enumerate(intents):
+            for link in intent[links_key]:
+                answers = answer_ranges.get(link)
+                if answers is not None:
+                    link_intent.extend([i] * len(answers))
+                    link_answer.extend(answers)
+        return link_intent, link_answer
+
+    def thread_stats(self):
+        """
+        :return: dict of arrays (one entry per thread): nbr_answers, nbr_solutions, nbr_answers_from_question_author,
+            kudos, words
+        """
+        nbr_threads = len(self.thread_urls)
+        res = {'nbr_answers': group_count(self.thread, nbr_threads),
+               'nbr_solutions': group_count(self.thread, nbr_threads, self.solution),
+               'nbr_answers_from_question_author': group_count(self.thread, nbr_threads, self.by_asker)}
+        for name in SUM_COLUMNS:
+            res[name] = group_sum(self.thread, getattr(self, name), nbr_threads).astype(np.int64)
+        return res
+
+    def intent_stats(self, percentiles=PERCENTILES):
+        """
+        :return: dict of arrays (one entry per intent): nbr_answers, nbr_solutions, nbr_answers_from_question_author,
+            kudos, words and per percentile p: words_p<p>, kudos_p<p> (nan for intents without answers)
+        """
+        groups = self.link_intent
+        res = {'nbr_answers': group_count(groups, self.nbr_intents),
+               'nbr_solutions': group_count(groups, self.nbr_intents, self.solution[self.link_answer]),
+               'nbr_answers_from_question_author': group_count(groups, self.nbr_intents,
+                                                               self.by_asker[self.link_answer])}
+        for name in SUM_COLUMNS:
+            values = getattr(self, name)[self.link_answer]
+            res[name] = group_sum(groups, values, self.nbr_intents).astype(np.int64)
+            for p, column in zip(percentiles, group_percentiles(groups, values, self.nbr_intents, percentiles).T):
+                res['%s_p%i' % (name, p)] = column
+        return res
+
+
+def to_rows(stats):
+    """
+    Convert a dict of arrays (see PostTable.thread_stats / intent_stats) into a list of dicts of python numbers for
+    csv.DictWriter (nan becomes None, i.e. an empty cell).
+    """
+    columns = {}
+    for name, values in stats.items():
+        if values.dtype.kind == 'f':
+            columns[name] = [None if np.isnan(v) else round(v, 2) for v in values.tolist()]
+        else:
+            columns[name] = values.tolist()
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
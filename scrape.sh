@@ -33,36 +33,28 @@ if [ ! -f "$INTENT_FILE" ]; then
     exit 1
 fi
 
-# scrape answers
-if [ ! -f "$DIR/scraped_answers_$MAX_ANSWERS".jl ]; then
-    echo "scrape answers ..."
-    echo "scrapy crawl answers -L INFO -a intent_file=$INTENT_FILE -a max_answers=$MAX_ANSWERS -o $DIR/scraped_answers_$MAX_ANSWERS.jl"
-    scrapy crawl answers -L INFO -a intent_file="$INTENT_FILE" -a max_answers=$MAX_ANSWERS -o "$DIR/scraped_answers_$MAX_ANSWERS".jl
-else
-    echo "skip scraping answers. file exists: $DIR/scraped_answers_$MAX_ANSWERS".jl
-fi
-# merge
-if [ ! -f "$DIR/intents_answers_$MAX_ANSWERS"_merged.jl ]; then
+# scrape answers (resumes from an existing output file, i.e. only missing answers are fetched)
+echo "scrape answers ..."
+echo "scrapy crawl answers -L INFO -a intent_file=$INTENT_FILE -a max_answers=$MAX_ANSWERS -a question_url_cache=$DIR/question_urls.jl -a resume=$DIR/scraped_answers_$MAX_ANSWERS.jl -o $DIR/scraped_answers_$MAX_ANSWERS.jl"
+scrapy crawl answers -L INFO -a intent_file="$INTENT_FILE" -a max_answers=$MAX_ANSWERS -a question_url_cache="$DIR/question_urls.jl" -a resume="$DIR/scraped_answers_$MAX_ANSWERS".jl -o "$DIR/scraped_answers_$MAX_ANSWERS".jl
+# merge (again, if the scrape added answers)
+if [ ! -f "$DIR/intents_answers_$MAX_ANSWERS"_merged.jl ] || [ "$DIR/scraped_answers_$MAX_ANSWERS".jl -nt "$DIR/intents_answers_$MAX_ANSWERS"_merged.jl ]; then
     echo "merge answers ..."
     echo "python questionscraper/spiders/helper.py --intents-jsonl $DIR/intents_answers_$MAX_ANSWERS.jl --out-dir $DIR --scraped-answers-jsonl $DIR/scraped_answers_$MAX_ANSWERS.jl"
     python questionscraper/spiders/helper.py --intents-jsonl "$DIR/intents_answers_$MAX_ANSWERS".jl --out-dir "$DIR" --scraped-answers-jsonl "$DIR/scraped_answers_$MAX_ANSWERS".jl
 else
-    echo "skip merging answers. file exists: $DIR/intents_answers_$MAX_ANSWERS"_merged.jl
+    echo "skip merging answers. file is up to date: $DIR/intents_answers_$MAX_ANSWERS"_merged.jl
 fi
 
-# scrape questions
-if [ ! -f "$DIR/scraped_questions_$MAX_ANSWERS".jl ]; then
-    echo "scrape questions ..."
-    echo "scrapy crawl questions -L INFO -a intent_file=$DIR/intents_answers_$MAX_ANSWERS""_merged.jl -a max_answers=$MAX_ANSWERS -o $DIR/scraped_questions_$MAX_ANSWERS"".jl"
-    scrapy crawl questions -L INFO -a intent_file="$DIR/intents_answers_$MAX_ANSWERS"_merged.jl -a max_answers=$MAX_ANSWERS -o "$DIR/scraped_questions_$MAX_ANSWERS".jl
-else
-    echo "skip scraping questions. file exists: $DIR/scraped_questions_$MAX_ANSWERS".jl
-fi
-# merge questions
-if [ ! -f "$DIR/intents_questions_$MAX_ANSWERS"_merged.jl ]; then
+# scrape questions (resumes from an existing output file, i.e. only missing threads are fetched)
+echo "scrape questions ..."
+echo "scrapy crawl questions -L INFO -a intent_file=$DIR/intents_answers_$MAX_ANSWERS""_merged.jl -a max_answers=$MAX_ANSWERS -a resume=$DIR/scraped_questions_$MAX_ANSWERS.jl -o $DIR/scraped_questions_$MAX_ANSWERS"".jl"
+scrapy crawl questions -L INFO -a intent_file="$DIR/intents_answers_$MAX_ANSWERS"_merged.jl -a max_answers=$MAX_ANSWERS -a resume="$DIR/scraped_questions_$MAX_ANSWERS".jl -o "$DIR/scraped_questions_$MAX_ANSWERS".jl
+# merge questions (again, if the scrape added threads)
+if [ ! -f "$DIR/intents_questions_$MAX_ANSWERS"_merged.jl ] || [ "$DIR/scraped_questions_$MAX_ANSWERS".jl -nt "$DIR/intents_questions_$MAX_ANSWERS"_merged.jl ]; then
     echo "merge questions ..."
     echo "python questionscraper/spiders/helper.py --intents-jsonl $DIR/intents_questions_$MAX_ANSWERS.jl --out-dir $DIR --scraped-questions-jsonl $DIR/scraped_questions_$MAX_ANSWERS.jl"
     python questionscraper/spiders/helper.py --intents-jsonl "$DIR/intents_questions_$MAX_ANSWERS".jl --out-dir "$DIR" --scraped-questions-jsonl "$DIR/scraped_questions_$MAX_ANSWERS".jl
 else
-    echo "skip merging answers. file exists: $DIR/intents_questions_$MAX_ANSWERS"_merged.jl
+    echo "skip merging questions. file is up to date: $DIR/intents_questions_$MAX_ANSWERS"_merged.jl
 fi
@@ -3,12 +3,16 @@ import logging
 import os
 import re
 import csv
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import json
-import html
 import plac
-from questionscraper.spiders.helper import load_jl
+from multiprocessing import Pool
+from questionscraper.markup import tokenize, render_plain, HtmlRenderer, LEFTOVER_RE
+from questionscraper.spiders.helper import iter_jl, LinkIndex
 from os import path
-from bs4 import BeautifulSoup
 from statistics import median
 
 
@@ -27,13 +31,13 @@ TITLE = 'title'
 ANSWERS = 'answers'
 URL = 'url'
 
-CAPTION_IMAGE = 'IMAGE'
-CAPTION_BLOCKQUOTE = 'BLOCKQUOTE'
-CAPTION_UNKNOWN = 'UNKNOWN'
-CAPTION_LINK = 'LINK'
-CAPTION_LINK_PROFILE = 'LINK_PROFILE'
+# the posts of an intent are sorted by their number of block elements, <div>s have more weight
+BLOCK_TAGS = ('<div', '<p', '<li')
+BLOCK_TAG_WEIGHTS = (1.5, 1, 1)
 
-CAPTIONS = [CAPTION_IMAGE, CAPTION_BLOCKQUOTE, CAPTION_UNKNOWN, CAPTION_LINK, CAPTION_LINK_PROFILE]
+# see JobWriter
+JSON_INDENT = ' ' * 4
+DYNAMIC_CONTENT_MARKER = '__DYNAMIC_CONTENT__'
 
 logging.getLogger().setLevel(logging.DEBUG)
 
@@ -72,156 +76,189 @@ def answers_from_intents(intents):
                 yield a
 
 
-def answers_dict_from_intent(intent):
+def answers_dict_from_intent(intent, relevant_index):
+    """
+    :param relevant_index: LinkIndex of the relevant answer links of the intents
+    """
     res = {}
     for q in intent[QUESTIONS]:
         for a in q[ANSWERS]:
-            if a[URL] in intent['relevant_answer_links']:
+            if intent[INTENT_ID] in relevant_index.get(a[URL], ()):
                 a[QUESTION] = q
                 res[a[URL]] = a
     return res
 
 
-def prepare_for_html(content, format_as=FORMAT_LIST):
-    if format_as == FORMAT_LIST:
-        s = '<ul>%s</ul>' % html.escape(content)
-        # add li elements
-        s = s.replace('##', '<li><span class="sentence">').replace('||', '</span></li>')
-    elif format_as == FORMAT_PARAGRAPHS:
-        # s = content.replace('##', '<p><input type="checkbox" name="%s">' % meta['checkbox_name']).replace('||', '</p>')
-        s = content.replace('##', '<p><span class="sentence">').replace('||', '</span></p>')
-    elif format_as == FORMAT_CHECKBOXES:
-        s_split = content.split('||')
-        s = ''
-        for i in range(len(s_split)):
-            if s_split[i].strip() != '':
-                if '[IMAGE]' in s_split[i] in s_split[i]:
-                    s += s_split[i].replace('##', '<p><input type="checkbox" name="check" disabled>') + '</p>'
-                else:
-                    s += s_split[i].replace('##', '<p><input type="checkbox" name="check">') + '</p>'
-        #s = content.replace('##', '<p><input type="checkbox" name="check">').replace('||', '</p>')
-        #s = content.replace('##', '<p><span class="sentence">').replace('||', '</span></p>')
-    elif format_as == FORMAT_PLAIN:
-        #s = html.escape(content).replace('##', '').replace('||', '')
-        s = content.replace('##', '').replace('||', '')
-    else:
-        raise ValueError('unknown "format_as": %s' % format_as)
+HTML_RENDERERS = {
+    FORMAT_LIST: HtmlRenderer(sentence_start='<li><span class="sentence">', sentence_end='</span></li>', escape=True,
+                              # interrupt the list for blockquotes (add closing and opening ul tags)
+                              quote_open='</ul><blockquote>', quote_close='</blockquote><ul>',
+                              count_tags=BLOCK_TAGS),
+    FORMAT_PARAGRAPHS: HtmlRenderer(sentence_start='<p><span class="sentence">', sentence_end='</span></p>',
+                                    count_tags=BLOCK_TAGS),
+    # sentences with images can not be selected
+    FORMAT_CHECKBOXES: HtmlRenderer(sentence_start='<p><input type="checkbox" name="check">', sentence_end='</p>',
+                                    sentence_start_image='<p><input type="checkbox" name="check" disabled>',
+                                    segments=True, count_tags=BLOCK_TAGS),
+}
+
 
+def count_blocks(s):
+    return sum(weight * s.count(tag) for tag, weight in zip(BLOCK_TAGS, BLOCK_TAG_WEIGHTS))
+
+
+def prepare_for_html(content, format_as=FORMAT_LIST, with_text=False):
+    """
+    Render a (sentence marked: ##sentence||) text with markup as html (or plain text), see questionscraper.markup.
+
+    :param with_text: return a tuple (html, text, nbr_blocks) with the visible text of the html and its weighted
+        number of block elements (see BLOCK_TAGS), both are collected while rendering
+    """
+    tokens = tokenize(content, sentence_marks=True)
     if format_as == FORMAT_PLAIN:
-        # replace links with captions
-        s = re.sub(r'\[LINK\]{{\s*([^}]+)\s*}}{{\s*([^}]+)\s*}} *', r'\2 ', s)
-        #s = re.sub(r'\[LINK\]{{\s*([^}]+)\s*}}{{\s*([^}]+)\s*}} *', CAPTION_LINK + ' ', s)
-        # replace remaining links without captions
-        s = re.sub(r'\[LINK\]{{\s*([^}]+)\s*}} *', r'\1 ', s)
-        #s = re.sub(r'\[LINK\]{{\s*([^}]+)\s*}} *', CAPTION_LINK + ' ', s)
-        # replace profile links (must have captions)
-        s = re.sub(r'\[LINK_PROFILE\]{{\s*([^}]+)\s*}}{{\s*([^}]+)\s*}}', r'\2', s)
-        # replace images
-        s = re.sub(r'\[IMAGE\]{{\s*([^}]+)\s*}}', CAPTION_IMAGE + ' ', s)
-    else:
-        # replace links with captions
-        s = re.sub(r'\[LINK\]{{\s*([^}]+)\s*}}{{\s*([^}]+)\s*}} *', r'<a href="\1" target="_blank">\2</a> ',
-                               s)
-        # replace remaining links with captions
-        s = re.sub(r'\[LINK\]{{\s*([^}]+)\s*}} *', r'<a href="\1" target="_blank">\1</a> ', s)
-        # replace profile links (must have captions)
-        s = re.sub(r'\[LINK_PROFILE\]{{\s*([^}]+)\s*}}{{\s*([^}]+)\s*}}',
-                               r'<a class="profile-link" href="\1" target="_blank">\2</a>', s)
-        # replace images
-        s = re.sub(r'\[IMAGE\]{{\s*([^}]+)\s*}}', r'<img src="\1" />', s)
-
-    # replace quotes. That separates the list (add closing and opening ul tags)
-    # remove empty blockquotes
-    s = s.replace('[BLOCKQUOTE]{{}}', '')
-    if '[BLOCKQUOTE]' in s and not format_as == FORMAT_PLAIN:
-        s = re.sub(r'schrieb:\s*', 'schrieb:<br/>', s)
-    # interrupt the list for blockquotes, if lists are is used
-    if format_as == FORMAT_LIST:
-        s = re.sub(r'\[BLOCKQUOTE\]{{\s*([^}]+)\s*}}', r'</ul><blockquote>\1</blockquote><ul>', s)
-    elif format_as == FORMAT_PLAIN:
-        #s = re.sub(r'\[BLOCKQUOTE\]{{\s*([^}]+)\s*}}', r'\1', s)
-        s = re.sub(r'\[BLOCKQUOTE\]{{\s*([^}]+)\s*}}', CAPTION_BLOCKQUOTE + ' ', s)
+        # links are replaced with their captions, images and quotes with their caption
+        s = render_plain(tokens)
+        text, nbr_blocks = s, (count_blocks(s) if with_text else None)
+    elif format_as in HTML_RENDERERS:
+        s, text, tag_counts = HTML_RENDERERS[format_as].render_with_text(tokens)
+        nbr_blocks = sum(weight * tag_counts[tag] for tag, weight in zip(BLOCK_TAGS, BLOCK_TAG_WEIGHTS))
+        if format_as == FORMAT_LIST:
+            s = '<ul>%s</ul>' % s
     else:
-        s = re.sub(r'\[BLOCKQUOTE\]{{\s*([^}]+)\s*}}', r'<blockquote>\1</blockquote>', s)
-
-    # replace emojis
-    # TODO: get list of all emojis
-    # see http://graphemica.com/%F0%9F%98%80
-    #s = s.replace('🙂', '&#128578;').replace('💕', '&#128578;').replace('😀', '&#128578;')
-    if format_as != FORMAT_PLAIN:
-        for emoji in ['🙂', '💕', '😀', '😊']:
-            s = s.replace(emoji, '&#%i;' % ord(emoji))
-    #s = s.replace('🙂', '').replace('💕', '').replace('😀', '')
+        raise ValueError('unknown "format_as": %s' % format_as)
 
-    assert '}}' not in s and '{{' not in s, 'final html contains "{{" or "}}":\n%s' % s
-    for c in CAPTIONS:
-        assert '[%s]' % c not in s, 'final html contains "[%s]":\n%s' % (c, s)
+    leftover = LEFTOVER_RE.search(s)
+    if leftover is not None:
+        if leftover.group(1) is not None:
+            raise AssertionError('final html contains "[%s]":\n%s' % (leftover.group(1), s))
+        raise AssertionError('final html contains "{{" or "}}":\n%s' % s)
+    if with_text:
+        return s, text, nbr_blocks
     return s
 
 
-def intents_split_to_dynamicContent(intents, nbr_posts, dynamic_content_loaded=None,
-                                    only_intent_ids=None, max_intents=None, format_as=FORMAT_LIST):
-    if max_intents:
-        logging.warning('max_intents is set to: %i' % max_intents)
-    if dynamic_content_loaded is None:
-        new_dynamic_content = {}
+def render_answer(answer, format_as=FORMAT_LIST):
+    """
+    :param answer: tuple (sentence marked content, question title, solution_accepted_by, solution_accepted_by_text)
+    :return: tuple (html, nbr_words, nbr_blocks)
+    """
+    content, title, accepted_by, accepted_by_text = answer
+    answer_splits, text, nbr_blocks = prepare_for_html(re.sub(r'\s*\(\d+\)\s*$', '', content), format_as=format_as,
+                                                       with_text=True)
+    if format_as == FORMAT_PLAIN:
+        return answer_splits, len(text.split()), nbr_blocks
+    new_answer = '<div class="answer-content">%s</div>' % answer_splits
+    question_title = '<div class="question-title">%s</div>' % title
+    header = ''
+    if accepted_by:
+        header = 'Lösung akzeptiert von %s %s' % (accepted_by, accepted_by_text)
+        new_answer = '<div class="answer solution"><div class="solution-header">%s</div>%s</div>' \
+                     % (header, new_answer)
     else:
-        new_dynamic_content = dynamic_content_loaded.copy()
-    posts = [{'identifier': 'Post%i' % (i+1), 'type': 'TEXT', 'values': []} for i in range(nbr_posts)]
-    if 'query' in new_dynamic_content:
-        logging.warning('"query" is already in dynamicContent, OVERWRITE it.')
-    if 'Post1' in new_dynamic_content:
-        logging.warning('"Post1" is already in dynamicContent, OVERWRITE "Post1" to "Post%i".' % nbr_posts)
-    query = {'identifier': 'query', 'type': 'TEXT', 'values': []}
-    all_l = []
+        new_answer = '<div class="answer">%s</div>' % new_answer
+    # the answer (and solution header) and answer content divs, the title and the header are inserted as html
+    nbr_blocks += count_blocks(question_title) + count_blocks(header) + BLOCK_TAG_WEIGHTS[0] * (3 if accepted_by else 2)
+    # (the visible text of the divs is not separated by whitespace)
+    return question_title + new_answer, len((title + header + text).split()), nbr_blocks
+
+
+def render_intent(intent_answers, format_as=FORMAT_LIST, nbr_posts=10):
+    """
+    :param intent_answers: tuple (intent id, intent text, answers), see render_answer for the answers
+    :return: tuple (query, posts, nbr_words): the posts (nbr_posts, filled with empty strings) are sorted by their
+        number of block elements
+    """
+    intent_id, intent_text, answers = intent_answers
+    query = prepare_for_html(intent_text, format_as=FORMAT_PLAIN)
+    if format_as != FORMAT_PLAIN:
+        query = '<div class=\"query\">%s</div>' % query
+    answers_rendered = []
+    for url, answer in answers:
+        try:
+            answers_rendered.append(render_answer(answer, format_as=format_as))
+        except Exception as e:
+            logging.error('intent: %s,\tanswer url: %s' % (intent_id, url))
+            raise e
+    ## use character count for sorting
+    #answers_sorted = sorted(answers_rendered, key=lambda a: len(a[0]), reverse=True)
+    # sort by number of block elements, but give <div>s more weight
+    answers_sorted = sorted(answers_rendered, key=lambda a: a[2], reverse=True)
+    posts = [answers_sorted[i][0] if i < len(answers_sorted) else '' for i in range(nbr_posts)]
+    # use words count as length
+    return query, posts, sum(a[1] for a in answers_rendered)
+
+
+def iter_intents_answers(intents, only_intent_ids=None, max_intents=None):
+    # only the data that is rendered, i.e. not the whole threads, is passed to render_intent (and the workers)
+    nbr_intents = 0
     for intent in intents:
-        if max_intents and len(query['values']) >= max_intents:
+        if max_intents and nbr_intents >= max_intents:
             break
         if only_intent_ids is not None and intent[INTENT_ID] not in only_intent_ids:
             continue
-        if format_as == FORMAT_PLAIN:
-            query['values'].append(prepare_for_html(intent[INTENT_TEXT], format_as=FORMAT_PLAIN))
-        else:
-            query['values'].append('<div class=\"query\">%s</div>' % prepare_for_html(intent[INTENT_TEXT], format_as=FORMAT_PLAIN))
-
-        current_answers_split = [(url, intent[ANSWERS_SPLIT][url]) for url in intent[ANSWERS_SPLIT]]
-        answers_html = []
-        for current_url, current_answer in current_answers_split:
+        answers = []
+        for url in intent[ANSWERS_SPLIT]:
             try:
-                answer_full = intent[ANSWERS_ALL][current_url]
-                answer_splits = prepare_for_html(re.sub(r'\s*\(\d+\)\s*$', '', current_answer),
-                                                 format_as=format_as)
-                if format_as == FORMAT_PLAIN:
-                    answers_html.append(answer_splits)
-                else:
-                    new_answer = '<div class="answer-content">%s</div>' % answer_splits
-                    question_title = '<div class="question-title">%s</div>' % answer_full[QUESTION][TITLE]
-
-                    accepted_by = answer_full.get('solution_accepted_by', None)
-                    accepted_by_text = answer_full.get('solution_accepted_by_text', None)
-                    if accepted_by:
-                        new_answer = '<div class="answer solution"><div class="solution-header">Lösung akzeptiert von %s %s</div>%s</div>' \
-                                     % (accepted_by, accepted_by_text, new_answer)
-                    else:
-                        new_answer = '<div class="answer">%s</div>' % new_answer
-                    answers_html.append(question_title + new_answer)
+                answer_full = intent[ANSWERS_ALL][url]
+                answers.append((url, (intent[ANSWERS_SPLIT][url], answer_full[QUESTION][TITLE],
+                                      answer_full.get('solution_accepted_by', None),
+                                      answer_full.get('solution_accepted_by_text', None))))
             except Exception as e:
-                logging.error('intent: %s,\tanswer url: %s' % (intent[INTENT_ID], current_url))
+                logging.error('intent: %s,\tanswer url: %s' % (intent[INTENT_ID], url))
                 raise e
-        answers_html_with_parsed_text = [(html_doc, BeautifulSoup(html_doc, 'html.parser').get_text()) for html_doc in answers_html]
-        ## use character count for sorting
-        #answers_html_sorted = sorted(answers_html_with_parsed_text, key=lambda h_with_l: len(h_with_l[1]), reverse=True)
-        # sort by umber of block elements, but give <div>s more weight
-        answers_html_sorted = sorted(answers_html_with_parsed_text, key=lambda h_with_l: 1.5 * h_with_l[0].count('<div') + h_with_l[0].count('<p') + h_with_l[0].count('<li'), reverse=True)
-        # use words count as length
-        l = sum(map(lambda x: len(x[1].strip().split()), answers_html_with_parsed_text))
-        for post_pos in range(nbr_posts):
-            if post_pos < len(answers_html_sorted):
-                posts[post_pos]['values'].append(answers_html_sorted[post_pos][0])
-            else:
-                posts[post_pos]['values'].append('')
+        nbr_intents += 1
+        yield intent[INTENT_ID], intent[INTENT_TEXT], answers
+
+
+def iter_rendered_intents(intents, nbr_posts, only_intent_ids=None, max_intents=None, format_as=FORMAT_LIST,
+                          pool=None):
+    """
+    :param pool: multiprocessing pool that renders the intents (default: render them in this process)
+    :return: generator of tuples (query, posts, nbr_words) in the order of the intents, see render_intent
+    """
+    if max_intents:
+        logging.warning('max_intents is set to: %i' % max_intents)
+    render = partial(render_intent, format_as=format_as, nbr_posts=nbr_posts)
+    intents_answers = iter_intents_answers(intents, only_intent_ids=only_intent_ids, max_intents=max_intents)
+    if pool is not None:
+        # imap keeps the order of the intents
+        rendered = pool.imap(render, intents_answers, chunksize=8)
+    else:
+        rendered = map(render, intents_answers)
+    all_l = []
+    for query_value, post_values, l in rendered:
         all_l.append(l)
+        yield query_value, post_values, l
     logging.info('lengths of all posts for all %i intents: %s' % (len(all_l), str(all_l)))
+
+
+def warn_overwrite(dynamic_content_loaded, nbr_posts):
+    if 'query' in dynamic_content_loaded:
+        logging.warning('"query" is already in dynamicContent, OVERWRITE it.')
+    if 'Post1' in dynamic_content_loaded:
+        logging.warning('"Post1" is already in dynamicContent, OVERWRITE "Post1" to "Post%i".' % nbr_posts)
+
+
+def intents_split_to_dynamicContent(intents, nbr_posts, dynamic_content_loaded=None,
+                                    only_intent_ids=None, max_intents=None, format_as=FORMAT_LIST, workers=1):
+    if dynamic_content_loaded is None:
+        new_dynamic_content = {}
+    else:
+        new_dynamic_content = dynamic_content_loaded.copy()
+    posts = [{'identifier': 'Post%i' % (i+1), 'type': 'TEXT', 'values': []} for i in range(nbr_posts)]
+    warn_overwrite(new_dynamic_content, nbr_posts)
+    query = {'identifier': 'query', 'type': 'TEXT', 'values': []}
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        for query_value, post_values, l in iter_rendered_intents(intents, nbr_posts, only_intent_ids=only_intent_ids,
+                                                                 max_intents=max_intents, format_as=format_as,
+                                                                 pool=pool):
+            query['values'].append(query_value)
+            for post_pos in range(nbr_posts):
+                posts[post_pos]['values'].append(post_values[post_pos])
+    finally:
+        if pool is not None:
+            pool.terminate()
     for p in posts:
         assert len(p['values']) == len(query['values']), \
             'nbr of post entries %i for %s does not match nbr of query entires %i' \
@@ -231,7 +268,90 @@ def intents_split_to_dynamicContent(intents, nbr_posts, dynamic_content_loaded=N
     return list(new_dynamic_content.values())
 
 
-def create_multiple_jobs(intents, summary, summary_out_fn, format_as, max_intents=None):
+class JobWriter(object):
+    """
+    Writes a job file: the summary template with the dynamicContent (query and Post1..PostN columns), formatted as
+    json.dump(summary, f, ensure_ascii=False, indent=4). The values of the columns are added intent by intent and
+    spooled to one temporary file per column, i.e. the memory does not depend on the number of intents.
+
+        with JobWriter(nbr_posts=10) as writer:
+            for query, posts, _ in iter_rendered_intents(intents, nbr_posts=10):
+                writer.add(query, posts)
+            writer.write(summary_out_fn, summary)
+    """
+
+    def __init__(self, nbr_posts):
+        self.identifiers = ['Post%i' % (i + 1) for i in range(nbr_posts)] + ['query']
+        self.columns = [tempfile.TemporaryFile('w+', encoding='utf-8') for _ in self.identifiers]
+        self.nbr_values = 0
+
+    def add(self, query, posts):
+        assert len(posts) == len(self.identifiers) - 1, \
+            'nbr of posts %i does not match nbr of post columns %i' % (len(posts), len(self.identifiers) - 1)
+        sep = ',\n' if self.nbr_values > 0 else '\n'
+        for f, value in zip(self.columns, list(posts) + [query]):
+            f.write(sep + JSON_INDENT * 4 + json.dumps(value, ensure_ascii=False))
+        self.nbr_values += 1
+
+    def write_column(self, f, i):
+        f.write('%s{\n%s"identifier": %s,\n%s"type": "TEXT",\n%s"values": ['
+                % (JSON_INDENT * 2, JSON_INDENT * 3, json.dumps(self.identifiers[i], ensure_ascii=False),
+                   JSON_INDENT * 3, JSON_INDENT * 3))
+        if self.nbr_values > 0:
+            column = self.columns[i]
+            column.seek(0)
+            shutil.copyfileobj(column, f)
+            f.write('\n' + JSON_INDENT * 3)
+        f.write(']\n%s}' % (JSON_INDENT * 2))
+
+    def write(self, path, summary, dynamic_content_loaded=None):
+        """
+        :param dynamic_content_loaded: dict of identifier to dynamicContent entry of the template (default: from
+            summary), entries with the identifier of a column are replaced at their position
+        """
+        if dynamic_content_loaded is None:
+            dynamic_content_loaded = {dc['identifier']: dc for dc in summary.get('dynamicContent', {})}
+        warn_overwrite(dynamic_content_loaded, len(self.identifiers) - 1)
+        columns = {identifier: i for i, identifier in enumerate(self.identifiers)}
+        identifiers = list(dynamic_content_loaded) + [i for i in self.identifiers if i not in dynamic_content_loaded]
+        # the summary (with dynamicContent at the same position) is dumped around a placeholder
+        marker = json.dumps(DYNAMIC_CONTENT_MARKER)
+        head, tail = json.dumps(dict(summary, dynamicContent=DYNAMIC_CONTENT_MARKER), ensure_ascii=False,
+                                indent=4).split(marker)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(head + '[\n')
+            for k, identifier in enumerate(identifiers):
+                if k > 0:
+                    f.write(',\n')
+                if identifier in columns:
+                    self.write_column(f, columns[identifier])
+                else:
+                    f.write(JSON_INDENT * 2 + json.dumps(dynamic_content_loaded[identifier], ensure_ascii=False,
+                                                         indent=4).replace('\n', '\n' + JSON_INDENT * 2))
+            f.write('\n%s]%s' % (JSON_INDENT, tail))
+
+    def close(self):
+        for f in self.columns:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_job(intents, summary, summary_out_fn, format_as, max_intents=None, dynamic_content_loaded=None, pool=None,
+              nbr_posts=10):
+    with JobWriter(nbr_posts=nbr_posts) as writer:
+        for query_value, post_values, _ in iter_rendered_intents(intents, nbr_posts=nbr_posts, format_as=format_as,
+                                                                 max_intents=max_intents, pool=pool):
+            writer.add(query_value, post_values)
+        writer.write(summary_out_fn, summary, dynamic_content_loaded=dynamic_content_loaded)
+    logging.info('wrote %i intents to %s' % (writer.nbr_values, summary_out_fn))
+
+
+def create_multiple_jobs(intents, summary, summary_out_fn, format_as, max_intents=None, workers=1):
     nbr_words_query_median = median((len(intent[INTENT_TEXT].split()) for intent in intents))
     nbr_words_posts_median = median((intent['nbr_words_relevant'] for intent in intents))
 
@@ -250,29 +370,29 @@ def create_multiple_jobs(intents, summary, summary_out_fn, format_as, max_intent
         else:
             raise AssertionError('This should not happen.')
 
-    dcs = [
-        intents_split_to_dynamicContent(
-            current_intents, nbr_posts=10, format_as=format_as,
-            dynamic_content_loaded={dc['identifier']: dc for dc in summary.get('dynamicContent', {})},
-            max_intents=max_intents
-        ) for current_intents in intents_selected
-    ]
-
-    for i, dc in enumerate(dcs):
-        summary['dynamicContent'] = dc
-        with codecs.open('%s.%i.json' % (summary_out_fn, i+1), 'w', encoding='utf-8') as f:
-            json.dump(summary, f, ensure_ascii=False, indent=4)
-            # f.write(json_string)
-            f.flush()
-
-
-def create_single_job(intents, summary, summary_out_fn, format_as, max_intents=None):
-    summary['dynamicContent'] = intents_split_to_dynamicContent(
-        intents, nbr_posts=10, format_as=format_as, max_intents=max_intents,
-        dynamic_content_loaded={dc['identifier']: dc for dc in summary.get('dynamicContent', {})})
-    with codecs.open(summary_out_fn, 'w', encoding='utf-8') as f:
-        json.dump(summary, f, ensure_ascii=False, indent=4)
-        f.flush()
+    dynamic_content_loaded = {dc['identifier']: dc for dc in summary.get('dynamicContent', {})}
+    # the quartile files are written in parallel, all of them are rendered by the same pool
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        with ThreadPoolExecutor(len(intents_selected)) as executor:
+            futures = [executor.submit(write_job, current_intents, summary, '%s.%i.json' % (summary_out_fn, i + 1),
+                                       format_as, max_intents=max_intents,
+                                       dynamic_content_loaded=dynamic_content_loaded, pool=pool)
+                       for i, current_intents in enumerate(intents_selected)]
+            for future in futures:
+                future.result()
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def create_single_job(intents, summary, summary_out_fn, format_as, max_intents=None, workers=1):
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        write_job(intents, summary, summary_out_fn, format_as, max_intents=max_intents, pool=pool)
+    finally:
+        if pool is not None:
+            pool.terminate()
 
 
 def main(mode: ("create one or multiple jobs", 'positional', None, str, ['single', 'multiple', 'test', 'split']),
@@ -286,7 +406,8 @@ def main(mode: ("create one or multiple jobs", 'positional', None, str, ['single
          whitelist: ("use only intents with these column values", 'option', 'w', str)=None,
          blacklist: ("exclude intents with these column values", 'option', 'b', str)='{"SEGMENTED": ["not-segmented", "", null], "Scrapen?": ["0","",null]}',
          max_intents: ('use only the first m intents', 'option', 'm', int)=None,
-         min_posts: ('min nbr', 'option', 'n', int)=6
+         min_posts: ('min nbr', 'option', 'n', int)=6,
+         workers: ('number of processes that render the intents', 'option', 'j', int)=1
          ):
 
     if mode == 'test':
@@ -312,9 +433,14 @@ def main(mode: ("create one or multiple jobs", 'positional', None, str, ['single
     blacklist = json.loads(blacklist.replace('_', ' '))
     whitelist = json.loads(whitelist.replace('_', ' ')) if whitelist is not None else None
 
-    intents_all = {intent[INTENT_ID]: intent for intent in load_jl(path.join(base_path, intents_all_fn))}
+    intents_tsv = read_tsv(path.join(base_path, tsv_sentences_fn))
+    # load only the intents that are in the sentences file
+    intent_ids = set(intent[INTENT_ID] for intent in intents_tsv)
+    intents_all = {intent_id: intent for intent_id, intent in iter_jl(path.join(base_path, intents_all_fn), key=INTENT_ID)
+                   if intent_id in intent_ids}
+    relevant_index = LinkIndex(intents_all.values(), links_key='relevant_answer_links')
     intents = []
-    for intent in read_tsv(path.join(base_path, tsv_sentences_fn)):
+    for intent in intents_tsv:
         intent_id = intent[INTENT_ID]
         content_segmented = intent[column_split_content]
         if not (content_segmented and content_segmented.strip() and intent_id and intent_id.strip()):
@@ -325,7 +451,7 @@ def main(mode: ("create one or multiple jobs", 'positional', None, str, ['single
             try:
                 # ATTENTION: that might override entries from tsv data!
                 intent.update(intents_all[intent_id])
-                intent[ANSWERS_ALL] = answers_dict_from_intent(intents_all[intent_id])
+                intent[ANSWERS_ALL] = answers_dict_from_intent(intents_all[intent_id], relevant_index)
                 intent[ANSWERS_SPLIT] = answer_from_concat(content_segmented)
                 if len(intent[ANSWERS_SPLIT]) < min_posts:
                     continue
@@ -365,7 +491,7 @@ def main(mode: ("create one or multiple jobs", 'positional', None, str, ['single
         if format_as == FORMAT_PLAIN:
             nbr_posts = 10
             dc = {dc_['identifier']: dc_ for dc_ in intents_split_to_dynamicContent(
-                intents, nbr_posts=nbr_posts, format_as=format_as, max_intents=max_intents)}
+                intents, nbr_posts=nbr_posts, format_as=format_as, max_intents=max_intents, workers=workers)}
 
             intents_plain = []
             for i, intent in enumerate(intents):
@@ -375,9 +501,9 @@ def main(mode: ("create one or multiple jobs", 'positional', None, str, ['single
                 json.dump(intents_plain, f, ensure_ascii=False, indent=4)
                 f.flush()
         else:
-            create_single_job(intents, summary, summary_out_fn, format_as, max_intents)
+            create_single_job(intents, summary, summary_out_fn, format_as, max_intents, workers=workers)
     elif mode == 'multiple':
-        create_multiple_jobs(intents, summary, summary_out_fn, format_as, max_intents)
+        create_multiple_jobs(intents, summary, summary_out_fn, format_as, max_intents, workers=workers)
     else:
         raise AssertionError('This should not happen.')
 